@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный прогон: настоящие хэндлеры dp против локальной подмены Bot API.
+
+N виртуальных пользователей одновременно проходят воронку из рекламного поста:
+  /start → «Моя тема» → тема → карта (🎲)
+Апдейты идут через планировщик (dp.scheduler), как при polling и webhook,
+так что время шага включает ожидание в его очередях.
+Отчёт: пропускная способность, p50/p95/p99 по каждому хэндлеру, и отдельно —
+время операций хранилища (выполнение в потоке SQLite и ожидание в его очереди),
+включая замки на карту (storage._set_last_draw). Так изменения хранилища сравниваются цифрами.
+
+  python bench.py --users 500 --api-latency 30
+  python bench.py --users 2000 --ramp 5 --json bench_output.json
+  python bench.py --users 300 --outbound-rate 30 --flood 0.05   # лимиты Telegram и 429
+
+База и файлы создаются во временной папке, рабочая subscribers.db не трогается.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import importlib
+import statistics
+from pathlib import Path
+from collections import defaultdict
+
+from fake_telegram import FakeTelegram, make_message, make_callback
+
+FUNNEL = (
+    ("cmd_start", lambda uid, topic: make_message(uid, "/start")),
+    ("choose_topic", lambda uid, topic: make_message(uid, "Моя тема")),
+    ("topic_router", lambda uid, topic: make_callback(uid, f"t:{topic}")),
+    ("card_choice", lambda uid, topic: make_callback(uid, f"c:{topic}:rand")),
+)
+TOPICS = ("think", "money", "talent")
+USER_ID_BASE = 10_000_000
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50/p95/p99 в миллисекундах."""
+    if not samples:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    if len(samples) == 1:
+        q = [samples[0]] * 99
+    else:
+        q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"n": len(samples), "p50": q[49] * 1000, "p95": q[94] * 1000, "p99": q[98] * 1000}
+
+
+def load_bot(api_url: str, workdir: Path, outbound_rate: float = 0.0):
+    """Импортировать bot.py, направив его в fake API и во временную папку."""
+    os.environ.update({
+        "OUTBOUND_RATE": str(outbound_rate),
+        "BOT_TOKEN": "123456:BENCH",
+        "TELEGRAM_API_URL": api_url,
+        "DB_PATH": str(workdir / "bench.db"),
+        "USAGE_FILE": str(workdir / "usage.json"),
+        "ARCHIVE_DIR": str(workdir / "archive"),
+        "BOT_MODE": "polling",
+    })
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    bot = importlib.import_module("bot")
+    logging.getLogger().setLevel(logging.WARNING)
+    return bot
+
+
+async def run(args) -> dict:
+    fake = FakeTelegram(latency=args.api_latency / 1000, flood_rate=args.flood)
+    await fake.start()
+    workdir = Path(tempfile.mkdtemp(prefix="clarity-bench-"))
+    bot = load_bot(fake.base_url, workdir, args.outbound_rate)
+    app = bot.APPS[0]
+    from aiogram import types
+
+    handler_times: dict[str, list[float]] = defaultdict(list)
+    op_exec: dict[str, list[float]] = defaultdict(list)
+    op_wait: dict[str, list[float]] = defaultdict(list)
+    queued: dict[str, list[float]] = defaultdict(list)
+    retries = 0
+
+    def on_op(name: str, wait: float, exec_: float):
+        op_wait[name].append(wait)
+        op_exec[name].append(exec_)
+
+    def on_retry(method: str, reason: str):
+        nonlocal retries
+        retries += 1
+
+    app.storage.on_op = on_op
+    app.outbound.on_queued = lambda priority, seconds: queued[priority].append(seconds)
+    app.outbound.on_retry = on_retry
+    await bot.on_startup()
+
+    # апдейт обрабатывается в воркере планировщика — ждём его завершения по update_id
+    done: dict[int, asyncio.Future] = {}
+    process_update = app.dp.process_update
+
+    async def tracked_process_update(update):
+        try:
+            return await process_update(update)
+        finally:
+            fut = done.pop(update.update_id, None)
+            if fut is not None:
+                fut.set_result(None)
+    app.dp.process_update = tracked_process_update
+
+    async def virtual_user(i: int):
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        uid = USER_ID_BASE + i
+        topic = random.choice(TOPICS)
+        for handler, make in FUNNEL:
+            update = types.Update(**make(uid, topic))
+            finished = done[update.update_id] = asyncio.get_running_loop().create_future()
+            t0 = time.perf_counter()
+            await app.dp.scheduler.put(update)
+            await finished
+            handler_times[handler].append(time.perf_counter() - t0)
+            if args.think:
+                await asyncio.sleep(random.uniform(0, args.think / 1000))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+    errors = app.dp.scheduler.errors
+
+    await bot.on_shutdown()   # закрывает и HTTP-сессию
+    await fake.close()
+
+    updates = sum(len(v) for v in handler_times.values())
+    return {
+        "users": args.users,
+        "updates": updates,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "updates_per_s": updates / elapsed if elapsed else 0.0,
+        "api_calls": len(fake.calls),
+        "api_429": fake.floods,
+        "outbound_retries": retries,
+        "outbound_queue": {p: percentiles(v) for p, v in queued.items()},
+        "handlers": {h: percentiles(handler_times[h]) for h, _ in FUNNEL},
+        "storage": {
+            name: {"exec": percentiles(op_exec[name]), "wait": percentiles(op_wait[name]),
+                   "total_exec_s": sum(op_exec[name])}
+            for name in sorted(op_exec)
+        },
+    }
+
+
+def print_report(r: dict):
+    print(f"Пользователей: {r['users']}, апдейтов: {r['updates']}, ошибок: {r['errors']}, "
+          f"вызовов API: {r['api_calls']}")
+    print(f"Время: {r['elapsed_s']:.2f} с, пропускная способность: {r['updates_per_s']:.1f} апд/с")
+    print(f"Ответов 429: {r['api_429']}, повторов отправки: {r['outbound_retries']}")
+    for p, q in r["outbound_queue"].items():
+        print(f"Очередь исходящих ({p}): p50 {q['p50']:.2f} мс, p95 {q['p95']:.2f} мс, p99 {q['p99']:.2f} мс")
+    print()
+    print(f"{'хэндлер':<16}{'n':>7}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for h, p in r["handlers"].items():
+        print(f"{h:<16}{p['n']:>7}{p['p50']:>10.2f}{p['p95']:>10.2f}{p['p99']:>10.2f}")
+    print(f"\n{'хранилище':<28}{'n':>7}{'всего с':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'очередь p95':>13}")
+    for name, s in r["storage"].items():
+        e = s["exec"]
+        print(f"{name:<28}{e['n']:>7}{s['total_exec_s']:>9.3f}{e['p50']:>9.2f}{e['p95']:>9.2f}"
+              f"{e['p99']:>9.2f}{s['wait']['p95']:>13.2f}")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Нагрузочный прогон воронки /start → тема → карта")
+    p.add_argument("--users", type=int, default=200, help="виртуальных пользователей")
+    p.add_argument("--ramp", type=float, default=1.0, help="за сколько секунд приходят все пользователи")
+    p.add_argument("--think", type=float, default=0.0, help="пауза между шагами, мс (случайная до)")
+    p.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа fake API, мс")
+    p.add_argument("--outbound-rate", type=float, default=0.0,
+                   help="общий лимит исходящих, сообщений/с (0 — без лимита, как у fake API)")
+    p.add_argument("--flood", type=float, default=0.0, help="доля отправок, на которые fake API отвечает 429")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--json", metavar="PATH", help="сохранить результат в JSON для сравнения прогонов")
+    args = p.parse_args()
+    random.seed(args.seed)
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), "utf-8")
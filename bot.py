@@ -8,34 +8,83 @@ Clarity Bot — стабильная версия с твоими текстам
   • /start с приветствием и фото + КНОПКИ (reply): «Моя тема», «О консультации», «Канал»
   • приглашение подписаться показывается ТОЛЬКО ОДИН РАЗ (consent_shown)
   • /subscribe и /unsubscribe
+  • анти-флуд: лишние нажатия кнопок отсекаются до хранилища (throttle.py)
+  • /broadcast — рассылка подписчикам (только владелец), с продолжением после падения
   • «Моя тема» → 3 темы → 6 вариантов: 5 твоих + 6-я «случайная из этих 5»
-  • «замок» на 7 дней на получение карты (usage.json)
-  • логирование событий в SQLite (users/events)
-  • авто-починка недостающих колонок (subscribe_flag, consent_shown) в users
+    (тексты в decks.json, правки подхватываются без перезапуска)
+  • «замок» на 7 дней на получение карты (таблица card_locks; старый usage.json импортируется при старте)
+  • схема базы — версионные миграции по PRAGMA user_version при старте (migrations.py)
+  • логирование событий в SQLite (users/events): одно WAL-соединение в отдельном потоке (storage.py),
+    события пишутся пачками в фоне (journal.py)
+  • несколько webhook-воркеров: общее состояние в Redis (state.py, redis_state.py)
+  • планировщик апдейтов: по очереди на пользователя, общий лимит параллельности (scheduler.py)
+  • все отправки — через очередь с лимитами Telegram и приоритетом ответов над рассылкой (outbound.py)
+  • подписчикам — напоминание, когда замок истёк и доступна новая карта (reminders.py)
+  • старые события — в сжатый архив по дням, /stats считает по-прежнему всё (retention.py)
+  • выгрузка users/events в CSV, JSON Lines, Parquet для аналитики (export.py)
+  • несколько брендированных копий бота в одном процессе (BOTS_FILE, tenants.py)
 
 Переменные окружения в .env:
   BOT_TOKEN=...
   TELEGRAM_CHANNEL_LINK=https://t.me/annap_club
-  OWNER_USERNAME=@AnnaPClub
+  OWNER_USERNAME=@AnnaPClub     # /stats и /broadcast; пустой — /broadcast не доступен никому
+  BOT_MODE=polling            # или webhook
+  WEBHOOK_URL=https://bot.example.com/webhook   # для BOT_MODE=webhook
+  WEBHOOK_SECRET=...          # сверяется с X-Telegram-Bot-Api-Secret-Token
+  WEBAPP_HOST=0.0.0.0
+  WEBAPP_PORT=8080
+  TELEGRAM_API_URL=           # свой Bot API сервер (или fake_telegram.py для проверок)
+  DECKS_FILE=decks.json       # тексты карт, CTA и замка
+  DB_PATH=subscribers.db      # база пользователей и событий
+  METRICS_PORT=9101           # /metrics на 127.0.0.1 (METRICS_HOST), 0 — выключено
+  STATE_BACKEND=sqlite        # или redis — для нескольких воркеров
+  REDIS_URL=redis://127.0.0.1:6379/0
+  STATE_SINK=1                # ровно один воркер: переносит данные из Redis в SQLite,
+                              # на нём /stats, /broadcast и рассылки
+  MAX_CONCURRENT_UPDATES=64   # сколько апдейтов (разных пользователей) обрабатываются одновременно
+  MAX_PENDING_UPDATES=5000    # больше в очереди — webhook отвечает 503, polling ждёт
+  OUTBOUND_RATE=30            # исходящих сообщений в секунду на бота, 0 — без общего лимита
+  REMINDERS=1                 # 0 — не напоминать подписчикам о новой карте
+  EVENTS_KEEP_DAYS=180        # events старше — в архив (ARCHIVE_DIR=archive), 0 — хранить всё в базе
+  BOTS_FILE=bots.json         # несколько ботов: токен, канал, владелец, колода, база — у каждого свои;
+                              # тогда BOT_TOKEN, TELEGRAM_CHANNEL_LINK, OWNER_USERNAME, DECKS_FILE, DB_PATH
+                              # не нужны, webhook каждого — на WEBHOOK_URL с путём /webhook/<name>
+  STORAGE_THREADS=2           # потоков SQLite на все базы процесса
 """
 
 import os
-import json
-import random
+import signal
+import asyncio
 import logging
-import time
 from pathlib import Path
-from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 from aiogram import Bot, Dispatcher, types
-from aiogram.utils import executor
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.types import (
     InlineKeyboardMarkup, InlineKeyboardButton,
     ReplyKeyboardMarkup, KeyboardButton
 )
 from aiogram.dispatcher.filters import Text
 from dotenv import load_dotenv
-import sqlite3
+
+from storage import Storage
+from scheduler import SchedulingDispatcher
+from outbound import OutboundQueue
+from redis_state import RedisBackend, SyncSink
+from journal import EventJournal
+from usercache import UserCache
+from locks import CardLocks
+from media import MediaCache
+from broadcast import Broadcaster
+from reminders import Reminders
+from retention import Retention
+from stats import WINDOWS
+from decks import DeckRegistry
+from tenants import BotConfig, SharedResources, load_bots
+import webhook
+import metrics
+from throttle import ThrottleMiddleware
 
 # ---------- ЛОГИ ----------
 logging.basicConfig(
@@ -48,17 +97,54 @@ BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(dotenv_path=BASE_DIR / ".env")
 
 TOKEN = os.getenv("BOT_TOKEN")
+BOTS_FILE = os.getenv("BOTS_FILE", "").strip()                       # несколько ботов в одном процессе
 CHANNEL_LINK = os.getenv("TELEGRAM_CHANNEL_LINK", "https://t.me/your_channel").strip()
 OWNER_USERNAME = (os.getenv("OWNER_USERNAME", "@your_username") or "").strip()
-USAGE_FILE = BASE_DIR / "usage.json"          # замок на 7 дней
-DB_PATH = BASE_DIR / "subscribers.db"         # база рассылки и событий
-
-if not TOKEN:
+USAGE_FILE = Path(os.getenv("USAGE_FILE", BASE_DIR / "usage.json"))    # старый файл замков, импортируется в базу при старте
+DB_PATH = Path(os.getenv("DB_PATH", BASE_DIR / "subscribers.db"))       # база рассылки и событий
+DECKS_FILE = Path(os.getenv("DECKS_FILE", BASE_DIR / "decks.json"))   # тексты карт, CTA, замок
+
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()   # polling | webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "").strip()          # по умолчанию — путь из WEBHOOK_URL
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip() or None
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").strip()
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)              # 0 — не поднимать /metrics
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").strip().lower()  # sqlite | redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0").strip()
+STATE_SINK = os.getenv("STATE_SINK", "0").strip() == "1"
+# здесь полная SQLite: /stats, /broadcast и продолжение рассылок
+PRIMARY = STATE_BACKEND == "sqlite" or STATE_SINK
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "5000"))
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "30"))
+REMINDERS = os.getenv("REMINDERS", "1").strip() == "1"
+EVENTS_KEEP_DAYS = int(os.getenv("EVENTS_KEEP_DAYS", "180") or 0)
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", BASE_DIR / "archive"))
+STORAGE_THREADS = int(os.getenv("STORAGE_THREADS", "2"))
+
+if not TOKEN and not BOTS_FILE:
     raise RuntimeError("Нет токена. Откройте .env и пропишите BOT_TOKEN=...")
-
-# ---------- БОТ ----------
-bot = Bot(token=TOKEN, parse_mode="HTML", timeout=120)
-dp = Dispatcher(bot)
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError("BOT_MODE должен быть polling или webhook.")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise RuntimeError("Для BOT_MODE=webhook пропишите WEBHOOK_URL=https://.../webhook")
+if STATE_BACKEND not in ("sqlite", "redis"):
+    raise RuntimeError("STATE_BACKEND должен быть sqlite или redis.")
+
+# ---------- НАСТРОЙКИ БОТОВ ----------
+if BOTS_FILE:
+    CONFIGS = load_bots(Path(BOTS_FILE), ARCHIVE_DIR)
+else:
+    # один бот из .env: прежние пути, ключи Redis и webhook
+    CONFIGS = [BotConfig(
+        name=None, token=TOKEN, channel_link=CHANNEL_LINK, owner_username=OWNER_USERNAME,
+        decks_file=DECKS_FILE, db_path=DB_PATH, usage_file=USAGE_FILE, archive_dir=ARCHIVE_DIR,
+        webhook_path=WEBHOOK_PATH or urlsplit(WEBHOOK_URL).path or "/",
+    )]
 
 # ---------- ТЕКСТЫ ----------
 WELCOME = (
@@ -74,25 +160,16 @@ CONSENT_TEXT = (
     "Ты всегда сможешь отписаться командой /unsubscribe."
 )
 
-CTA_TAIL = (
-    f"\n\nПодписывайся на канал: {CHANNEL_LINK}\n\n"
-    f"🎁 Напиши слово «ЯСНОСТЬ» в профиль {OWNER_USERNAME} — и получи скидку <b>50%</b> на первый разбор. "
-    "Действует для новых клиентов. <b>18+</b>"
-)
-
-LOCK_TEXT = (
-    "«Карта ясности» доступна <b>1 раз в неделю</b> — чтобы не зациклиться на переспрашивании и сохранить ценность первого взгляда. "
-    "Пока идёт ожидание, в канале тебя уже ждут расклады, короткие практики и разборы — они помогают держать курс каждый день.\n\n"
-    f"Загляни: {CHANNEL_LINK}\n\n"
-    f"🎁 Не хочешь ждать и нужен личный разбор со <b>скидкой 50%</b>? Напиши слово «ЯСНОСТЬ» в профиль {OWNER_USERNAME}. "
-    "Скидка 50% действует для новых клиентов. <b>18+</b>"
-)
-
 ABOUT_TEXT = (
     "Форматы: Таро / Нумерология / Астрология — фокус на твоих запросах.\n"
     "Что получишь: честные ответы на все волнующие тебя вопросы. "
     "Я рядом, чтобы помочь услышать, как хочешь жить именно ты 💚.\n\n"
-    f"💬 Напиши «ЯСНОСТЬ» {OWNER_USERNAME} — подскажу формат и время. <b>18+</b>"
+    "💬 Напиши «ЯСНОСТЬ» {owner} — подскажу формат и время. <b>18+</b>"
+)
+
+REMINDER_TEXT = (
+    "Новая карта уже доступна 🌗 Выбирай тему:\n\n"
+    "<i>Не хочешь таких напоминаний — /unsubscribe</i>"
 )
 
 # ---------- КЛАВИАТУРЫ ----------
@@ -105,357 +182,251 @@ KB_MAIN = ReplyKeyboardMarkup(resize_keyboard=True)
 KB_MAIN.row(KeyboardButton("Моя тема"))
 KB_MAIN.row(KeyboardButton("О консультации"), KeyboardButton("Канал"))
 
-# Inline-кнопки с темами
-TOPICS_KB = InlineKeyboardMarkup(row_width=1)
-TOPICS_KB.add(
-    InlineKeyboardButton("Что он(а) думает обо мне?", callback_data="t:think"),
-    InlineKeyboardButton("Как зарабатывать больше?", callback_data="t:money"),
-    InlineKeyboardButton("Мой скрытый талант", callback_data="t:talent"),
-)
-
-# --- Клавиатура выбора карты 1–5 + 🎲 ---
-def build_cards_kb(topic: str) -> InlineKeyboardMarkup:
-    kb = InlineKeyboardMarkup(row_width=3)
-    kb.add(
-        InlineKeyboardButton("1", callback_data=f"c:{topic}:1"),
-        InlineKeyboardButton("2", callback_data=f"c:{topic}:2"),
-        InlineKeyboardButton("3", callback_data=f"c:{topic}:3"),
-        InlineKeyboardButton("4", callback_data=f"c:{topic}:4"),
-        InlineKeyboardButton("5", callback_data=f"c:{topic}:5"),
-    )
-    kb.add(InlineKeyboardButton("🎲 Случайная", callback_data=f"c:{topic}:rand"))
-    kb.add(InlineKeyboardButton("⬅️ Назад к темам", callback_data="t:menu"))
-    return kb
-
 BACK_TO_MENU_KB = InlineKeyboardMarkup().add(
     InlineKeyboardButton("Назад к темам", callback_data="t:menu")
 )
 
-# ---------- SQLite: схема и авто-починка ----------
-def db_init():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-
-    # Базовые таблицы
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id        INTEGER PRIMARY KEY,
-            username       TEXT,
-            first_name     TEXT,
-            last_name      TEXT,
-            first_seen_ts  INTEGER,
-            last_seen_ts   INTEGER
-        )
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS events (
-            id          INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id     INTEGER,
-            event_type  TEXT,
-            ts          INTEGER,
-            meta        TEXT
-        )
-    """)
-
-    # Добавляем недостающие колонки, если база старая
-    cur.execute("PRAGMA table_info(users)")
-    cols = {row[1] for row in cur.fetchall()}
-    if "subscribe_flag" not in cols:
-        cur.execute("ALTER TABLE users ADD COLUMN subscribe_flag INTEGER DEFAULT 0")
-    if "consent_shown" not in cols:
-        cur.execute("ALTER TABLE users ADD COLUMN consent_shown INTEGER DEFAULT 0")
-
-    conn.commit()
-    conn.close()
-
-def log_event(user_id: int, event_type: str, meta: str | None = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO events (user_id, event_type, ts, meta) VALUES (?,?,?,?)",
-        (user_id, event_type, int(time.time()), meta)
-    )
-    conn.commit()
-    conn.close()
-
-def upsert_user(u: types.User, subscribe_flag: int | None = None, consent_shown: int | None = None):
-    """Вставляет или обновляет пользователя + last_seen_ts."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM users WHERE user_id=?", (u.id,))
-    row = cur.fetchone()
-    now = int(time.time())
-
-    if row:
-        sets = ["last_seen_ts=?"]
-        args = [now]
-        if subscribe_flag is not None:
-            sets.append("subscribe_flag=?")
-            args.append(int(subscribe_flag))
-        if consent_shown is not None:
-            sets.append("consent_shown=?")
-            args.append(int(consent_shown))
-        sets_str = ", ".join(sets)
-        args.append(u.id)
-        cur.execute(f"UPDATE users SET {sets_str} WHERE user_id=?", args)
-    else:
-        cur.execute("""
-            INSERT INTO users (user_id, username, first_name, last_name,
-                               first_seen_ts, last_seen_ts, subscribe_flag, consent_shown)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            u.id, u.username, u.first_name, u.last_name,
-            now, now,
-            int(subscribe_flag or 0), int(consent_shown or 0)
-        ))
-    conn.commit()
-    conn.close()
-
-def get_user_flags(user_id: int) -> tuple[int, int]:
-    """Возвращает (subscribe_flag, consent_shown). Если пользователя ещё нет — (0,0)."""
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT subscribe_flag, consent_shown FROM users WHERE user_id=?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row:
-        return (0, 0)
-    return int(row[0] or 0), int(row[1] or 0)
-
-# ---------- «Замок» на 7 дней ----------
 LOCK_DAYS = 7
+WELCOME_PHOTO = BASE_DIR / "welcome.jpg"
 
-def _load_usage() -> dict:
-    if not USAGE_FILE.exists():
-        return {}
-    try:
-        return json.loads(USAGE_FILE.read_text("utf-8"))
-    except Exception:
-        return {}
-
-def _save_usage(data: dict):
-    # Чиним полностью битый usage.json (если кто-то записал не-словарь)
-    if not isinstance(data, dict):
-        data = {}
-    USAGE_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), "utf-8")
-
-def can_draw_card(user_id: int) -> tuple[bool, str | None]:
-    """
-    Возвращает (можно_ли, когда_можно_снова).
-    Поддерживает старый формат usage.json (строка) и мигрирует его в новый.
-    """
-    data = _load_usage()
-    uid = str(user_id)
-    rec = data.get(uid)
-    if not rec:
-        return True, None
-
-    # старый формат: rec == "2025-10-01T04:20:33"
-    if isinstance(rec, str):
-        try:
-            last_ts = datetime.fromisoformat(rec)
-        except Exception:
-            return True, None
-        # мигрируем в новый формат
-        data[uid] = {"last_draw": rec}
-        _save_usage(data)
-    else:
-        # новый формат: {"last_draw": "..."}
-        try:
-            last_ts = datetime.fromisoformat(rec.get("last_draw", ""))
-        except Exception:
-            return True, None
-
-    if datetime.now() - last_ts >= timedelta(days=LOCK_DAYS):
-        return True, None
-    next_time = last_ts + timedelta(days=LOCK_DAYS)
-    return False, next_time.strftime("%d.%m %H:%M")
-
-
-def mark_card_drawn(user_id: int):
-    data = _load_usage()
-    data[str(user_id)] = {"last_draw": datetime.now().isoformat(timespec="seconds")}
-    _save_usage(data)
-
-
-# ---------- КОНТЕНТ КАРТ (твои тексты) ----------
-DECKS: dict[str, dict[str, str]] = {
-    "think": {
-        "1": (
-            "<b>Ответ:</b> интерес есть, но человек осторожничает. 😊\n"
-            "<b>Шаг:</b> сделай лёгкий контакт без давления: короткое сообщение «Как ты?» — без разговоров «кто мы».\n"
-            "«Когда рядом спокойно — чувства сами выбирают оставаться.»"
-        ),
-        "2": (
-            "<b>Ответ:</b> видит в тебе опору, но боится раскрыться. 💛\n"
-            "<b>Шаг:</b> скажи или напиши: «Мне тепло, когда мы общаемся чаще» и после предложи провести время вдвоём.\n"
-            "«Безопасность открывает двери мягче любых слов.»"
-        ),
-        "3": (
-            "<b>Ответ:</b> симпатия есть, но сравнивает и сомневается. 🤔\n"
-            "<b>Шаг:</b> запиши 3 факта своей ценности (дела, а не ярлыки) и прояви один из них в следующем общении.\n"
-            "«Ясность о себе делает чужие сомнения тише.»"
-        ),
-        "4": (
-            "<b>Ответ:</b> восхищается твоей самостоятельностью, боится «не дотянуть». ✨\n"
-            "<b>Шаг:</b> попроси о маленькой помощи по делу: «Подскажешь, как выбрать…?» — это сокращает дистанцию.\n"
-            "«Сила притягивает, когда в ней есть место для другого.»"
-        ),
-        "5": (
-            "<b>Ответ:</b> чувства есть, но сейчас перегружен(-а) делами. 🌧️\n"
-            "<b>Шаг:</b> выбери формат «лёгкий контакт 48 часов»: короткие тёплые касания без серьёзных тем.\n"
-            "«Иногда лучший шаг — мягкий шаг.»"
-        ),
-    },
-    "money": {
-        "1": (
-            "<b>Ответ:</b> главный стоп — расфокус. 📌\n"
-            "<b>Шаг:</b> один денежный шаг на сегодня: закрыть один счёт, отправить 3 отклика, созвониться по подработке — доведи до конца.\n"
-            "«Фокус — ускоритель дохода.»"
-        ),
-        "2": (
-            "<b>Ответ:</b> занижена собственная ценность. 💼\n"
-            "<b>Шаг:</b> прибавь +10–15% к цене/ставке или попроси надбавку: «Готов(а) брать больше задач, прошу пересмотреть оплату до ___».\n"
-            "«Деньги идут туда, где себя ценят.»"
-        ),
-        "3": (
-            "<b>Ответ:</b> не видно твою пользу (дело не в навыках). 🔎\n"
-            "<b>Шаг:</b> попроси у 2 людей конкретную обратную связь: «Что со мной особенно удобно? Что я делаю лучше всего?» — добавь это в резюме/диалоги.\n"
-            "«Стань видим(ой) там, где ты уже полезен(на).»"
-        ),
-        "4": (
-            "<b>Ответ:</b> деньги упираются в хаос. 📒\n"
-            "<b>Шаг:</b> «финансовые 20 минут» сегодня: выписка доходов/расходов → один перевод/хвост → 1 план на неделю.\n"
-            "«Порядок — уважение к своему потоку.»"
-        ),
-        "5": (
-            "<b>Ответ:</b> растёшь в одиночку — потолок близко. 🤝\n"
-            "<b>Шаг:</b> предложи знакомому(ой) простое взаимовыгодное дело: «Давай вместе возьмём маленький проект/смену» или обмен навыками.\n"
-            "«Доход любит партнёрства.»"
-        ),
+# (токенов в секунду, ёмкость): лишние нажатия не доходят до замков и SQLite (throttle.py)
+THROTTLE_LIMITS = dict(
+    callback_limits={
+        "c:": (1 / 5, 2),     # карта: 2 нажатия подряд, дальше одно в 5 с
+        "t:": (1.0, 5),       # темы и «назад»
     },
-    "talent": {
-        "1": (
-            "<b>Ответ:</b> объясняешь сложное просто. 💡\n"
-            "<b>Шаг:</b> выбери одну тему и объясни её близкому за 3–5 минут простыми словами; проверь, что понял(а).\n"
-            "«Быть понятным — редкий дар.»"
-        ),
-        "2": (
-            "<b>Ответ:</b> соединяешь людей и идеи. 🌉\n"
-            "<b>Шаг:</b> познакомь двух знакомых, которым полезно встретиться, и кратко напиши — чем они могут помочь друг другу.\n"
-            "«Там, где ты — появляются мосты.»"
-        ),
-        "3": (
-            "<b>Ответ:</b> тонкое чувство вкуса/нюанса. 🎨\n"
-            "<b>Шаг:</b> сделай «выбор дня»: одна вещь/мысль/музыка — и 2 предложения, почему это работает для тебя.\n"
-            "«Чувствительность — сила, когда у неё есть форма.»"
-        ),
-        "4": (
-            "<b>Ответ:</b> видишь стратегию и шаги. 🧭\n"
-            "<b>Шаг:</b> распиши одну цель в 3 шага на 7 дней (шаги должны быть измеримы) и сделай первый сегодня.\n"
-            "«Путь короче, когда виден план.»"
-        ),
-        "5": (
-            "<b>Ответ:</b> собираешь смысл из хаоса. 🔦\n"
-            "<b>Шаг:</b> выбери запутанную тему и сформулируй её суть в 5 предложениях — для себя.\n"
-            "«Смысл — свет, который ты умеешь включать.»"
-        ),
+    message_limits={
+        "Моя тема": (1 / 2, 3),
+        "/start": (1 / 10, 3),
     },
-}
+    default_limit=(1.0, 10),
+)
 
-def build_card_text(topic: str) -> str:
+
+class ClarityApp:
     """
-    Возвращает ОДНУ карту.
-    6 вариантов = 5 фиксированных твоих текстов + 1 «случайная из этих же 5».
-    Никаких чужих формулировок — только твои.
+    Один бот со всем своим состоянием. Хэндлеры общие для всех ботов процесса
+    и находят свой экземпляр через current_app().
     """
-    t = topic if topic in DECKS else "think"
-    base_texts = list(DECKS[t].values())  # ровно 5
 
-    idx = random.randrange(6)
-    if idx == 5:
-        chosen = random.choice(base_texts)   # «шестая» — случайная из этих же 5
-    else:
-        chosen = base_texts[idx]             # одна из пяти фиксированных
+    def __init__(self, cfg: BotConfig, shared: SharedResources):
+        self.cfg = cfg
+        self.owner_username = cfg.owner_username
+        self.channel_link = cfg.channel_link
+        self.about_text = ABOUT_TEXT.format(owner=cfg.owner_username)
 
-    return chosen + CTA_TAIL
+        # ---------- бот ----------
+        self.bot = Bot(
+            token=cfg.token, parse_mode="HTML", timeout=120,
+            server=TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else TELEGRAM_PRODUCTION,
+        )
+        shared.add_bot(self.bot)   # HTTP-сессия к Bot API — одна на процесс
+        # апдейты идут через планировщик: по очереди на пользователя, не больше
+        # MAX_CONCURRENT_UPDATES одновременно, очередь ограничена (scheduler.py)
+        self.dp = SchedulingDispatcher(self.bot, scheduler_options={
+            "max_concurrency": MAX_CONCURRENT_UPDATES,
+            "max_pending": MAX_PENDING_UPDATES,
+        })
+        self.dp["app"] = self
+        register_handlers(self.dp)
+
+        # ---------- SQLite: пользователи и события ----------
+        # одно WAL-соединение в потоке хранилища (поток может быть общим с другими ботами), см. storage.py;
+        # схема — миграциями при старте; usage.json переносится в card_locks, если замки в SQLite
+        self.storage = Storage(cfg.db_path, usage_file=cfg.usage_file if STATE_BACKEND == "sqlite" else None,
+                               executor=shared.storage_executor())
+
+        # ---------- общее состояние: SQLite или Redis (state.py) ----------
+        if STATE_BACKEND == "redis":
+            self.state = RedisBackend(REDIS_URL, prefix=cfg.redis_prefix, client=shared.redis(REDIS_URL))
+            # один воркер переносит события/пользователей/замки из Redis в свою SQLite
+            self.sync_sink = SyncSink(self.state, self.storage, on_update=self.process_forwarded) \
+                if STATE_SINK else None
+        else:
+            self.state = self.storage
+            self.sync_sink = None
+        # повторы update_id бывают только у webhook (Telegram повторяет доставку, воркеров несколько)
+        self.dp.scheduler.state = self.state if BOT_MODE == "webhook" else None
+        # события копятся в памяти и пишутся пачками, см. journal.py
+        self.journal = EventJournal(self.state)
+        # флаги пользователей из памяти, last_seen_ts — не чаще раза в минуту (usercache.py)
+        self.users = UserCache(self.state)
+        # «замок» на 7 дней: card_locks (или ключи Redis) + кэш в памяти, см. locks.py
+        self.card_locks = CardLocks(self.state, LOCK_DAYS)
+        # файл грузится в Telegram один раз, дальше шлём по file_id (media.py)
+        self.media = MediaCache(self.storage)
+        # курсор по подписчикам, лимиты Telegram, чекпоинты (broadcast.py)
+        self.broadcaster = Broadcaster(self.bot, self.storage)
+
+        # ---------- напоминания о новой карте ----------
+        # таймеры в памяти, восстанавливаются из card_locks при старте (reminders.py);
+        # нужна полная SQLite — только на PRIMARY
+        self.reminders = Reminders(self.storage, self.journal, self.card_locks.lock_seconds, self.send_reminder) \
+            if REMINDERS and PRIMARY else None
+        if self.reminders and self.sync_sink:
+            self.sync_sink.on_lock = self.reminders.schedule   # карты, выданные любым воркером
+        elif self.reminders:
+            self.card_locks.on_acquire = self.reminders.schedule
+
+        # ---------- архив событий ----------
+        # events старше EVENTS_KEEP_DAYS — в archive_dir/ГГГГ-ММ/events-*.jsonl.gz (retention.py)
+        self.retention = Retention(self.storage, cfg.archive_dir, EVENTS_KEEP_DAYS) \
+            if EVENTS_KEEP_DAYS and PRIMARY else None
+
+        # ---------- анти-флуд ----------
+        self.throttle = ThrottleMiddleware(**THROTTLE_LIMITS)
+        self.dp.middleware.setup(self.throttle)
+
+        # ---------- метрики ----------
+        # хэндлеры, хранилище, Bot API; /metrics — один на процесс, сумма по ботам (metrics.py)
+        metrics.setup(self.dp, self.storage)
+
+        # ---------- исходящие ----------
+        # все отправки бота — через одну очередь: лимиты Telegram, приоритеты, повторы (outbound.py);
+        # лимиты Telegram — на токен, так что очередь у каждого бота своя;
+        # ставится после metrics.setup, чтобы в clarity_telegram_* попадал каждый реальный вызов
+        self.outbound = OutboundQueue(global_rate=OUTBOUND_RATE)
+        self.outbound.install(self.bot)
+        metrics.instrument_outbound(self.outbound)
+
+        # ---------- контент карт ----------
+        # колоды, CTA и текст замка — в decks.json; проверяются при загрузке,
+        # перечитываются на лету при изменении файла (decks.py)
+        self.decks = DeckRegistry(cfg.decks_file, cfg.channel_link, cfg.owner_username)
+        self.decks.load()
+
+    async def send_reminder(self, user_id: int):
+        await self.bot.send_message(user_id, REMINDER_TEXT, reply_markup=self.decks.current.topics_kb)
+
+    async def process_forwarded(self, update: dict):
+        """Админ-команда, пересланная другим воркером (см. forwarded_to_primary)."""
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.bot)
+        await self.dp.process_update(types.Update(**update))
+
+    async def forwarded_to_primary(self) -> bool:
+        """Не здесь полная SQLite — отдаём текущий апдейт воркеру с STATE_SINK=1."""
+        if PRIMARY:
+            return False
+        await self.state.forward_update(types.Update.get_current().to_python())
+        return True
+
+    def is_owner(self, m: types.Message) -> bool:
+        owner = self.owner_username
+        return not owner or f"@{(m.from_user.username or '').lower()}" == owner.lower()
+
+    async def startup(self):
+        await self.storage.open()
+        if self.state is not self.storage:
+            await self.state.open()
+            if self.cfg.usage_file:
+                await self.card_locks.import_legacy(self.cfg.usage_file)
+        await self.media.load()
+        self.journal.start()
+        if self.sync_sink:
+            await self.sync_sink.start()
+        self.decks.start()
+        if self.reminders:
+            await self.reminders.start()
+        if self.retention:
+            self.retention.start()
+        if PRIMARY:
+            await self.broadcaster.resume_pending()
+
+    async def shutdown(self):
+        await self.dp.scheduler.close(webhook.DRAIN_TIMEOUT)   # дорабатываем принятые апдейты
+        await self.decks.close()
+        await self.broadcaster.close()   # прогресс сохранён, продолжится при следующем старте
+        if self.reminders:
+            await self.reminders.close()
+        await self.outbound.close(webhook.DRAIN_TIMEOUT)
+        if self.retention:
+            await self.retention.close()
+        await self.journal.close()   # сначала дописываем буфер событий
+        if self.sync_sink:
+            await self.sync_sink.close()
+        if self.state is not self.storage:
+            await self.state.close()
+        await self.storage.close()
+
+
+def current_app() -> ClarityApp:
+    """Бот, чей апдейт сейчас обрабатывается."""
+    return Dispatcher.get_current()["app"]
 
 # ---------- ХЭНДЛЕРЫ ----------
-@dp.message_handler(commands=['start'])
 async def cmd_start(m: types.Message):
-    db_init()
-    upsert_user(m.from_user, subscribe_flag=0)
-    log_event(m.from_user.id, "start")
+    app = current_app()
+    # upsert + отметка consent_shown — одна транзакция
+    show_consent = await app.users.start_user(m.from_user)
+    await app.journal.log(m.from_user.id, "start")
 
     # привет + фото
-    photo_path = BASE_DIR / "welcome.jpg"
     try:
-        with open(photo_path, "rb") as photo:
-            await m.answer_photo(photo, caption=WELCOME, reply_markup=KB_MAIN)
+        await app.media.send(m, WELCOME_PHOTO, caption=WELCOME, reply_markup=KB_MAIN)
     except FileNotFoundError:
         await m.answer(WELCOME, reply_markup=KB_MAIN)
 
     # ПРИГЛАШЕНИЕ К РАССЫЛКЕ — ТОЛЬКО ОДИН РАЗ
-    sub_flag, consent_shown = get_user_flags(m.from_user.id)
-    if consent_shown == 0:
-        upsert_user(m.from_user, consent_shown=1)
+    if show_consent:
         await m.answer(CONSENT_TEXT, reply_markup=CONSENT_KB)
 
-@dp.message_handler(Text(equals="Подписаться ❤️"))
 async def agree_subscribe(m: types.Message):
-    upsert_user(m.from_user, subscribe_flag=1)
-    log_event(m.from_user.id, "subscribe", "consent_button")
+    app = current_app()
+    await app.users.set_flags(m.from_user, subscribe_flag=1)
+    await app.journal.log(m.from_user.id, "subscribe", "consent_button")
     await m.answer("Спасибо за доверие! Я аккуратно и редко ✨", reply_markup=KB_MAIN)
 
-@dp.message_handler(Text(equals="🚫 Не сейчас"))
 async def decline_subscribe(m: types.Message):
-    log_event(m.from_user.id, "consent_decline")
+    await current_app().journal.log(m.from_user.id, "consent_decline")
     await m.answer("Хорошо. Если передумаешь — команда /subscribe.", reply_markup=KB_MAIN)
 
-@dp.message_handler(commands=['subscribe'])
 async def manual_subscribe(m: types.Message):
-    upsert_user(m.from_user, subscribe_flag=1)
-    log_event(m.from_user.id, "subscribe", "manual")
+    app = current_app()
+    await app.users.set_flags(m.from_user, subscribe_flag=1)
+    await app.journal.log(m.from_user.id, "subscribe", "manual")
     await m.answer("Подписка включена. Спасибо! 🌿")
 
-@dp.message_handler(commands=['unsubscribe'])
 async def manual_unsubscribe(m: types.Message):
-    upsert_user(m.from_user, subscribe_flag=0)
-    log_event(m.from_user.id, "unsubscribe", "manual")
+    app = current_app()
+    await app.users.set_flags(m.from_user, subscribe_flag=0)
+    await app.journal.log(m.from_user.id, "unsubscribe", "manual")
     await m.answer("Подписка выключена. В любой момент можно включить: /subscribe")
 
-@dp.message_handler(Text(equals="О консультации"))
 async def about_handler(m: types.Message):
+    app = current_app()
+    owner = app.owner_username
     kb = InlineKeyboardMarkup().add(
-        InlineKeyboardButton("Написать", url=f"https://t.me/{OWNER_USERNAME[1:]}")) if OWNER_USERNAME.startswith("@") \
+        InlineKeyboardButton("Написать", url=f"https://t.me/{owner[1:]}")) if owner.startswith("@") \
         else InlineKeyboardMarkup()
-    await m.answer(ABOUT_TEXT, reply_markup=kb if kb.inline_keyboard else None)
+    await m.answer(app.about_text, reply_markup=kb if kb.inline_keyboard else None)
 
-@dp.message_handler(Text(equals="Канал"))
 async def channel_handler(m: types.Message):
-    kb = InlineKeyboardMarkup().add(InlineKeyboardButton("Открыть канал", url=CHANNEL_LINK))
+    kb = InlineKeyboardMarkup().add(InlineKeyboardButton("Открыть канал", url=current_app().channel_link))
     await m.answer("Вот ссылка на мой канал. Жду тебя 💚\n\n<b>18+</b>", reply_markup=kb)
 
-@dp.message_handler(Text(equals="Моя тема", ignore_case=True))
 async def choose_topic(m: types.Message):
+    app = current_app()
     # одно сообщение, сразу с инлайн-кнопками тем
-    await m.answer("Выбирай тему:", reply_markup=TOPICS_KB)
+    await app.journal.log(m.from_user.id, "topic_menu")
+    await m.answer("Выбирай тему:", reply_markup=app.decks.current.topics_kb)
 
 # показываем выбор карт для выбранной темы (1–5 или 🎲)
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("t:"))
 async def topic_router(c: types.CallbackQuery):
+    app = current_app()
     code = c.data.split(":", 1)[1]  # think | money | talent | menu
-    if code == "menu":
-        await c.message.edit_text("Выбирай тему:", reply_markup=TOPICS_KB)
+    deck = app.decks.current
+    if code == "menu" or code not in deck.cards_kb:
+        await c.message.edit_text("Выбирай тему:", reply_markup=deck.topics_kb)
         await c.answer()
         return
 
     # сразу даём выбор карт
-    await c.message.edit_text("Выбери карту:", reply_markup=build_cards_kb(code))
+    await app.journal.log(c.from_user.id, "topic", code)
+    await c.message.edit_text("Выбери карту:", reply_markup=deck.cards_kb[code])
     await c.answer()
 
 # обработчик клика по конкретной карте 1–5 или 🎲
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("c:"))
 async def card_choice(c: types.CallbackQuery):
     try:
         _, topic, key = c.data.split(":")  # topic in (think|money|talent), key in (1..5|rand)
@@ -463,58 +434,194 @@ async def card_choice(c: types.CallbackQuery):
         await c.answer("Что-то пошло не так.", show_alert=True)
         return
 
-    # замок 7 дней
-    ok, when = can_draw_card(c.from_user.id)
-    if not ok:
-        await c.answer()
-        await c.message.answer(LOCK_TEXT, reply_markup=BACK_TO_MENU_KB)
-        return
-
-    # выбираем карту: конкретную 1..5 или случайную из имеющихся ключей
-    if key == "rand":
-        key = random.choice(list(DECKS.get(topic, {}).keys()))
-
-    text = DECKS.get(topic, {}).get(key)
+    # выбираем карту: конкретную 1..5 или случайную; текст уже с CTA
+    app = current_app()
+    deck = app.decks.current
+    key, text = deck.card(topic, key)
     if not text:
         await c.answer("Карты не нашлось 🙈", show_alert=True)
         return
 
+    # замок 7 дней: проверка и установка одной операцией
+    ok, when = await app.card_locks.try_acquire(c.from_user.id)
+    if not ok:
+        await app.journal.log(c.from_user.id, "card_locked", topic)
+        await c.answer()
+        await c.message.answer(deck.lock_text, reply_markup=BACK_TO_MENU_KB)
+        return
+
     # логика после выдачи карты
-    mark_card_drawn(c.from_user.id)
-    upsert_user(c.from_user)  # обновить last_seen
-    log_event(c.from_user.id, "card", f"{topic}:{key}")
+    await app.users.touch(c.from_user)  # обновить last_seen (не чаще раза в минуту)
+    await app.journal.log(c.from_user.id, "card", f"{topic}:{key}")
 
     await c.answer()
-    await c.message.answer(text + CTA_TAIL, reply_markup=BACK_TO_MENU_KB)
+    await c.message.answer(text, reply_markup=BACK_TO_MENU_KB)
 
 # ---------- /stats (краткая админ-статистика) ----------
-@dp.message_handler(commands=['stats'])
 async def cmd_stats(m: types.Message):
-    if OWNER_USERNAME and f"@{(m.from_user.username or '').lower()}" != OWNER_USERNAME.lower():
+    app = current_app()
+    if not app.is_owner(m):
         await m.answer("Команда доступна владельцу.")
         return
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users")
-    total = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM users WHERE subscribe_flag=1")
-    subs = cur.fetchone()[0]
-    week_ago = int((datetime.now() - timedelta(days=7)).timestamp())
-    cur.execute("SELECT COUNT(DISTINCT user_id) FROM events WHERE ts>=?", (week_ago,))
-    active7 = cur.fetchone()[0]
-    conn.close()
-    text = (
-        f"Пользователи: {total}\n"
-        f"Подписка включена: {subs}\n"
-        f"Актив за 7 дней: {active7}"
-    )
-    await m.answer(text)
-
-# ---------- ТОЧКА ВХОДА ----------
-if __name__ == "__main__":
-    db_init()
-    executor.start_polling(dp, skip_updates=True)
+    if await app.forwarded_to_primary():
+        return
+    # всё из счётчиков stats_daily/user_activity/stats_totals — events не сканируем
+    r = await app.storage.stats_report()
+
+    def by_windows(get) -> str:
+        return " / ".join(str(get(n)) for n in WINDOWS)
+
+    lines = [
+        f"Пользователи: {r['users']}",
+        f"Подписка включена: {r['subscribed']}",
+        "",
+        "За 1 / 7 / 30 дней:",
+        f"Актив: {by_windows(lambda n: r['active'][n])}",
+        f"Старты: {by_windows(lambda n: r['counts'][n]['start'])}",
+        f"«Моя тема»: {by_windows(lambda n: r['counts'][n]['topic_menu'])}",
+        f"Карты: {by_windows(lambda n: r['counts'][n]['card'])}",
+        f"Упёрлись в замок: {by_windows(lambda n: r['counts'][n]['card_locked'])}",
+        f"Подписки: {by_windows(lambda n: r['counts'][n]['subscribe'])}",
+        f"Отписки: {by_windows(lambda n: r['counts'][n]['unsubscribe'])}",
+    ]
+    funnel = r["funnel"][WINDOWS[-1]]
+    if funnel:
+        lines += ["", f"Воронка по темам за {WINDOWS[-1]} дней (тема → карта / замок):"]
+        lines += [f"{topic}: {f['topic']} → {f['card']} / {f['locked']}" for topic, f in funnel.items()]
+    await m.answer("\n".join(lines))
+
+# ---------- /broadcast (рассылка подписчикам) ----------
+async def cmd_broadcast(m: types.Message):
+    """
+    Ответь командой /broadcast на своё сообщение боту — его копия уйдёт всем,
+    у кого subscribe_flag=1. Без ответа — статус последней рассылки.
+    """
+    app = current_app()
+    # без OWNER_USERNAME /stats открыт всем, как и раньше, а рассылка — никому
+    if not app.owner_username or not app.is_owner(m):
+        await m.answer("Команда доступна владельцу.")
+        return
+    if await app.forwarded_to_primary():
+        return
 
+    broadcaster = app.broadcaster
+    if not m.reply_to_message:
+        st = await broadcaster.status()
+        if not st:
+            await m.answer("Рассылок ещё не было. Ответь /broadcast на сообщение, которое нужно разослать.")
+            return
+        await m.answer(
+            f"Рассылка #{st['id']}: {st['status']}\n"
+            f"Отправлено: {st['sent']}\n"
+            f"Заблокировали бота: {st['blocked']}\n"
+            f"Ошибки: {st['failed']}"
+        )
+        return
 
+    if broadcaster.running:
+        await m.answer("Рассылка уже идёт. Статус: /broadcast")
+        return
+    bid = await broadcaster.start(m.chat.id, m.reply_to_message.message_id)
+    await m.answer(f"Рассылка #{bid} запущена. Статус: /broadcast")
+
+def register_handlers(dp: Dispatcher):
+    """Одни и те же хэндлеры — на диспетчер каждого бота, в прежнем порядке."""
+    dp.register_message_handler(cmd_start, commands=['start'])
+    dp.register_message_handler(agree_subscribe, Text(equals="Подписаться ❤️"))
+    dp.register_message_handler(decline_subscribe, Text(equals="🚫 Не сейчас"))
+    dp.register_message_handler(manual_subscribe, commands=['subscribe'])
+    dp.register_message_handler(manual_unsubscribe, commands=['unsubscribe'])
+    dp.register_message_handler(about_handler, Text(equals="О консультации"))
+    dp.register_message_handler(channel_handler, Text(equals="Канал"))
+    dp.register_message_handler(choose_topic, Text(equals="Моя тема", ignore_case=True))
+    dp.register_callback_query_handler(topic_router, lambda c: c.data and c.data.startswith("t:"))
+    dp.register_callback_query_handler(card_choice, lambda c: c.data and c.data.startswith("c:"))
+    dp.register_message_handler(cmd_stats, commands=['stats'])
+    dp.register_message_handler(cmd_broadcast, commands=['broadcast'])
+
+# ---------- БОТЫ ----------
+shared = SharedResources(storage_threads=min(STORAGE_THREADS, len(CONFIGS)))
+APPS = [ClarityApp(cfg, shared) for cfg in CONFIGS]
+
+# ---------- МЕТРИКИ ----------
+# одна страница /metrics на процесс: гистограммы общие, значения ниже — сумма по ботам
+def _total(fn):
+    return lambda: sum(fn(app) for app in APPS)
+
+metrics.REGISTRY.gauge("clarity_bots", "Ботов в процессе", lambda: len(APPS))
+metrics.REGISTRY.gauge("clarity_storage_queue", "Операций в очереди потока SQLite", lambda: shared.storage_queue)
+metrics.REGISTRY.gauge("clarity_journal_pending", "Событий в буфере, ещё не записанных",
+                       _total(lambda a: a.journal.pending))
+metrics.REGISTRY.gauge("clarity_user_cache_size", "Пользователей в кэше", _total(lambda a: len(a.users)))
+metrics.REGISTRY.gauge("clarity_user_cache_hits_total", "Попадания в кэш пользователей",
+                       _total(lambda a: a.users.hits), "counter")
+metrics.REGISTRY.gauge("clarity_user_cache_misses_total", "Промахи кэша пользователей",
+                       _total(lambda a: a.users.misses), "counter")
+metrics.REGISTRY.gauge("clarity_user_cache_writes_total", "Записи users из кэша",
+                       _total(lambda a: a.users.writes), "counter")
+metrics.REGISTRY.gauge("clarity_throttle_buckets", "Вёдер анти-флуда в памяти", _total(lambda a: len(a.throttle)))
+metrics.REGISTRY.gauge("clarity_throttle_dropped_total", "Отброшено анти-флудом",
+                       _total(lambda a: a.throttle.dropped), "counter")
+metrics.REGISTRY.gauge("clarity_broadcasts_running", "Идущих рассылок", _total(lambda a: len(a.broadcaster)))
+metrics.REGISTRY.gauge("clarity_reminders_scheduled", "Напоминаний в расписании",
+                       _total(lambda a: len(a.reminders) if a.reminders else 0))
+metrics.REGISTRY.gauge("clarity_events_archived_total", "Событий выгружено в архив",
+                       _total(lambda a: a.retention.archived if a.retention else 0), "counter")
+metrics.REGISTRY.gauge("clarity_outbound_pending", "Исходящих сообщений в очереди", _total(lambda a: a.outbound.pending))
+metrics.REGISTRY.gauge("clarity_outbound_failed_total", "Не отправлено после всех повторов",
+                       _total(lambda a: a.outbound.failed), "counter")
+metrics.REGISTRY.gauge("clarity_updates_pending", "Апдейтов в очереди планировщика",
+                       _total(lambda a: a.dp.scheduler.pending))
+metrics.REGISTRY.gauge("clarity_updates_active", "Пользователей в обработке", _total(lambda a: a.dp.scheduler.active))
+metrics.REGISTRY.gauge("clarity_updates_duplicates_total", "Отброшено повторов update_id",
+                       _total(lambda a: a.dp.scheduler.duplicates), "counter")
+metrics.REGISTRY.gauge("clarity_updates_rejected_total", "Не принято: очередь полна",
+                       _total(lambda a: a.dp.scheduler.rejected), "counter")
+metrics.REGISTRY.gauge("clarity_updates_dropped_total", "Отброшено: очередь пользователя полна",
+                       _total(lambda a: a.dp.scheduler.dropped), "counter")
+metrics_server = metrics.MetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
 
+# ---------- ТОЧКА ВХОДА ----------
+async def on_startup():
+    await shared.open()
+    for app in APPS:
+        await app.startup()
+    if metrics_server:
+        await metrics_server.start()
+
+async def on_shutdown():
+    if metrics_server:
+        await metrics_server.close()
+    # боты останавливаются параллельно: каждый дорабатывает свою очередь (не дольше DRAIN_TIMEOUT)
+    await asyncio.gather(*(app.shutdown() for app in APPS))
+    await shared.close()
+
+async def run_polling():
+    """Long polling всех ботов на одном loop; Ctrl+C / SIGTERM — корректная остановка."""
+    loop, main = asyncio.get_running_loop(), asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, main.cancel)
+    await on_startup()
+    try:
+        for app in APPS:
+            await app.dp.skip_updates()
+        await asyncio.gather(*(app.dp.start_polling() for app in APPS))
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for app in APPS:
+            app.dp.stop_polling()
+        await on_shutdown()
 
+if __name__ == "__main__":
+    if BOT_MODE == "webhook":
+        origin = "{0.scheme}://{0.netloc}".format(urlsplit(WEBHOOK_URL))
+        webhook.start_webhook(
+            [(app.dp, WEBHOOK_URL if app.cfg.name is None else origin + app.cfg.webhook_path, app.cfg.webhook_path)
+             for app in APPS],
+            secret=WEBHOOK_SECRET, host=WEBAPP_HOST, port=WEBAPP_PORT,
+            on_startup=on_startup, on_shutdown=on_shutdown,
+            skip_updates=PRIMARY,   # перезапуск одного из воркеров не сбрасывает очередь Telegram
+        )
+    else:
+        asyncio.run(run_polling())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Рассылка подписчикам (users.subscribe_flag=1).
+
+- получатели читаются курсором по user_id пачками, весь список в память не грузится;
+- отправка параллельная, но не чаще GLOBAL_RATE сообщений в секунду
+  (лимит Telegram ~30/с на бота; каждому чату уходит одно сообщение,
+  так что лимит «1 в секунду на чат» соблюдается сам собой);
+- отправки идут через очередь outbound.py как массовые: ответы пользователям
+  обгоняют рассылку; RetryAfter пережидается там же, а если повторы кончились —
+  притормаживает вся рассылка;
+- после каждой пачки прогресс сохраняется в таблицу broadcasts —
+  после падения рассылка продолжается с места остановки при следующем старте;
+- заблокировавшие бота автоматически отписываются (subscribe_flag=0, blocked_ts);
+  401 без уточнения (токен отозван) — не про пользователя: рассылка останавливается
+  со статусом running и продолжится после перезапуска с исправленным токеном;
+- каждый исход пишется в events: event_type="broadcast", meta="<id>:sent|blocked|failed" —
+  сразу в SQLite, мимо буфера journal.py: после падения продолжение знает,
+  кому уже отправлено (окно повтора — только сообщения, ушедшие в момент падения).
+"""
+
+import time
+import asyncio
+import logging
+import sqlite3
+
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    RetryAfter, BotBlocked, UserDeactivated, ChatNotFound, CantInitiateConversation, Unauthorized, TelegramAPIError
+)
+
+from storage import Storage
+from outbound import bulk
+
+log = logging.getLogger(__name__)
+
+GLOBAL_RATE = 25        # сообщений в секунду на всю рассылку
+CONCURRENCY = 10        # одновременных запросов к Telegram
+CHUNK = 100             # получателей между сохранениями прогресса
+MAX_RETRIES = 3
+
+# ошибки про конкретного получателя: он недоступен, отписываем
+USER_GONE = (BotBlocked, UserDeactivated, ChatNotFound, CantInitiateConversation)
+
+
+class RateLimiter:
+    """Равномерно: не чаще rate вызовов wait() в секунду."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+    def pause(self, seconds: float):
+        """Никого не пускать ближайшие seconds секунд (после RetryAfter)."""
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+# ---------- SQL ----------
+def _create(conn: sqlite3.Connection, from_chat_id: int, message_id: int) -> int:
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO broadcasts (created_ts, from_chat_id, message_id, status) VALUES (?,?,?,'running')",
+            (int(time.time()), from_chat_id, message_id)
+        )
+        return cur.lastrowid
+
+
+def _running(conn: sqlite3.Connection) -> list[int]:
+    return [r[0] for r in conn.execute("SELECT id FROM broadcasts WHERE status='running' ORDER BY id")]
+
+
+def _get(conn: sqlite3.Connection, bid: int | None = None) -> dict | None:
+    conn.row_factory = sqlite3.Row
+    try:
+        if bid is None:
+            row = conn.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1").fetchone()
+        else:
+            row = conn.execute("SELECT * FROM broadcasts WHERE id=?", (bid,)).fetchone()
+    finally:
+        conn.row_factory = None
+    return dict(row) if row else None
+
+
+def _next_chunk(conn: sqlite3.Connection, after_user_id: int, limit: int) -> list[int]:
+    return [r[0] for r in conn.execute(
+        "SELECT user_id FROM users WHERE subscribe_flag=1 AND user_id>? ORDER BY user_id LIMIT ?",
+        (after_user_id, limit)
+    )]
+
+
+def _delivered_after(conn: sqlite3.Connection, bid: int, created_ts: int, after_user_id: int) -> dict[int, str]:
+    """Кому уже отправили после последнего чекпоинта и с каким исходом (для продолжения после падения)."""
+    return {uid: meta.partition(":")[2] for uid, meta in conn.execute(
+        "SELECT user_id, meta FROM events WHERE ts>=? AND user_id>? AND event_type='broadcast' AND meta LIKE ?",
+        (created_ts, after_user_id, f"{bid}:%")
+    )}
+
+
+def _checkpoint(conn: sqlite3.Connection, bid: int, last_user_id: int, sent: int, failed: int,
+                blocked: int, done: bool):
+    with conn:
+        conn.execute("""
+            UPDATE broadcasts
+               SET last_user_id=?, sent=sent+?, failed=failed+?, blocked=blocked+?,
+                   status=?, finished_ts=?
+             WHERE id=?
+        """, (last_user_id, sent, failed, blocked,
+              "done" if done else "running", int(time.time()) if done else None, bid))
+
+
+def _mark_blocked(conn: sqlite3.Connection, user_ids: list[int]):
+    now = int(time.time())
+    with conn:
+        conn.executemany(
+            "UPDATE users SET subscribe_flag=0, blocked_ts=? WHERE user_id=?",
+            [(now, uid) for uid in user_ids]
+        )
+
+
+class Broadcaster:
+    def __init__(self, bot: Bot, storage: Storage):
+        self.bot = bot
+        self.storage = storage
+        self.limiter = RateLimiter(GLOBAL_RATE)
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def start(self, from_chat_id: int, message_id: int) -> int:
+        """Начать рассылку копии сообщения (from_chat_id, message_id). Возвращает id рассылки."""
+        bid = await self.storage.run(_create, from_chat_id, message_id)
+        self._spawn(bid)
+        return bid
+
+    async def resume_pending(self):
+        """Продолжить рассылки, прерванные падением/перезапуском."""
+        for bid in await self.storage.run(_running):
+            log.info("broadcast #%d: продолжаю после перезапуска", bid)
+            self._spawn(bid)
+
+    async def status(self, bid: int | None = None) -> dict | None:
+        return await self.storage.run(_get, bid)
+
+    async def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, bid: int):
+        with bulk():   # контекст копируется в задачу: все её отправки — массовые
+            task = asyncio.create_task(self._run(bid), name=f"broadcast-{bid}")
+        self._tasks[bid] = task
+        task.add_done_callback(lambda t: self._done(bid, t))
+
+    def _done(self, bid: int, task: asyncio.Task):
+        self._tasks.pop(bid, None)
+        if not task.cancelled() and task.exception() is not None:
+            # статус остаётся running: продолжится при следующем старте
+            log.error("broadcast #%d: остановлена", bid, exc_info=task.exception())
+
+    async def _deliver(self, uid: int, row: dict, sem: asyncio.Semaphore) -> str:
+        outcome = await self._send(uid, row, sem)
+        # исход — сразу на диск, не в буфер журнала и не после пачки:
+        # при падении посреди пачки продолжение увидит, кому уже отправлено
+        await self.storage.insert_events([(uid, "broadcast", int(time.time()), f"{row['id']}:{outcome}")])
+        return outcome
+
+    async def _send(self, uid: int, row: dict, sem: asyncio.Semaphore) -> str:
+        async with sem:
+            for _ in range(MAX_RETRIES):
+                await self.limiter.wait()
+                try:
+                    await self.bot.copy_message(uid, row["from_chat_id"], row["message_id"])
+                    return "sent"
+                except RetryAfter as e:
+                    log.warning("broadcast #%d: RetryAfter %ss", row["id"], e.timeout)
+                    self.limiter.pause(e.timeout)
+                except USER_GONE:
+                    return "blocked"
+                except Unauthorized:
+                    raise   # 401 про сам бот (токен), а не про получателя — останавливаем рассылку
+                except TelegramAPIError as e:
+                    log.warning("broadcast #%d: %s → %s", row["id"], uid, e)
+                    return "failed"
+            return "failed"
+
+    async def _run(self, bid: int):
+        row = await self.status(bid)
+        cursor = row["last_user_id"]
+        skip = await self.storage.run(_delivered_after, bid, row["created_ts"], cursor)
+        sem = asyncio.Semaphore(CONCURRENCY)
+
+        while True:
+            chunk = await self.storage.run(_next_chunk, cursor, CHUNK)
+            if not chunk:
+                # доставленные до падения, но с тех пор отписавшиеся — в пачки не попали
+                rest = [outcome for uid, outcome in skip.items() if uid > cursor]
+                await self.storage.run(_checkpoint, bid, cursor, rest.count("sent"), rest.count("failed"),
+                                       rest.count("blocked"), True)
+                log.info("broadcast #%d: готово", bid)
+                return
+
+            todo = [uid for uid in chunk if uid not in skip]
+            tasks = [asyncio.ensure_future(self._deliver(uid, row, sem)) for uid in todo]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                # Unauthorized (токен), ошибка базы или остановка — остальным пачки не отправляем
+                for task in tasks:
+                    task.cancel()
+                raise
+
+            # доставленные до падения (skip) — тоже в счётчики и отписки
+            done = list(zip(todo, results)) + [(uid, outcome) for uid, outcome in skip.items()
+                                               if cursor < uid <= chunk[-1]]
+            results = [outcome for _, outcome in done]
+            blocked = [uid for uid, outcome in done if outcome == "blocked"]
+            if blocked:
+                await self.storage.run(_mark_blocked, blocked)
+            cursor = chunk[-1]
+            await self.storage.run(
+                _checkpoint, bid, cursor,
+                results.count("sent"), results.count("failed"), len(blocked), False
+            )
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Колоды карт, CTA и текст замка — из внешнего файла (decks.json).
+
+При загрузке файл проверяется: у каждой темы ровно карты 1–5, HTML
+корректный (только теги, которые понимает Telegram, всё закрыто).
+Готовые сообщения «карта + CTA» и клавиатуры собираются один раз.
+Файл изменился — новая версия подменяет старую одним присваиванием,
+без перезапуска; битый файл не применяется, работает прежняя версия.
+
+Формат:
+{
+  "cta": "...{channel_link}...{owner}...",
+  "lock_text": "...",
+  "topics": {"think": {"title": "Что он(а) думает обо мне?", "cards": {"1": "...", ..., "5": "..."}}}
+}
+"""
+
+import json
+import random
+import asyncio
+import logging
+from pathlib import Path
+from html.parser import HTMLParser
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+log = logging.getLogger(__name__)
+
+CARD_KEYS = ("1", "2", "3", "4", "5")
+# теги, которые Telegram принимает в parse_mode=HTML
+ALLOWED_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+                "a", "code", "pre", "tg-spoiler", "span", "blockquote"}
+
+
+class DeckError(ValueError):
+    pass
+
+
+class _HTMLCheck(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: list[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ALLOWED_TAGS:
+            raise DeckError(f"тег <{tag}> не поддерживается Telegram")
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if not self.stack or self.stack[-1] != tag:
+            raise DeckError(f"лишний или перепутанный </{tag}>")
+        self.stack.pop()
+
+
+def check_html(text: str, where: str):
+    p = _HTMLCheck()
+    try:
+        p.feed(text)
+        p.close()
+    except DeckError as e:
+        raise DeckError(f"{where}: {e}") from None
+    if p.stack:
+        raise DeckError(f"{where}: не закрыт <{p.stack[-1]}>")
+
+
+class Deck:
+    """Неизменяемый снимок колоды: всё уже собрано, хэндлеры только читают."""
+
+    def __init__(self, data: dict, channel_link: str, owner: str):
+        if not isinstance(data, dict) or not isinstance(data.get("topics"), dict) or not data["topics"]:
+            raise DeckError("нужны ключи cta, lock_text и непустой topics")
+        try:
+            cta = data["cta"].format(channel_link=channel_link, owner=owner)
+            self.lock_text = data["lock_text"].format(channel_link=channel_link, owner=owner)
+        except (KeyError, AttributeError, IndexError, ValueError) as e:
+            # ValueError — одиночная { или } в тексте: её надо удвоить, {{ }}
+            raise DeckError(f"cta/lock_text: {e!r}") from None
+        check_html(cta, "cta")
+        check_html(self.lock_text, "lock_text")
+
+        self.titles: dict[str, str] = {}
+        self.messages: dict[str, dict[str, str]] = {}   # topic → key → «карта + CTA»
+        for topic, spec in data["topics"].items():
+            cards = spec.get("cards") if isinstance(spec, dict) else None
+            if not isinstance(cards, dict) or sorted(cards) != list(CARD_KEYS):
+                raise DeckError(f"{topic}: нужны ровно карты {', '.join(CARD_KEYS)}")
+            if ":" in topic:
+                raise DeckError(f"{topic}: двоеточие в коде темы ломает callback_data")
+            for key, text in cards.items():
+                if not isinstance(text, str) or not text.strip():
+                    raise DeckError(f"{topic}/{key}: пустой текст")
+                check_html(text, f"{topic}/{key}")
+            self.titles[topic] = spec.get("title") or topic
+            self.messages[topic] = {key: cards[key] + cta for key in CARD_KEYS}
+
+        # клавиатуры — тоже один раз на версию колоды
+        self.topics_kb = InlineKeyboardMarkup(row_width=1)
+        self.topics_kb.add(*(InlineKeyboardButton(title, callback_data=f"t:{topic}")
+                             for topic, title in self.titles.items()))
+        self.cards_kb = {topic: self._build_cards_kb(topic) for topic in self.titles}
+
+    @staticmethod
+    def _build_cards_kb(topic: str) -> InlineKeyboardMarkup:
+        kb = InlineKeyboardMarkup(row_width=3)
+        kb.add(*(InlineKeyboardButton(key, callback_data=f"c:{topic}:{key}") for key in CARD_KEYS))
+        kb.add(InlineKeyboardButton("🎲 Случайная", callback_data=f"c:{topic}:rand"))
+        kb.add(InlineKeyboardButton("⬅️ Назад к темам", callback_data="t:menu"))
+        return kb
+
+    def card(self, topic: str, key: str) -> tuple[str | None, str | None]:
+        """(ключ карты, готовый текст); key="rand" — случайная из пяти."""
+        deck = self.messages.get(topic)
+        if not deck:
+            return None, None
+        if key == "rand":
+            key = random.choice(CARD_KEYS)
+        return key, deck.get(key)
+
+
+class DeckRegistry:
+    """Текущая версия колоды + фоновая проверка файла на изменения."""
+
+    def __init__(self, path: str | Path, channel_link: str, owner: str, poll_interval: float = 5.0):
+        self.path = Path(path)
+        self.channel_link = channel_link
+        self.owner = owner
+        self.poll_interval = poll_interval
+        self.current: Deck | None = None
+        self._mtime: int | None = None
+        self._task: asyncio.Task | None = None
+
+    def load(self) -> Deck:
+        """Прочитать и проверить файл; при ошибке — DeckError, текущая версия не меняется."""
+        mtime = self.path.stat().st_mtime_ns
+        try:
+            data = json.loads(self.path.read_text("utf-8"))
+        except ValueError as e:
+            raise DeckError(f"{self.path.name}: {e}") from None
+        deck = Deck(data, self.channel_link, self.owner)
+        self.current = deck    # атомарная подмена: хэндлеры видят либо старую, либо новую
+        self._mtime = mtime
+        return deck
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if self.path.stat().st_mtime_ns == self._mtime:
+                    continue
+                self.load()
+                log.info("decks: %s перечитан", self.path.name)
+                continue
+            except (OSError, DeckError) as e:
+                log.error("decks: новая версия не применена, работает прежняя: %s", e)
+            except Exception:
+                # непредусмотренная ошибка разбора не должна останавливать слежение за файлом
+                log.exception("decks: новая версия не применена, работает прежняя")
+            # не повторяем ошибку каждые poll_interval, ждём следующего изменения
+            try:
+                self._mtime = self.path.stat().st_mtime_ns
+            except OSError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch(), name="decks-watch")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
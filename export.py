@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Выгрузка users и events для аналитики: CSV, JSON Lines или Parquet.
+
+  python export.py events --from 2025-10-01 --to 2025-10-31 --type card --topic think -o cards.csv
+  python export.py events --format jsonl --with-archive archive > events.jsonl
+  python export.py events --format parquet -o events.parquet   # нужен pyarrow
+  python export.py users --subscribed --format csv -o subscribers.csv
+
+- meta разбирается в колонки: card «think:3» → topic=think, card=3;
+  topic / card_locked «think» → topic; broadcast «12:sent» → broadcast_id=12, detail=sent;
+  остальные («manual», «consent_button», ...) → detail; исходный meta тоже остаётся;
+- строки читаются курсором пачками по --chunk и сразу пишутся: память не зависит
+  от размера таблицы, Parquet пишется по row group на пачку;
+- база открывается только на чтение (WAL): работающий бот продолжает писать;
+- --with-archive добавляет события, уже выгруженные в архив (retention.py).
+
+Без -o CSV и JSONL пишутся в stdout.
+"""
+
+import os
+import csv
+import sys
+import json
+import sqlite3
+import argparse
+from pathlib import Path
+from datetime import date, datetime, timedelta
+
+from retention import iter_events, _day_start
+
+TOPIC_EVENTS = ("topic", "card_locked")
+
+EVENT_COLUMNS = ("id", "user_id", "event_type", "ts", "time", "topic", "card", "broadcast_id", "detail", "meta")
+USER_COLUMNS = ("user_id", "username", "first_name", "last_name", "first_seen_ts", "last_seen_ts",
+                "subscribe_flag", "consent_shown", "blocked_ts")
+
+
+def parse_meta(event_type: str, meta: str | None) -> dict:
+    out = {"topic": None, "card": None, "broadcast_id": None, "detail": None}
+    if not meta:
+        return out
+    if event_type == "card":
+        out["topic"], _, out["card"] = meta.partition(":")
+    elif event_type in TOPIC_EVENTS:
+        out["topic"] = meta
+    elif event_type == "broadcast":
+        bid, _, out["detail"] = meta.partition(":")
+        out["broadcast_id"] = int(bid) if bid.isdigit() else None
+    else:
+        out["detail"] = meta
+    return out
+
+
+def _event_row(id_, user_id, event_type, ts, meta) -> dict:
+    row = {"id": id_, "user_id": user_id, "event_type": event_type, "ts": ts,
+           "time": datetime.fromtimestamp(ts).isoformat(sep=" ") if ts is not None else None}
+    row.update(parse_meta(event_type, meta))
+    row["meta"] = meta
+    return row
+
+
+# ---------- чтение ----------
+def _connect(db_path: Path) -> sqlite3.Connection:
+    return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+
+def _events_query(since: int | None, until: int | None, event_types: list[str] | None,
+                  topic: str | None) -> tuple[str, list]:
+    where, params = [], []
+    if since is not None:
+        where.append("ts >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("ts < ?")
+        params.append(until)
+    if event_types:
+        where.append(f"event_type IN ({','.join('?' * len(event_types))})")
+        params += event_types
+    if topic:
+        where.append(f"((event_type IN ({','.join('?' * len(TOPIC_EVENTS))}) AND meta = ?)"
+                     " OR (event_type = 'card' AND meta LIKE ?))")
+        params += [*TOPIC_EVENTS, topic, f"{topic}:%"]
+    sql = "SELECT id, user_id, event_type, ts, meta FROM events"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return sql + " ORDER BY ts, id", params
+
+
+def iter_event_chunks(db_path: Path, since: date | None = None, until: date | None = None,
+                      event_types: list[str] | None = None, topic: str | None = None,
+                      archive_dir: Path | None = None, chunk: int = 5000):
+    """Пачки строк-словарей: сначала из архива (он старше), потом из базы."""
+    since_ts = _day_start(since) if since else None
+    until_ts = _day_start(until + timedelta(days=1)) if until else None   # --to включительно
+
+    if archive_dir is not None:
+        batch = []
+        types = set(event_types or ())
+        for ev in iter_events(archive_dir, since, until):
+            if types and ev["event_type"] not in types:
+                continue
+            row = _event_row(ev["id"], ev["user_id"], ev["event_type"], ev["ts"], ev["meta"])
+            if topic and row["topic"] != topic:
+                continue
+            batch.append(row)
+            if len(batch) >= chunk:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    conn = _connect(db_path)
+    try:
+        cur = conn.execute(*_events_query(since_ts, until_ts, event_types, topic))
+        while rows := cur.fetchmany(chunk):
+            yield [_event_row(*r) for r in rows]
+    finally:
+        conn.close()
+
+
+def iter_user_chunks(db_path: Path, since: date | None = None, until: date | None = None,
+                     subscribed: bool = False, chunk: int = 5000):
+    """Пользователи по first_seen_ts (пришли в этот период)."""
+    where, params = [], []
+    if since:
+        where.append("first_seen_ts >= ?")
+        params.append(_day_start(since))
+    if until:
+        where.append("first_seen_ts < ?")
+        params.append(_day_start(until + timedelta(days=1)))
+    if subscribed:
+        where.append("subscribe_flag = 1")
+    sql = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    conn = _connect(db_path)
+    try:
+        cur = conn.execute(sql + " ORDER BY user_id", params)
+        while rows := cur.fetchmany(chunk):
+            yield [dict(zip(USER_COLUMNS, r)) for r in rows]
+    finally:
+        conn.close()
+
+
+# ---------- запись ----------
+class CsvWriter:
+    def __init__(self, out, columns):
+        self.w = csv.DictWriter(out, fieldnames=columns)
+        self.w.writeheader()
+
+    def write(self, rows: list[dict]):
+        self.w.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonlWriter:
+    def __init__(self, out, columns):
+        self.out = out
+
+    def write(self, rows: list[dict]):
+        self.out.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows))
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    """Пачка → row group; pyarrow нужен только здесь."""
+
+    def __init__(self, path: Path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Для --format parquet нужен пакет pyarrow: pip install pyarrow") from e
+        self.pa = pa
+        types = {"id": pa.int64(), "user_id": pa.int64(), "ts": pa.int64(), "broadcast_id": pa.int64(),
+                 "first_seen_ts": pa.int64(), "last_seen_ts": pa.int64(), "blocked_ts": pa.int64(),
+                 "subscribe_flag": pa.int8(), "consent_shown": pa.int8()}
+        self.schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+        self.w = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows: list[dict]):
+        self.w.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.w.close()
+
+
+def export(chunks, columns, fmt: str, out_path: Path | None) -> int:
+    """Записать пачки в out_path (или stdout). Возвращает число строк."""
+    if fmt == "parquet":
+        if out_path is None:
+            raise RuntimeError("Для --format parquet укажите файл: -o events.parquet")
+        writer, f = ParquetWriter(out_path, columns), None
+    else:
+        f = open(out_path, "w", encoding="utf-8", newline="") if out_path else sys.stdout
+        writer = (CsvWriter if fmt == "csv" else JsonlWriter)(f, columns)
+    n = 0
+    try:
+        for rows in chunks:
+            writer.write(rows)
+            n += len(rows)
+    finally:
+        writer.close()
+        if f is not None and f is not sys.stdout:
+            f.close()
+    return n
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Выгрузка users и events для аналитики")
+    p.add_argument("table", choices=("events", "users"))
+    p.add_argument("--db", type=Path, default=Path(os.getenv("DB_PATH", "subscribers.db")))
+    p.add_argument("--format", choices=("csv", "jsonl", "parquet"), default="csv")
+    p.add_argument("-o", "--out", type=Path, help="файл; без него — stdout (кроме parquet)")
+    p.add_argument("--from", dest="since", type=date.fromisoformat, help="ГГГГ-ММ-ДД, включительно")
+    p.add_argument("--to", dest="until", type=date.fromisoformat, help="ГГГГ-ММ-ДД, включительно")
+    p.add_argument("--type", dest="event_types", action="append", help="event_type, можно несколько раз")
+    p.add_argument("--topic", help="тема: topic / card_locked с этим meta и card «тема:…»")
+    p.add_argument("--with-archive", type=Path, metavar="ARCHIVE_DIR", help="добавить события из архива")
+    p.add_argument("--subscribed", action="store_true", help="users: только подписчики")
+    p.add_argument("--chunk", type=int, default=5000, help="строк в пачке чтения/записи")
+    args = p.parse_args(argv)
+
+    if args.table == "events":
+        chunks = iter_event_chunks(args.db, args.since, args.until, args.event_types, args.topic,
+                                   args.with_archive, args.chunk)
+        columns = EVENT_COLUMNS
+    else:
+        chunks = iter_user_chunks(args.db, args.since, args.until, args.subscribed, args.chunk)
+        columns = USER_COLUMNS
+    n = export(chunks, columns, args.format, args.out)
+    print(f"Выгружено строк: {n}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная подмена Redis (протоколы RESP2/RESP3) — для проверки STATE_BACKEND=redis
+без настоящего сервера: несколько воркеров бота на одной машине.
+
+Поддержан только тот набор команд, который использует redis_state.py:
+HELLO, PING, GET, SET [NX] [EX|PX], DEL, EXPIRE, HSET, HSETNX, HMGET, HGETALL,
+RPUSH, LRANGE, LTRIM, LLEN, FLUSHALL. Всё в памяти, истечение — лениво.
+
+Запуск вручную:
+  python fake_redis.py --port 6380
+  STATE_BACKEND=redis REDIS_URL=redis://127.0.0.1:6380 STATE_SINK=1 python bot.py
+"""
+
+import time
+import asyncio
+import argparse
+
+
+class _Error(str):
+    pass
+
+
+class _Status(str):
+    pass
+
+
+OK = _Status("OK")
+
+
+def _encode(value, resp3: bool = False) -> bytes:
+    if value is None:
+        return b"_\r\n" if resp3 else b"$-1\r\n"
+    if isinstance(value, _Error):
+        return f"-{value}\r\n".encode()
+    if isinstance(value, _Status):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, bool) or isinstance(value, int):
+        return f":{int(value)}\r\n".encode()
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(_encode(v, resp3) for v in value)
+    if isinstance(value, dict):
+        if not resp3:
+            return _encode([x for item in value.items() for x in item])
+        return f"%{len(value)}\r\n".encode() + b"".join(_encode(k, resp3) + _encode(v, resp3)
+                                                        for k, v in value.items())
+    data = str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def _read_command(reader: asyncio.StreamReader) -> list[str] | None:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.decode().split()   # inline-команда (redis-cli, telnet)
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2].decode())
+    return args
+
+
+class FakeRedis:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._data: dict[str, object] = {}      # str | dict | list
+        self._expires: dict[str, float] = {}    # ключ → unix-время истечения
+        self._server: asyncio.AbstractServer | None = None
+        self.commands = 0
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    # --- данные ---
+    def _get(self, key: str, kind=None):
+        deadline = self._expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        value = self._data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise TypeError
+        return value
+
+    def _set(self, key: str, value, ttl: float | None = None):
+        self._data[key] = value
+        if ttl is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = time.time() + ttl
+
+    def execute(self, args: list[str]):
+        cmd, args = args[0].upper(), args[1:]
+        handler = getattr(self, f"cmd_{cmd.lower()}", None)
+        if handler is None:
+            return _Error(f"ERR unknown command '{cmd}'")
+        try:
+            return handler(*args)
+        except TypeError:
+            return _Error(f"ERR wrong arguments or WRONGTYPE for '{cmd}'")
+
+    # --- команды ---
+    def cmd_ping(self, *args):
+        return _Status("PONG") if not args else args[0]
+
+    def cmd_hello(self, *args):   # redis-py по умолчанию просит RESP3
+        return {"server": "fake-redis", "version": "7.0.0", "proto": int(args[0]) if args else 2,
+                "mode": "standalone", "role": "master"}
+
+    def cmd_client(self, *args):   # CLIENT SETINFO при подключении redis-py
+        return OK
+
+    def cmd_select(self, db):
+        return OK
+
+    def cmd_flushall(self, *args):
+        self._data.clear()
+        self._expires.clear()
+        return OK
+
+    def cmd_get(self, key):
+        return self._get(key, str)
+
+    def cmd_set(self, key, value, *opts):
+        opts = [o.upper() for o in opts]
+        ttl = None
+        if "EX" in opts:
+            ttl = float(opts[opts.index("EX") + 1])
+        elif "PX" in opts:
+            ttl = float(opts[opts.index("PX") + 1]) / 1000
+        exists = self._get(key) is not None
+        if ("NX" in opts and exists) or ("XX" in opts and not exists):
+            return None
+        self._set(key, value, ttl)
+        return OK
+
+    def cmd_del(self, *keys):
+        n = 0
+        for key in keys:
+            if self._get(key) is not None:
+                del self._data[key]
+                self._expires.pop(key, None)
+                n += 1
+        return n
+
+    def cmd_expire(self, key, seconds):
+        if self._get(key) is None:
+            return 0
+        self._expires[key] = time.time() + float(seconds)
+        return 1
+
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise TypeError
+        h = self._get(key, dict)
+        if h is None:
+            h = self._data[key] = {}
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in h
+            h[field] = value
+        return added
+
+    def cmd_hsetnx(self, key, field, value):
+        h = self._get(key, dict)
+        if h is None:
+            h = self._data[key] = {}
+        if field in h:
+            return 0
+        h[field] = value
+        return 1
+
+    def cmd_hget(self, key, field):
+        return (self._get(key, dict) or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        h = self._get(key, dict) or {}
+        return [h.get(f) for f in fields]
+
+    def cmd_hgetall(self, key):
+        h = self._get(key, dict) or {}
+        return [x for item in h.items() for x in item]
+
+    def cmd_rpush(self, key, *values):
+        lst = self._get(key, list)
+        if lst is None:
+            lst = self._data[key] = []
+        lst.extend(values)
+        return len(lst)
+
+    def cmd_llen(self, key):
+        return len(self._get(key, list) or [])
+
+    @staticmethod
+    def _range(n: int, start: str, stop: str) -> slice:
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start = max(n + start, 0)
+        if stop < 0:
+            stop = n + stop
+        return slice(start, stop + 1)
+
+    def cmd_lrange(self, key, start, stop):
+        lst = self._get(key, list) or []
+        return lst[self._range(len(lst), start, stop)]
+
+    def cmd_ltrim(self, key, start, stop):
+        lst = self._get(key, list)
+        if lst is not None:
+            lst[:] = lst[self._range(len(lst), start, stop)]
+            if not lst:
+                del self._data[key]
+        return OK
+
+    # --- сеть ---
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        resp3 = False
+        try:
+            while True:
+                args = await _read_command(reader)
+                if not args:
+                    break
+                self.commands += 1
+                cmd = args[0].upper()
+                if cmd == "QUIT":
+                    writer.write(_encode(OK))
+                    break
+                if cmd == "HELLO" and len(args) > 1:
+                    resp3 = args[1] == "3"
+                writer.write(_encode(self.execute(args), resp3))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+async def _main(args):
+    fake = FakeRedis(args.host, args.port)
+    await fake.start()
+    print(f"Fake Redis: {fake.url}")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await fake.close()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Локальная подмена Redis")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=6380)
+    asyncio.run(_main(p.parse_args()))
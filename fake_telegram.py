@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Локальная подмена Telegram Bot API — для проверки webhook-режима и нагрузочных прогонов.
+
+- FakeTelegram: aiohttp-сервер с маршрутом /bot<token>/<method>, отвечает
+  правдоподобными объектами и запоминает все вызовы (calls); flood_rate — доля
+  отправок, на которые он отвечает 429 Too Many Requests (retry_after секунд);
+- make_message / make_callback — собрать апдейт от «пользователя»;
+- post_update — отправить апдейт в webhook бота, как это делает Telegram.
+
+Запуск вручную:
+  python fake_telegram.py --port 8081
+  TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8080/webhook python bot.py
+  python fake_telegram.py --push http://127.0.0.1:8080/webhook --user 1 --text /start
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import itertools
+
+import aiohttp
+from aiohttp import web
+
+from webhook import SECRET_HEADER
+
+_BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Clarity", "username": "clarity_test_bot"}
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+
+
+class FakeTelegram:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 flood_rate: float = 0.0, retry_after: int = 1):
+        self.host = host
+        self.port = port
+        self.latency = latency                    # имитация сетевой задержки Telegram, сек
+        self.flood_rate = flood_rate              # доля отправок с ответом 429
+        self.retry_after = retry_after
+        self.floods = 0
+        self.calls: list[tuple[str, dict]] = []   # (method, параметры)
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+        self.webhook: dict | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # --- ответы ---
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        msg = {"message_id": next(self._message_ids), "date": int(time.time()),
+               "chat": _chat(chat_id), "from": _BOT_USER}
+        msg.update(extra)
+        return msg
+
+    def result(self, method: str, params: dict):
+        if method == "getMe":
+            return _BOT_USER
+        if method == "getUpdates":
+            return []
+        if method in ("setWebhook", "deleteWebhook", "answerCallbackQuery"):
+            if method == "setWebhook":
+                self.webhook = params
+            return True
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "sendPhoto":
+            file_id = params.get("photo")
+            if file_id == "<file>":   # загрузка файла, а не отправка по file_id
+                file_id = f"photo-{time.time_ns()}"
+            return self._message(params, photo=[{"file_id": file_id, "file_unique_id": file_id,
+                                                  "width": 640, "height": 640}],
+                                 caption=params.get("caption"))
+        return self._message(params, text=params.get("text", ""))
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        params = {k: (v if isinstance(v, str) else "<file>") for k, v in form.items()}
+        self.calls.append((method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getUpdates":
+            await asyncio.sleep(float(params.get("timeout", 0) or 0))
+        if self.flood_rate and "chat_id" in params and random.random() < self.flood_rate:
+            self.floods += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    # --- жизненный цикл ---
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+# ---------- апдейты «от пользователей» ----------
+_update_ids = itertools.count(1)
+
+
+def make_message(user_id: int, text: str, update_id: int | None = None) -> dict:
+    return {
+        "update_id": update_id or next(_update_ids),
+        "message": {"message_id": next(_update_ids), "date": int(time.time()),
+                    "chat": _chat(user_id), "from": _user(user_id), "text": text,
+                    **({"entities": [{"type": "bot_command", "offset": 0,
+                                      "length": len(text.split()[0])}]} if text.startswith("/") else {})},
+    }
+
+
+def make_callback(user_id: int, data: str, update_id: int | None = None) -> dict:
+    return {
+        "update_id": update_id or next(_update_ids),
+        "callback_query": {"id": str(next(_update_ids)), "from": _user(user_id), "chat_instance": "1",
+                           "data": data,
+                           "message": {"message_id": 1, "date": int(time.time()), "chat": _chat(user_id),
+                                       "from": _BOT_USER, "text": "..."}},
+    }
+
+
+async def post_update(session: aiohttp.ClientSession, url: str, update: dict,
+                      secret: str | None = None) -> int:
+    """POST апдейта в webhook бота. Возвращает HTTP-статус."""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with session.post(url, json=update, headers=headers) as resp:
+        return resp.status
+
+
+async def _main(args):
+    if args.push:
+        async with aiohttp.ClientSession() as session:
+            upd = make_callback(args.user, args.callback) if args.callback else make_message(args.user, args.text)
+            print(await post_update(session, args.push, upd, args.secret))
+        return
+    fake = FakeTelegram(args.host, args.port, flood_rate=args.flood)
+    await fake.start()
+    print(f"Fake Bot API: {fake.base_url}")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await fake.close()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Локальная подмена Telegram Bot API")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8081)
+    p.add_argument("--push", metavar="WEBHOOK_URL", help="отправить один апдейт в webhook и выйти")
+    p.add_argument("--secret", default=None)
+    p.add_argument("--user", type=int, default=1)
+    p.add_argument("--text", default="/start")
+    p.add_argument("--callback", default=None, help="callback_data вместо текста, например t:think")
+    p.add_argument("--flood", type=float, default=0.0, help="доля отправок с ответом 429, например 0.1")
+    asyncio.run(_main(p.parse_args()))
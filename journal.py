@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Журнал событий с отложенной записью (write-behind).
+
+Хэндлеры кладут события в память и сразу идут дальше; фоновая задача
+сбрасывает их в таблицу events (или в Redis, см. state.py) пачками —
+по размеру или по таймеру.
+Схема events не меняется, /stats работает как раньше.
+"""
+
+import time
+import asyncio
+import logging
+
+from state import StateBackend
+
+log = logging.getLogger(__name__)
+
+
+class EventJournal:
+    """
+    batch_size     — сколько событий копим до внеочередного сброса
+    flush_interval — как часто (сек) сбрасываем хвост, даже если пачка не набралась
+    max_pending    — порог backpressure: выше него log() ждёт, пока буфер не разгрузится
+    """
+
+    def __init__(self, state: StateBackend, batch_size: int = 200,
+                 flush_interval: float = 1.0, max_pending: int = 10_000):
+        self.state = state
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._buf: list[tuple[int, str, int, str | None]] = []
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._buf)
+
+    async def log(self, user_id: int, event_type: str, meta: str | None = None):
+        """
+        Записать событие. В обычном режиме не ждёт ничего;
+        ждёт только если буфер переполнен (диск не успевает).
+        """
+        self._buf.append((user_id, event_type, int(time.time()), meta))
+        if len(self._buf) >= self.batch_size:
+            self._wakeup.set()
+        while len(self._buf) >= self.max_pending:
+            self._room.clear()
+            self._wakeup.set()
+            await self._room.wait()
+
+    async def flush(self):
+        """Сбросить всё накопленное на диск (пачками по batch_size)."""
+        async with self._flush_lock:
+            while self._buf:
+                batch = self._buf[:self.batch_size]
+                try:
+                    await self.state.insert_events(batch)
+                except Exception:
+                    # события остаются в буфере, попробуем на следующем тике
+                    log.exception("Не удалось записать %d событий", len(batch))
+                    break
+                del self._buf[:len(batch)]
+                if len(self._buf) < self.max_pending:
+                    self._room.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="event-journal")
+
+    async def close(self):
+        """Остановить фоновую задачу и сбросить остаток (вызывать до state.close())."""
+        # не отменяем задачу посреди записи: пачка ушла бы в базу дважды
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        self._room.set()
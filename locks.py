@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+«Замок» на получение карты: общее состояние (SQLite card_locks или Redis,
+см. state.py) + кэш в памяти с write-through.
+
+Проверка и установка замка — одна операция (try_acquire): без await
+между проверкой и записью в кэш, а в хранилище — атомарная условная запись.
+Два одновременных тапа одного пользователя не получат две карты,
+даже если их обрабатывают разные процессы.
+
+Кэш — LRU на max_size пользователей; истёкшие замки из него выбрасываются:
+память — по недавно бравшим карту, а не по всем, кто когда-либо брал.
+"""
+
+import json
+import time
+import logging
+from pathlib import Path
+from collections import OrderedDict
+from datetime import datetime
+
+from state import StateBackend
+
+log = logging.getLogger(__name__)
+
+
+def _parse_legacy(rec) -> int | None:
+    """Старый формат: "2025-10-01T04:20:33"; новый: {"last_draw": "..."}."""
+    if isinstance(rec, dict):
+        rec = rec.get("last_draw")
+    if not isinstance(rec, str):
+        return None
+    try:
+        return int(datetime.fromisoformat(rec).timestamp())
+    except ValueError:
+        return None
+
+
+def read_usage_json(path: Path) -> list[tuple[int, int]]:
+    """
+    Записи (user_id, last_draw) из старого usage.json. Битый файл — ошибка
+    старта, а не «все разблокированы», как было раньше.
+    """
+    try:
+        data = json.loads(path.read_text("utf-8"))
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Не удалось прочитать {path.name}: {e}. Почините файл или удалите его.") from e
+    if not isinstance(data, dict):
+        raise RuntimeError(f"{path.name}: ожидался словарь user_id → дата, файл не импортирован.")
+
+    rows = []
+    for uid, rec in data.items():
+        ts = _parse_legacy(rec)
+        if ts is None or not str(uid).lstrip("-").isdigit():
+            log.warning("usage.json: пропускаю запись %r: %r", uid, rec)
+            continue
+        rows.append((int(uid), ts))
+    return rows
+
+
+def archive_usage_json(path: Path, count: int):
+    """После импорта: usage.json → usage.json.imported, повторно не читается."""
+    try:
+        path.rename(path.with_name(path.name + ".imported"))
+    except FileNotFoundError:
+        pass   # параллельно стартовавший процесс уже импортировал (импорт идемпотентный)
+    log.info("usage.json: импортировано %d замков", count)
+
+
+_MISSING = object()
+
+
+class CardLocks:
+    def __init__(self, state: StateBackend, lock_days: int, max_size: int = 50_000):
+        self.state = state
+        self.lock_seconds = lock_days * 86400
+        self.max_size = max_size
+        # user_id → last_draw (None — карт не брал); порядок — по последнему обращению
+        self._cache: OrderedDict[int, int | None] = OrderedDict()
+        self.on_acquire = None   # fn(user_id, last_draw) — выдана карта (reminders.py)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _expired(self, last: int | None, now: int) -> bool:
+        return last is None or now - last >= self.lock_seconds
+
+    def _remember(self, user_id: int, last: int | None, now: int):
+        """Записать в кэш и поднять в LRU; спереди выбросить истёкшие и лишние."""
+        self._cache[user_id] = last
+        self._cache.move_to_end(user_id)
+        while self._cache:
+            uid, oldest = next(iter(self._cache.items()))
+            if uid == user_id or (len(self._cache) <= self.max_size and not self._expired(oldest, now)):
+                break
+            del self._cache[uid]
+
+    async def import_legacy(self, path: Path) -> int:
+        """
+        Разовый перенос usage.json в Redis. С SQLite-состоянием файл переносит
+        сама база при старте (Storage(usage_file=...)).
+        """
+        if not path.exists():
+            return 0
+        rows = read_usage_json(path)
+        await self.state.import_locks(rows, self.lock_seconds)
+        archive_usage_json(path, len(rows))
+        return len(rows)
+
+    @staticmethod
+    def _format(next_ts: int) -> str:
+        return datetime.fromtimestamp(next_ts).strftime("%d.%m %H:%M")
+
+    async def try_acquire(self, user_id: int) -> tuple[bool, str | None]:
+        """
+        Возвращает (можно_ли, когда_можно_снова).
+        Если можно — замок уже поставлен на текущий момент.
+        """
+        last = self._cache.get(user_id, _MISSING)
+        if last is _MISSING:
+            last = await self.state.get_last_draw(user_id)
+            # пока мы ждали базу, параллельный тап мог уже поставить замок
+            last = self._cache.get(user_id, last)
+
+        now = int(time.time())
+        if not self._expired(last, now):
+            self._remember(user_id, last, now)
+            return False, self._format(last + self.lock_seconds)
+
+        self._remember(user_id, now, now)   # проверка и установка — без await между ними
+        try:
+            ok = await self.state.try_lock_card(user_id, now, self.lock_seconds)
+        except Exception:
+            self._cache.pop(user_id, None)   # что в хранилище — неизвестно, перечитаем
+            raise
+        if not ok:
+            # замок успели поставить мимо кэша (другой процесс) — верим хранилищу
+            last = await self.state.get_last_draw(user_id)
+            self._remember(user_id, last, now)
+            return False, self._format((last or now) + self.lock_seconds)
+        if self.on_acquire is not None:
+            self.on_acquire(user_id, now)
+        return True, None
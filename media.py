@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш file_id для медиафайлов (welcome.jpg и будущие картинки карт).
+
+Каждый файл загружается в Telegram один раз; полученный file_id хранится
+в таблице media_cache по sha256 содержимого. Дальше отправляем по file_id.
+Файл изменился — изменился хэш — будет новая загрузка. Если Telegram
+отверг сам file_id, забываем его и загружаем файл заново; остальные ошибки
+(длинная подпись, разметка) летят наружу, кэш не трогают.
+"""
+
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+from pathlib import Path
+
+from aiogram import types
+from aiogram.utils.exceptions import WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch
+
+from storage import Storage
+
+log = logging.getLogger(__name__)
+
+# ответы Telegram, после которых file_id больше не годится
+STALE_FILE_ID = (WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch)
+
+# kind → метод Message для отправки
+_SENDERS = {
+    "photo": "answer_photo",
+    "document": "answer_document",
+    "animation": "answer_animation",
+    "video": "answer_video",
+}
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_ids(conn: sqlite3.Connection) -> dict[tuple[str, str], str]:
+    return {(sha, kind): file_id for sha, kind, file_id in
+            conn.execute("SELECT sha256, kind, file_id FROM media_cache")}
+
+
+def _save_id(conn: sqlite3.Connection, sha: str, kind: str, file_id: str | None):
+    with conn:
+        if file_id is None:
+            conn.execute("DELETE FROM media_cache WHERE sha256=? AND kind=?", (sha, kind))
+        else:
+            conn.execute("""
+                INSERT INTO media_cache (sha256, kind, file_id, updated_ts) VALUES (?,?,?,?)
+                ON CONFLICT(sha256, kind) DO UPDATE SET file_id=excluded.file_id, updated_ts=excluded.updated_ts
+            """, (sha, kind, file_id, int(time.time())))
+
+
+def _file_id(sent: types.Message, kind: str) -> str:
+    if kind == "photo":
+        return sent.photo[-1].file_id   # самый большой размер
+    return getattr(sent, kind).file_id
+
+
+class MediaCache:
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._ids: dict[tuple[str, str], str] = {}
+        self._hashes: dict[Path, tuple[tuple[int, int], str]] = {}   # path → ((mtime_ns, size), sha)
+        self._uploads: dict[tuple[str, str], asyncio.Future] = {}
+
+    async def load(self):
+        self._ids = await self.storage.run(_load_ids)
+
+    async def _digest(self, path: Path) -> str:
+        """sha256 файла; пересчитывается, только если изменились mtime/размер."""
+        st = path.stat()   # FileNotFoundError летит наружу
+        sig = (st.st_mtime_ns, st.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == sig:
+            return cached[1]
+        sha = await asyncio.to_thread(_sha256, path)
+        self._hashes[path] = (sig, sha)
+        return sha
+
+    async def send(self, message: types.Message, path: str | Path, kind: str = "photo", **kwargs) -> types.Message:
+        """Отправить файл в чат message: по file_id, если он есть, иначе загрузить."""
+        path = Path(path)
+        sender = getattr(message, _SENDERS[kind])
+        key = (await self._digest(path), kind)
+
+        # пока идёт первая загрузка этого файла, остальные ждут её file_id
+        pending = self._uploads.get(key)
+        if pending is not None:
+            await asyncio.shield(pending)
+
+        file_id = self._ids.get(key)
+        if file_id:
+            try:
+                return await sender(file_id, **kwargs)
+            except STALE_FILE_ID as e:
+                log.warning("media: file_id для %s отвергнут (%s), загружаю заново", path.name, e)
+                self._ids.pop(key, None)
+                await self.storage.run(_save_id, key[0], kind, None)
+
+        return await self._upload(sender, path, key, **kwargs)
+
+    async def _upload(self, sender, path: Path, key: tuple[str, str], **kwargs) -> types.Message:
+        fut = asyncio.get_running_loop().create_future()
+        self._uploads[key] = fut
+        try:
+            with open(path, "rb") as f:
+                sent = await sender(f, **kwargs)
+            file_id = _file_id(sent, key[1])
+            self._ids[key] = file_id
+            await self.storage.run(_save_id, key[0], key[1], file_id)
+            return sent
+        finally:
+            self._uploads.pop(key, None)
+            fut.set_result(None)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики: задержки хэндлеров и операций хранилища, вызовы Telegram API,
+очередь исходящих сообщений, лаг event loop, глубина очередей. Отдаются в текстовом формате Prometheus
+на маленьком локальном HTTP-сервере (METRICS_PORT).
+
+Запись — это пара сложений и bisect по бакетам, без блокировок и потоков;
+рендер текста происходит только при запросе /metrics.
+"""
+
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from storage import Storage
+from outbound import OutboundQueue
+
+log = logging.getLogger(__name__)
+
+# секунды: от 0.5 мс (SQLite) до 10 с (загрузка медиа, RetryAfter)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in self._values.items()]
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}   # labels → [счётчики по бакетам..., +Inf, sum]
+
+    def observe(self, value: float, *labels):
+        s = self._series.get(labels)
+        if s is None:
+            s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, s in self._series.items():
+            acc = 0
+            for le, n in zip(self.buckets + (float("inf"),), s):
+                acc += n
+                le_s = "+Inf" if le == float("inf") else f"{le:g}"
+                out.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le_s,))} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {s[-1]:g}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {acc}")
+        return out
+
+
+class Gauge:
+    """Значение снимается при рендере: fn() → число (глубина очереди, размер кэша)."""
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge"):
+        self.name, self.help, self.fn, self.kind = name, help, fn, kind
+
+    def render(self) -> list[str]:
+        try:
+            value = float(self.fn())
+        except Exception:
+            log.exception("metrics: не удалось снять %s", self.name)
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value:g}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str, fn, kind: str = "gauge"):
+        return self.add(Gauge(name, help, fn, kind))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for m in self._metrics:
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.add(Histogram(
+    "clarity_handler_seconds", "Время работы хэндлера aiogram", ("handler",)))
+HANDLER_ERRORS = REGISTRY.add(Counter(
+    "clarity_handler_errors_total", "Исключения в хэндлерах", ("handler", "error")))
+STORAGE_SECONDS = REGISTRY.add(Histogram(
+    "clarity_storage_seconds", "Время выполнения операции SQLite в потоке хранилища", ("op",)))
+STORAGE_WAIT_SECONDS = REGISTRY.add(Histogram(
+    "clarity_storage_wait_seconds", "Ожидание операции в очереди потока хранилища", ("op",)))
+TG_REQUESTS = REGISTRY.add(Counter(
+    "clarity_telegram_requests_total", "Вызовы Telegram Bot API", ("method",)))
+TG_ERRORS = REGISTRY.add(Counter(
+    "clarity_telegram_errors_total", "Ошибки Telegram Bot API", ("method", "error")))
+TG_SECONDS = REGISTRY.add(Histogram(
+    "clarity_telegram_seconds", "Время вызова Telegram Bot API", ("method",)))
+OUTBOUND_QUEUE_SECONDS = REGISTRY.add(Histogram(
+    "clarity_outbound_queue_seconds", "Ожидание исходящего сообщения в очереди до отправки", ("priority",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)))
+OUTBOUND_RETRIES = REGISTRY.add(Counter(
+    "clarity_outbound_retries_total", "Повторы исходящих сообщений", ("method", "reason")))
+LOOP_LAG = REGISTRY.add(Histogram(
+    "clarity_event_loop_lag_seconds", "Опоздание таймера event loop (насколько loop занят)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+
+
+# ---------- aiogram ----------
+# хэндлер текущего апдейта — для счётчика ошибок: aiogram вызывает post_process
+# (и _finish) раньше обработчика ошибок, а у того свой, пустой data
+_current_handler_name: ContextVar[str] = ContextVar("clarity_handler_name", default="unknown")
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Задержка каждого хэндлера: от его выбора (после фильтров) до завершения."""
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        _current_handler_name.set("unknown")   # воркер планировщика обрабатывает апдейты подряд
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._start(data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        self._start(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self._finish(data)
+
+    async def on_post_process_callback_query(self, call: types.CallbackQuery, results, data: dict):
+        self._finish(data)
+
+    @staticmethod
+    def _start(data: dict):
+        name = getattr(current_handler.get(None), "__name__", "unknown")
+        _current_handler_name.set(name)
+        data["_metrics"] = (name, time.perf_counter())
+
+    @staticmethod
+    def _finish(data: dict):
+        started = data.pop("_metrics", None)
+        if started:
+            HANDLER_SECONDS.observe(time.perf_counter() - started[1], started[0])
+
+
+async def _count_error(update: types.Update, error: Exception):
+    HANDLER_ERRORS.inc(_current_handler_name.get(), type(error).__name__)
+    # ничего не возвращаем: ошибка не считается обработанной и логируется как обычно
+
+
+def instrument_bot(bot: Bot):
+    """Обернуть bot.request: счётчики и задержки по методам Bot API."""
+    request = bot.request
+
+    async def timed_request(method, data=None, files=None, **kwargs):
+        TG_REQUESTS.inc(method)
+        started = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        except Exception as e:
+            TG_ERRORS.inc(method, type(e).__name__)
+            raise
+        finally:
+            TG_SECONDS.observe(time.perf_counter() - started, method)
+
+    bot.request = timed_request
+
+
+def instrument_storage(storage: Storage):
+    def on_op(name: str, wait: float, exec_: float):
+        STORAGE_WAIT_SECONDS.observe(wait, name)
+        STORAGE_SECONDS.observe(exec_, name)
+    storage.on_op = on_op
+
+
+def instrument_outbound(outbound: OutboundQueue):
+    outbound.on_queued = lambda priority, seconds: OUTBOUND_QUEUE_SECONDS.observe(seconds, priority)
+    outbound.on_retry = OUTBOUND_RETRIES.inc
+
+
+def setup(dp: Dispatcher, storage: Storage):
+    dp.middleware.setup(MetricsMiddleware())
+    dp.register_errors_handler(_count_error)
+    instrument_bot(dp.bot)
+    instrument_storage(storage)
+
+
+# ---------- лаг event loop и HTTP ----------
+async def _watch_loop_lag(interval: float = 0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+class MetricsServer:
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self._runner: web.AppRunner | None = None
+        self._lag_task: asyncio.Task | None = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        self._lag_task = asyncio.create_task(_watch_loop_lag(), name="loop-lag")
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("metrics: http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
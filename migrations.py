@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Миграции схемы SQLite по PRAGMA user_version.
+
+Выполняются один раз при старте (Storage.open), на пути запроса — никогда.
+Каждая миграция — отдельная транзакция вместе с новым user_version:
+упала посередине — база остаётся на прежней версии, при следующем старте
+миграция повторится целиком.
+
+Базы, созданные до версионирования (user_version=0), могут быть в любом
+промежуточном виде: от самой первой схемы без subscribe_flag до почти
+текущей. Поэтому миграции 1–5 написаны через IF NOT EXISTS и проверку
+колонок; новые миграции (6 и дальше) могут рассчитывать на точную схему
+предыдущей версии.
+
+Новая миграция — функция fn(cur) в конец MIGRATIONS, номера не переиспользуются.
+"""
+
+import logging
+import sqlite3
+
+import stats
+
+log = logging.getLogger(__name__)
+
+
+def _columns(cur: sqlite3.Cursor, table: str) -> set[str]:
+    return {row[1] for row in cur.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(cur: sqlite3.Cursor, table: str, column: str, decl: str):
+    if column not in _columns(cur, table):
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _table_exists(cur: sqlite3.Cursor, name: str) -> bool:
+    return cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+# ---------- миграции ----------
+def _m1_base(cur: sqlite3.Cursor):
+    """Пользователи, события, замок на карту; колонки подписки в старых базах."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id        INTEGER PRIMARY KEY,
+            username       TEXT,
+            first_name     TEXT,
+            last_name      TEXT,
+            first_seen_ts  INTEGER,
+            last_seen_ts   INTEGER
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id     INTEGER,
+            event_type  TEXT,
+            ts          INTEGER,
+            meta        TEXT
+        )
+    """)
+    # когда пользователь последний раз тянул карту (unix ts)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS card_locks (
+            user_id    INTEGER PRIMARY KEY,
+            last_draw  INTEGER NOT NULL
+        )
+    """)
+    _add_column(cur, "users", "subscribe_flag", "INTEGER DEFAULT 0")
+    _add_column(cur, "users", "consent_shown", "INTEGER DEFAULT 0")
+
+
+def _m2_indexes(cur: sqlite3.Cursor):
+    """Выборки по времени/пользователю и курсор рассылки по подписчикам."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events(user_id, ts)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_users_subscribed ON users(user_id) WHERE subscribe_flag=1")
+
+
+def _m3_service(cur: sqlite3.Cursor):
+    """Дедупликация апдейтов, кэш file_id (media.py), рассылки (broadcast.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id  INTEGER PRIMARY KEY,
+            ts         INTEGER NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS media_cache (
+            sha256      TEXT NOT NULL,
+            kind        TEXT NOT NULL,
+            file_id     TEXT NOT NULL,
+            updated_ts  INTEGER,
+            PRIMARY KEY (sha256, kind)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_ts    INTEGER,
+            from_chat_id  INTEGER,
+            message_id    INTEGER,
+            status        TEXT,
+            last_user_id  INTEGER DEFAULT 0,
+            sent          INTEGER DEFAULT 0,
+            failed        INTEGER DEFAULT 0,
+            blocked       INTEGER DEFAULT 0,
+            finished_ts   INTEGER
+        )
+    """)
+    _add_column(cur, "users", "blocked_ts", "INTEGER")
+
+
+def _m4_stats(cur: sqlite3.Cursor):
+    """Счётчики для /stats (stats.py) и их разовый пересчёт по накопленным events."""
+    need_backfill = not _table_exists(cur, "stats_daily")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day     TEXT NOT NULL,
+            metric  TEXT NOT NULL,
+            key     TEXT NOT NULL DEFAULT '',
+            value   INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, metric, key)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS user_activity (
+            user_id   INTEGER PRIMARY KEY,
+            last_day  TEXT,
+            last_ts   INTEGER
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_user_activity_ts ON user_activity(last_ts)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            name   TEXT PRIMARY KEY,
+            value  INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_count AFTER INSERT ON users BEGIN
+            UPDATE stats_totals SET value=value+1 WHERE name='users';
+            UPDATE stats_totals SET value=value+1 WHERE name='subscribed' AND NEW.subscribe_flag=1;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_subscribed AFTER UPDATE OF subscribe_flag ON users
+        WHEN COALESCE(OLD.subscribe_flag, 0)=1 OR COALESCE(NEW.subscribe_flag, 0)=1 BEGIN
+            UPDATE stats_totals
+               SET value=value + (COALESCE(NEW.subscribe_flag, 0)=1) - (COALESCE(OLD.subscribe_flag, 0)=1)
+             WHERE name='subscribed';
+        END
+    """)
+    if need_backfill:
+        stats.backfill(cur)
+
+
+def _m5_reminders(cur: sqlite3.Cursor):
+    """last_draw, о конце которого уже напомнили (reminders.py)."""
+    _add_column(cur, "card_locks", "reminded_draw", "INTEGER")
+
+
+def _m6_events_archive(cur: sqlite3.Cursor):
+    """Выгруженные в архив партиции events (retention.py)."""
+    cur.execute("""
+        CREATE TABLE events_archive (
+            file        TEXT PRIMARY KEY,
+            day         TEXT NOT NULL,
+            min_id      INTEGER NOT NULL,
+            max_id      INTEGER NOT NULL,
+            rows        INTEGER NOT NULL,
+            created_ts  INTEGER NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX idx_events_archive_day ON events_archive(day)")
+
+
+MIGRATIONS = [
+    _m1_base,
+    _m2_indexes,
+    _m3_service,
+    _m4_stats,
+    _m5_reminders,
+    _m6_events_archive,
+]
+LATEST = len(MIGRATIONS)
+
+
+# ---------- движок ----------
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Довести базу до LATEST. Возвращает число применённых миграций."""
+    version = schema_version(conn)
+    if version > LATEST:
+        raise RuntimeError(f"База новее кода: версия схемы {version}, код знает до {LATEST}. Обновите бота.")
+
+    applied = 0
+    while version < LATEST:
+        cur = conn.cursor()
+        # IMMEDIATE: второй процесс на том же файле ждёт здесь и потом видит новую версию
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < LATEST:
+                MIGRATIONS[version](cur)
+                version += 1
+                cur.execute(f"PRAGMA user_version={version}")
+                applied += 1
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        log.info("schema: версия %d", version)
+    return applied
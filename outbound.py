@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Единый конвейер исходящих сообщений.
+
+Все отправки бота (sendMessage, sendPhoto, copyMessage, editMessageText, ...)
+проходят через одну очередь. Она подключается вместо bot.request, так что
+хэндлеры по-прежнему зовут m.answer / c.message.edit_text и просто ждут результат.
+
+- общий лимит на бота (OUTBOUND_RATE, у Telegram ~30 сообщений/с) и лимит на чат
+  (личка — около 1/с с небольшим запасом на серию, группа — 20 в минуту), token bucket;
+- интерактивные ответы уходят раньше массовых (рассылка помечает свои отправки bulk());
+- в один чат — по одному сообщению за раз, в порядке постановки;
+- RetryAfter — чат встаёт на паузу на сказанное время, сообщение уйдёт после неё:
+  хэндлер ждёт дольше, но не падает; сетевые ошибки и 5xx — повтор с нарастающей паузой;
+- время в очереди и повторы отдаются через хуки on_queued / on_retry (см. metrics.py).
+
+Остальные методы (answerCallbackQuery, getUpdates, ...) идут мимо очереди.
+"""
+
+import random
+import asyncio
+import logging
+import itertools
+import contextlib
+import contextvars
+from heapq import heappush, heappop
+from collections import deque
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, NetworkError, RestartingTelegram, TelegramAPIError
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE, BULK = 0, 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+QUEUED_METHODS = frozenset({
+    "sendMessage", "sendPhoto", "sendDocument", "sendAnimation", "sendVideo", "sendAudio",
+    "sendVoice", "sendSticker", "sendMediaGroup", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+})
+
+_priority = contextvars.ContextVar("outbound_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def bulk():
+    """Отправки внутри блока (и в задачах, созданных из него) — массовые, после интерактивных."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _is_retryable(e: Exception) -> bool:
+    # «голый» TelegramAPIError — это 5xx или неизвестный код, остальное — конкретные ошибки запроса
+    return isinstance(e, (NetworkError, RestartingTelegram, asyncio.TimeoutError)) or type(e) is TelegramAPIError
+
+
+def _rewind(files: dict | None):
+    """Повторная загрузка файла: поток нужно отмотать в начало."""
+    for f in (files or {}).values():
+        f = f.get_file() if hasattr(f, "get_file") else f
+        if hasattr(f, "seek"):
+            f.seek(0)
+
+
+class _Bucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = burst, now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        self._refill(now)
+        return now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Item:
+    __slots__ = ("method", "data", "files", "kwargs", "future", "priority", "seq", "enqueued", "attempts")
+
+
+class _Chat:
+    __slots__ = ("queue", "bucket", "not_before", "busy", "scheduled")
+
+    def __init__(self, bucket: _Bucket):
+        self.queue: deque[_Item] = deque()
+        self.bucket = bucket
+        self.not_before = 0.0    # пауза после RetryAfter
+        self.busy = False        # сообщение этого чата сейчас в полёте
+        self.scheduled = False   # чат стоит в _ready или _waiting
+
+
+class OutboundQueue:
+    """
+    global_rate  — сообщений в секунду на бота (0 — без общего лимита)
+    chat_rate    — в секунду на личный чат, chat_burst — сколько подряд без паузы
+    group_rate   — в секунду на группу/канал (chat_id < 0), group_burst
+    max_retries  — повторов на сообщение (RetryAfter, сеть, 5xx)
+    max_inflight — одновременных запросов к Telegram
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 5,
+                 group_rate: float = 20 / 60, group_burst: float = 3,
+                 max_retries: int = 5, max_inflight: int = 32):
+        self.global_rate = global_rate
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.group_rate, self.group_burst = group_rate, group_burst
+        self.max_retries = max_retries
+        self.max_inflight = max_inflight
+
+        self._request = None
+        self._chats: dict[object, _Chat] = {}
+        self._ready: list = []     # (priority, seq, key) — можно отправлять сейчас
+        self._waiting: list = []   # (когда, seq, key) — ждут лимита чата или паузы
+        self._seq = itertools.count()
+        self._global: _Bucket | None = None
+        self._inflight: asyncio.Semaphore | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._idle: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._pruned = 0.0
+
+        # хуки для метрик: on_queued(priority, секунды в очереди), on_retry(method, причина)
+        self.on_queued = None
+        self.on_retry = None
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+
+    def install(self, bot: Bot):
+        """Подменить bot.request: все отправки бота идут через очередь."""
+        self._request = bot.request
+        bot.request = self.request
+
+    # --- постановка ---
+    async def request(self, method, data=None, files=None, **kwargs):
+        if method not in QUEUED_METHODS:
+            return await self._request(method, data, files, **kwargs)
+        self._start()
+        loop = asyncio.get_running_loop()
+        item = _Item()
+        item.method, item.data, item.files, item.kwargs = method, data, files, kwargs
+        item.future = loop.create_future()
+        item.priority = _priority.get()
+        item.seq = next(self._seq)
+        item.enqueued = loop.time()
+        item.attempts = 0
+
+        key = (data or {}).get("chat_id")
+        if key is None:
+            key = ("item", item.seq)   # inline_message_id и т.п. — без лимита чата
+        chat = self._chats.get(key)
+        if chat is None:
+            group = isinstance(key, (int, str)) and str(key).startswith("-")
+            bucket = _Bucket(self.group_rate, self.group_burst, item.enqueued) if group \
+                else _Bucket(self.chat_rate, self.chat_burst, item.enqueued)
+            chat = self._chats[key] = _Chat(bucket)
+        chat.queue.append(item)
+        self.pending += 1
+        self._idle.clear()
+        if not chat.busy and not chat.scheduled:
+            self._schedule(key, chat, item.enqueued)
+        return await item.future
+
+    def _schedule(self, key, chat: _Chat, now: float):
+        at = max(chat.not_before, chat.bucket.ready_at(now))
+        if at <= now:
+            heappush(self._ready, (chat.queue[0].priority, chat.queue[0].seq, key))
+        else:
+            heappush(self._waiting, (at, next(self._seq), key))
+        chat.scheduled = True
+        self._wakeup.set()
+
+    # --- отправка ---
+    def _start(self):
+        if self._task is None:
+            now = asyncio.get_running_loop().time()
+            self._global = _Bucket(self.global_rate, max(self.global_rate, 1), now) if self.global_rate else None
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._task = asyncio.create_task(self._run(), name="outbound")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, key = heappop(self._waiting)
+                chat = self._chats[key]
+                heappush(self._ready, (chat.queue[0].priority, chat.queue[0].seq, key))
+            if now - self._pruned > 60:
+                self._prune(now)
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._global is not None:
+                delay = self._global.ready_at(now) - now
+                if delay > 0:
+                    # после паузы заново выбираем: мог прийти интерактивный ответ
+                    await asyncio.sleep(delay)
+                    continue
+            await self._inflight.acquire()
+
+            _, _, key = heappop(self._ready)
+            chat = self._chats[key]
+            chat.scheduled = False
+            item = chat.queue.popleft()
+            if item.future.done():     # хэндлер отменён, пока сообщение ждало
+                self.pending -= 1
+                self._inflight.release()
+                self._done(key, chat, loop.time())
+                continue
+            now = loop.time()
+            if self._global is not None:
+                self._global.take(now)
+            chat.bucket.take(now)
+            chat.busy = True
+            if self.on_queued is not None and not item.attempts:
+                self.on_queued(PRIORITY_NAMES[item.priority], now - item.enqueued)
+            asyncio.create_task(self._send(key, chat, item))
+
+    async def _send(self, key, chat: _Chat, item: _Item):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    result = await self._request(item.method, item.data, item.files, **item.kwargs)
+                except RetryAfter as e:
+                    item.attempts += 1
+                    self._retried(item.method, "retry_after")
+                    if item.attempts > self.max_retries:
+                        raise
+                    # в этот чат — не раньше, чем сказал Telegram; сообщение — обратно в голову очереди
+                    log.info("outbound: RetryAfter %ss для чата %s", e.timeout, key)
+                    chat.not_before = loop.time() + e.timeout
+                    chat.queue.appendleft(item)
+                    _rewind(item.files)
+                    return
+                except Exception as e:
+                    if not _is_retryable(e) or item.attempts >= self.max_retries:
+                        raise
+                    item.attempts += 1
+                    self._retried(item.method, type(e).__name__)
+                    # чат остаётся занятым: следующее сообщение не обгонит это
+                    await asyncio.sleep(min(0.5 * 2 ** (item.attempts - 1), 10.0) * random.uniform(0.8, 1.2))
+                    _rewind(item.files)
+                    continue
+                self.sent += 1
+                self.pending -= 1
+                if not item.future.done():
+                    item.future.set_result(result)
+                return
+        except Exception as e:
+            self.failed += 1
+            self.pending -= 1
+            if not item.future.done():
+                item.future.set_exception(e)
+        finally:
+            chat.busy = False
+            self._inflight.release()
+            self._done(key, chat, loop.time())
+
+    def _done(self, key, chat: _Chat, now: float):
+        if chat.queue:
+            self._schedule(key, chat, now)
+        elif not self.pending:
+            self._idle.set()
+
+    def _retried(self, method: str, reason: str):
+        if self.on_retry is not None:
+            self.on_retry(method, reason)
+
+    def _prune(self, now: float):
+        """Забыть чаты, у которых ничего не ждёт и ведро уже полное."""
+        self._pruned = now
+        for key in [k for k, c in self._chats.items()
+                    if not c.queue and not c.busy and c.not_before <= now and c.bucket.full(now)]:
+            del self._chats[key]
+
+    async def close(self, timeout: float | None = None):
+        """Дождаться отправки очереди (не дольше timeout) и остановить конвейер."""
+        if self._task is None:
+            return
+        if self.pending:
+            log.info("outbound: дожидаюсь %d сообщений", self.pending)
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                log.warning("outbound: не отправлено %d сообщений", self.pending)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        for chat in self._chats.values():
+            for item in chat.queue:
+                if not item.future.done():
+                    item.future.set_exception(RuntimeError("outbound: очередь остановлена"))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Общее состояние в Redis — для нескольких воркеров бота (STATE_BACKEND=redis).
+
+Ключи (prefix по умолчанию «clarity:»):
+  u:{id}     — hash пользователя: профиль, first/last_seen_ts, subscribe_flag, consent_shown;
+  lock:{id}  — замок на карту: last_draw, живёт lock_seconds (SET NX EX);
+  upd:{id}   — обработанный update_id, живёт DEDUP_TTL (SET NX EX);
+  ulock:{id} — аренда пользователя: его апдейты обрабатывает один воркер за раз;
+  sync       — список записей для SQLite-приёмника (события, пользователи, замки,
+               пересланные админ-команды).
+
+Redis отвечает за то, что должно быть атомарным между воркерами. Аналитика,
+рассылка и /stats по-прежнему работают на SQLite — в одном процессе-приёмнике
+(STATE_SINK=1), который переносит список sync в свою базу (SyncSink).
+Админ-команды с остальных воркеров пересылаются ему через тот же список.
+
+Пакет redis нужен только здесь: pip install redis.
+Для проверок без настоящего Redis — fake_redis.py.
+"""
+
+import json
+import time
+import uuid
+import asyncio
+import logging
+import sqlite3
+import contextlib
+from types import SimpleNamespace
+
+from state import StateBackend
+from storage import Storage, DEDUP_TTL, _upsert_user, _import_locks
+
+log = logging.getLogger(__name__)
+
+LEASE_MS = 30_000   # аренда пользователя: дольше хэндлер не работает
+
+
+def _user_fields(u, now: int, subscribe_flag: int | None = None) -> dict:
+    fields = {"username": u.username, "first_name": u.first_name, "last_name": u.last_name,
+              "last_seen_ts": now, "subscribe_flag": subscribe_flag}
+    return {k: v for k, v in fields.items() if v is not None}
+
+
+def _user_record(u, now: int, subscribe_flag: int | None = None, consent_shown: int | None = None) -> str:
+    return json.dumps({"t": "user", "id": u.id, "username": u.username, "first_name": u.first_name,
+                       "last_name": u.last_name, "ts": now,
+                       "subscribe_flag": subscribe_flag, "consent_shown": consent_shown},
+                      ensure_ascii=False)
+
+
+class RedisBackend(StateBackend):
+    def __init__(self, url: str, prefix: str = "clarity:", client=None):
+        """client — общий клиент Redis нескольких ботов процесса (tenants.py), закрывает его владелец."""
+        if client is None:
+            try:
+                from redis import asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("Для STATE_BACKEND=redis нужен пакет redis: pip install redis") from e
+            client = aioredis.from_url(url, decode_responses=True)
+            self._own_client = True
+        else:
+            self._own_client = False
+        self.url = url
+        self.prefix = prefix
+        self.redis = client
+        self.sync_key = f"{prefix}sync"
+
+    def _key(self, kind: str, id_) -> str:
+        return f"{self.prefix}{kind}:{id_}"
+
+    async def open(self):
+        await self.redis.ping()
+
+    async def close(self):
+        if self._own_client:
+            await self.redis.aclose()
+
+    # --- пользователи ---
+    async def start_user(self, u) -> bool:
+        now = int(time.time())
+        key = self._key("u", u.id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hsetnx(key, "first_seen_ts", now)
+        pipe.hset(key, mapping=_user_fields(u, now, subscribe_flag=0))
+        pipe.hsetnx(key, "consent_shown", 1)   # 1 — поле поставили мы, значит показываем впервые
+        pipe.rpush(self.sync_key, _user_record(u, now, subscribe_flag=0, consent_shown=1))
+        _, _, first, _ = await pipe.execute()
+        return bool(first)
+
+    async def upsert_user(self, u, subscribe_flag: int | None = None, consent_shown: int | None = None):
+        now = int(time.time())
+        key = self._key("u", u.id)
+        fields = _user_fields(u, now, subscribe_flag)
+        if consent_shown is not None:
+            fields["consent_shown"] = consent_shown
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hsetnx(key, "first_seen_ts", now)
+        pipe.hset(key, mapping=fields)
+        pipe.rpush(self.sync_key, _user_record(u, now, subscribe_flag, consent_shown))
+        await pipe.execute()
+
+    # --- события ---
+    async def insert_events(self, rows: list[tuple[int, str, int, str | None]]):
+        if rows:
+            await self.redis.rpush(self.sync_key, *(json.dumps({"t": "event", "row": r}, ensure_ascii=False)
+                                                    for r in rows))
+
+    # --- замок на карту ---
+    async def get_last_draw(self, user_id: int) -> int | None:
+        value = await self.redis.get(self._key("lock", user_id))
+        return int(value) if value is not None else None
+
+    async def try_lock_card(self, user_id: int, now: int, lock_seconds: int) -> bool:
+        # ключ сам исчезает, когда замок истёк: «нет ключа» = «можно»
+        ok = await self.redis.set(self._key("lock", user_id), now, nx=True, ex=lock_seconds)
+        if ok:
+            await self.redis.rpush(self.sync_key, json.dumps({"t": "lock", "id": user_id, "ts": now}))
+        return bool(ok)
+
+    async def import_locks(self, rows: list[tuple[int, int]], lock_seconds: int):
+        now = int(time.time())
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, last_draw in rows:
+            left = last_draw + lock_seconds - now
+            if left > 0:
+                pipe.set(self._key("lock", user_id), last_draw, nx=True, ex=left)
+            pipe.rpush(self.sync_key, json.dumps({"t": "lock", "id": user_id, "ts": last_draw}))
+        await pipe.execute()
+
+    # --- апдейты ---
+    async def mark_update(self, update_id: int) -> bool:
+        return bool(await self.redis.set(self._key("upd", update_id), 1, nx=True, ex=DEDUP_TTL))
+
+    @contextlib.asynccontextmanager
+    async def user_lock(self, user_id: int):
+        key = self._key("ulock", user_id)
+        token = uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 2 * LEASE_MS / 1000
+        delay = 0.005
+        while not await self.redis.set(key, token, nx=True, px=LEASE_MS):
+            if loop.time() > deadline:
+                # держатель аренды продлевать её не умеет — сюда попадаем, только если Redis сбоит
+                log.warning("redis: не дождался аренды пользователя %s, обрабатываю без неё", user_id)
+                token = None
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            if token is not None and await self.redis.get(key) == token:
+                await self.redis.delete(key)
+
+    async def forward_update(self, update: dict):
+        """Переслать апдейт процессу-приёмнику (админ-команды, которым нужна полная SQLite)."""
+        await self.redis.rpush(self.sync_key, json.dumps({"t": "update", "update": update}, ensure_ascii=False))
+
+
+# ---------- приёмник: Redis → локальная SQLite ----------
+def _apply_sync(conn: sqlite3.Connection, users: list[dict], locks: list[tuple[int, int]]):
+    with conn:
+        cur = conn.cursor()
+        for r in users:
+            u = SimpleNamespace(id=r["id"], username=r["username"],
+                                first_name=r["first_name"], last_name=r["last_name"])
+            _upsert_user(cur, u, r["ts"], r["subscribe_flag"], r["consent_shown"])
+    _import_locks(conn, locks)
+
+
+class SyncSink:
+    """
+    Переносит список sync в локальную SQLite: события (с rollup-ами /stats),
+    копию users и card_locks. Работает в одном процессе (STATE_SINK=1).
+
+    Пачка сначала записывается, потом удаляется из Redis (LRANGE → запись → LTRIM):
+    падение посередине не теряет события, в худшем случае пачка запишется повторно.
+    Пересланные апдейты — наоборот, удаляются до обработки: рассылку дважды не запускаем.
+    """
+
+    def __init__(self, state: RedisBackend, storage: Storage, on_update=None, on_lock=None,
+                 batch_size: int = 500, interval: float = 1.0):
+        self.state = state
+        self.storage = storage
+        self.on_update = on_update   # async fn(dict апдейта)
+        self.on_lock = on_lock       # fn(user_id, last_draw) — новая карта на любом воркере
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._closing = False
+
+    async def drain(self) -> int:
+        """Перенести одну пачку. Возвращает её размер."""
+        redis = self.state.redis
+        items = await redis.lrange(self.state.sync_key, 0, self.batch_size - 1)
+        if not items:
+            return 0
+        events, users, locks, updates = [], [], [], []
+        for raw in items:
+            try:
+                rec = json.loads(raw)
+                kind = rec["t"]
+            except (ValueError, KeyError, TypeError):
+                log.error("sync: пропускаю битую запись %r", raw[:200])
+                continue
+            if kind == "event":
+                events.append(tuple(rec["row"]))
+            elif kind == "user":
+                users.append(rec)
+            elif kind == "lock":
+                locks.append((rec["id"], rec["ts"]))
+            elif kind == "update":
+                updates.append(rec["update"])
+        if users or locks:
+            await self.storage.run(_apply_sync, users, locks)
+        if events:
+            await self.storage.insert_events(events)
+        await redis.ltrim(self.state.sync_key, len(items), -1)
+
+        if self.on_lock is not None:
+            for user_id, last_draw in locks:
+                self.on_lock(user_id, last_draw)
+        for update in updates:
+            if self.on_update is None:
+                continue
+            try:
+                await self.on_update(update)
+            except Exception:
+                log.exception("sync: ошибка обработки пересланного апдейта")
+        return len(items)
+
+    async def drain_all(self):
+        while await self.drain() >= self.batch_size:
+            pass
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                n = await self.drain()
+            except Exception:
+                log.exception("sync: не удалось перенести пачку")
+                n = 0
+            if n < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def start(self):
+        """Дописать накопленное (рассылке при продолжении нужны все события), потом — в фоне."""
+        await self.drain_all()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="redis-sync")
+
+    async def close(self):
+        # не отменяем посреди записи пачки — ждём конца итерации
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.drain_all()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Напоминание «новая карта уже доступна» — когда истекает замок на карту.
+
+- только подписчикам (subscribe_flag=1): проверяется в момент отправки,
+  так что отписка после карты напоминание отменяет, а подписка — включает;
+- расписание — куча таймеров в памяти (due, user_id, last_draw): при старте
+  собирается одним запросом из card_locks, дальше пополняется при каждой новой
+  карте (schedule); периодических проходов по всем пользователям нет;
+- без повторов после перезапуска: перед отправкой в card_locks.reminded_draw
+  записывается last_draw, о котором напоминаем (условный UPDATE) — сначала
+  отметка, потом сообщение: при падении между ними напоминание потеряется,
+  но не придёт дважды;
+- не все в одну секунду: к сроку добавляется сдвиг до spread секунд, постоянный
+  для пользователя (после перезапуска тот же), а отправки идут не чаще rate в
+  секунду и как массовые (outbound.bulk) — ответы пользователям их обгоняют;
+- напоминания, опоздавшие больше чем на max_late (бот долго лежал), не шлём.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import sqlite3
+
+from aiogram.utils.exceptions import TelegramAPIError
+
+from storage import Storage
+from journal import EventJournal
+from broadcast import RateLimiter, USER_GONE
+from outbound import bulk
+
+log = logging.getLogger(__name__)
+
+
+# ---------- SQL ----------
+def _pending(conn: sqlite3.Connection, since_draw: int) -> list[tuple[int, int]]:
+    """Замки, о конце которых ещё не напоминали (только подписчики)."""
+    return conn.execute("""
+        SELECT cl.user_id, cl.last_draw FROM card_locks cl
+          JOIN users u ON u.user_id = cl.user_id
+         WHERE u.subscribe_flag = 1 AND cl.last_draw >= ?
+           AND COALESCE(cl.reminded_draw, 0) < cl.last_draw
+    """, (since_draw,)).fetchall()
+
+
+def _claim(conn: sqlite3.Connection, user_id: int, last_draw: int) -> bool:
+    """Отметить напоминание отправленным. False — уже напомнили, новая карта или отписка."""
+    with conn:
+        cur = conn.execute("""
+            UPDATE card_locks SET reminded_draw = last_draw
+             WHERE user_id = ? AND last_draw = ? AND COALESCE(reminded_draw, 0) < last_draw
+               AND EXISTS (SELECT 1 FROM users WHERE user_id = card_locks.user_id AND subscribe_flag = 1)
+        """, (user_id, last_draw))
+        return cur.rowcount > 0
+
+
+class Reminders:
+    """
+    send(user_id) — корутина, отправляющая само напоминание (текст и кнопки — в bot.py).
+    """
+
+    def __init__(self, storage: Storage, journal: EventJournal, lock_seconds: int, send,
+                 spread: int = 1800, rate: float = 5.0, max_late: int = 86400):
+        self.storage = storage
+        self.journal = journal
+        self.lock_seconds = lock_seconds
+        self.send = send
+        self.spread = spread
+        self.max_late = max_late
+        self.limiter = RateLimiter(rate)
+
+        self._heap: list[tuple[int, int, int]] = []   # (due, user_id, last_draw)
+        self._due: dict[int, int] = {}                # user_id → last_draw актуальной записи
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def _due_at(self, user_id: int, last_draw: int) -> int:
+        # постоянный сдвиг по user_id: когорта одного промо расходится на spread секунд
+        return last_draw + self.lock_seconds + (user_id * 2654435761) % (self.spread or 1)
+
+    def schedule(self, user_id: int, last_draw: int):
+        """Новая карта: напомнить, когда её замок истечёт. Старая запись в куче становится неактуальной."""
+        if self._due.get(user_id, 0) >= last_draw:
+            return
+        self._due[user_id] = last_draw
+        due = self._due_at(user_id, last_draw)
+        heapq.heappush(self._heap, (due, user_id, last_draw))
+        if self._heap[0][1] == user_id:
+            self._wakeup.set()   # новая запись раньше той, которую ждёт цикл
+
+    async def load(self) -> int:
+        since = int(time.time()) - self.lock_seconds - self.max_late
+        rows = await self.storage.run(_pending, since)
+        for user_id, last_draw in rows:
+            self.schedule(user_id, last_draw)
+        log.info("reminders: в расписании %d напоминаний", len(rows))
+        return len(rows)
+
+    async def _fire(self, user_id: int, last_draw: int):
+        if not await self.storage.run(_claim, user_id, last_draw):
+            return
+        try:
+            with bulk():
+                await self.send(user_id)
+            outcome = "sent"
+        except USER_GONE:
+            outcome = "blocked"
+        except TelegramAPIError as e:
+            log.warning("reminders: %s → %s", user_id, e)
+            outcome = "failed"
+        await self.journal.log(user_id, "reminder", outcome)
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, user_id, last_draw = self._heap[0]
+            if self._due.get(user_id) != last_draw:
+                heapq.heappop(self._heap)   # устарела: у пользователя уже новая карта
+                continue
+            now = time.time()
+            if due > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            del self._due[user_id]
+            if now - due > self.max_late:
+                continue
+            await self.limiter.wait()
+            try:
+                await self._fire(user_id, last_draw)
+            except Exception:
+                log.exception("reminders: ошибка напоминания %s", user_id)
+
+    async def start(self):
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="reminders")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
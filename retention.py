@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Срок хранения events: старые события уходят в архив, база не растёт без конца.
+
+- события старше keep_days выгружаются по дням (местная дата, как в stats.py)
+  в archive_dir/ГГГГ-ММ/events-ГГГГ-ММ-ДД.jsonl.gz — одна строка JSON на событие;
+- /stats не меняется: он читает только счётчики stats_daily/user_activity/stats_totals,
+  они при архивации не трогаются;
+- файл сначала пишется целиком (.part → fsync → rename) и записывается в
+  events_archive, только потом строки удаляются из events — небольшими пачками
+  с паузой, чтобы запись живых событий не ждала; упали посередине — при
+  следующем проходе дочищаются строки, уже лежащие в архиве (id <= max_id);
+- события идущей рассылки не архивируются (по ним она продолжается после падения);
+- освободившееся место возвращается постепенно (PRAGMA incremental_vacuum).
+  Для базы, созданной до этого, один раз нужен полный VACUUM:
+    python retention.py vacuum        # при остановленном боте
+
+Архив читается без базы:
+  python retention.py query --from 2025-01-01 --to 2025-01-31 --user 123 --type card
+  python retention.py restore --from 2025-01-01 --to 2025-01-31   # обратно в events, без повторного счёта в /stats
+  python retention.py list
+  python retention.py run --keep-days 180                         # один проход вручную
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import argparse
+from pathlib import Path
+from datetime import date, datetime, timedelta
+
+from storage import Storage
+
+log = logging.getLogger(__name__)
+
+FILE_PREFIX = "events-"
+
+
+def _day_start(day: date) -> int:
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
+
+
+def partition_path(archive_dir: Path, day: date, part: int = 0) -> Path:
+    name = f"{FILE_PREFIX}{day.isoformat()}" + (f".{part}" if part else "") + ".jsonl.gz"
+    return archive_dir / day.strftime("%Y-%m") / name
+
+
+def partition_day(path: Path) -> date | None:
+    """events-2025-01-31.jsonl.gz, events-2025-01-31.1.jsonl.gz → 2025-01-31."""
+    if not path.name.startswith(FILE_PREFIX):
+        return None
+    try:
+        return date.fromisoformat(path.name[len(FILE_PREFIX):len(FILE_PREFIX) + 10])
+    except ValueError:
+        return None
+
+
+# ---------- SQL ----------
+def _oldest_ts(conn: sqlite3.Connection, since: int) -> int | None:
+    return conn.execute("SELECT MIN(ts) FROM events WHERE ts >= ?", (since,)).fetchone()[0]
+
+
+def _running_broadcast_ts(conn: sqlite3.Connection) -> int | None:
+    return conn.execute("SELECT MIN(created_ts) FROM broadcasts WHERE status='running'").fetchone()[0]
+
+
+def _archived(conn: sqlite3.Connection, day: str) -> tuple[int, int]:
+    """(max_id уже выгруженных строк дня, сколько файлов у дня)."""
+    max_id, parts = conn.execute("SELECT MAX(max_id), COUNT(*) FROM events_archive WHERE day=?", (day,)).fetchone()
+    return max_id or 0, parts
+
+
+def _record(conn: sqlite3.Connection, path: str, day: str, min_id: int, max_id: int, rows: int):
+    with conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO events_archive (file, day, min_id, max_id, rows, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (path, day, min_id, max_id, rows, int(time.time())))
+
+
+def _delete_batch(conn: sqlite3.Connection, start: int, end: int, max_id: int, limit: int) -> int:
+    with conn:
+        return conn.execute("""
+            DELETE FROM events WHERE id IN (
+                SELECT id FROM events WHERE ts >= ? AND ts < ? AND id <= ? LIMIT ?)
+        """, (start, end, max_id, limit)).rowcount
+
+
+def _vacuum_step(conn: sqlite3.Connection, pages: int) -> int:
+    """Вернуть в ОС до pages свободных страниц. Возвращает, сколько свободных осталось."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def _export_day(db_path: Path, dest: Path, start: int, end: int, after_id: int) -> tuple[int, int, int]:
+    """
+    Выгрузить строки дня (id > after_id) в dest. Своё read-only соединение
+    в отдельном потоке: поток хранилища в это время пишет живые события.
+    Возвращает (строк, min_id, max_id).
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    tmp = dest.with_name(dest.name + ".part")
+    rows, min_id, max_id = 0, 0, 0
+    try:
+        cur = conn.execute("""
+            SELECT id, user_id, event_type, ts, meta FROM events
+             WHERE ts >= ? AND ts < ? AND id > ? ORDER BY id
+        """, (start, end, after_id))
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+                while batch := cur.fetchmany(1000):
+                    for id_, user_id, event_type, ts, meta in batch:
+                        gz.write(json.dumps({"id": id_, "user_id": user_id, "event_type": event_type,
+                                             "ts": ts, "meta": meta}, ensure_ascii=False).encode() + b"\n")
+                    rows += len(batch)
+                    min_id = min_id or batch[0][0]
+                    max_id = batch[-1][0]
+            raw.flush()
+            os.fsync(raw.fileno())
+        if rows:
+            os.replace(tmp, dest)
+        else:
+            tmp.unlink()
+    finally:
+        conn.close()
+    return rows, min_id, max_id
+
+
+class Retention:
+    """
+    keep_days  — сколько дней events остаются в базе (по счётчикам /stats всё равно видно всё)
+    batch_size — строк в одной транзакции удаления, pause — пауза между ними, сек
+    interval   — как часто проверять, сек
+    """
+
+    def __init__(self, storage: Storage, archive_dir: Path, keep_days: int = 180,
+                 batch_size: int = 2000, pause: float = 0.05, interval: float = 6 * 3600):
+        self.storage = storage
+        self.archive_dir = Path(archive_dir)
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+
+        self.archived = 0
+        self.deleted = 0
+
+    async def _delete(self, start: int, end: int, max_id: int) -> int:
+        total = 0
+        while not self._closing:
+            n = await self.storage.run(_delete_batch, start, end, max_id, self.batch_size)
+            total += n
+            if n < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)   # между пачками в очередь хранилища успевают живые записи
+        self.deleted += total
+        return total
+
+    async def archive_day(self, day: date) -> int:
+        """Выгрузить один день и удалить его строки из events. Возвращает число выгруженных строк."""
+        start, end = _day_start(day), _day_start(day + timedelta(days=1))
+        done_id, parts = await self.storage.run(_archived, day.isoformat())
+        if done_id:
+            await self._delete(start, end, done_id)   # дочистить после прерванного прохода
+        dest = partition_path(self.archive_dir, day, parts)
+        rows, min_id, max_id = await asyncio.to_thread(_export_day, self.storage.path, dest, start, end, done_id)
+        if not rows:
+            return 0
+        await self.storage.run(_record, str(dest.relative_to(self.archive_dir)), day.isoformat(), min_id, max_id, rows)
+        await self._delete(start, end, max_id)
+        self.archived += rows
+        log.info("retention: %s → %s (%d событий)", day, dest.name, rows)
+        return rows
+
+    async def vacuum(self, pages: int = 1000):
+        while not self._closing and await self.storage.run(_vacuum_step, pages):
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self) -> int:
+        cutoff = _day_start(date.today() - timedelta(days=self.keep_days))
+        running = await self.storage.run(_running_broadcast_ts)
+        if running is not None:
+            cutoff = min(cutoff, _day_start(date.fromtimestamp(running)))
+
+        total, since, deleted = 0, 0, self.deleted
+        while not self._closing:
+            oldest = await self.storage.run(_oldest_ts, since)
+            if oldest is None or oldest >= cutoff:
+                break
+            day = date.fromtimestamp(oldest)
+            total += await self.archive_day(day)
+            since = _day_start(day + timedelta(days=1))
+        if self.deleted > deleted:
+            await self.vacuum()
+        return total
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await self.run_once()
+            except Exception:
+                log.exception("retention: проход не удался")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="retention")
+
+    async def close(self):
+        # текущая пачка удаления дописывается, новые не начинаются
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+
+# ---------- чтение архива ----------
+def iter_partitions(archive_dir: Path, since: date | None = None, until: date | None = None):
+    for path in sorted(archive_dir.glob(f"*/{FILE_PREFIX}*.jsonl.gz")):
+        day = partition_day(path)
+        if day is None or (since and day < since) or (until and day > until):
+            continue
+        yield path
+
+
+def iter_events(archive_dir: Path, since: date | None = None, until: date | None = None,
+                user_id: int | None = None, event_type: str | None = None):
+    """События из архива по порядку дней; фильтры по пользователю и типу."""
+    for path in iter_partitions(archive_dir, since, until):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                ev = json.loads(line)
+                if user_id is not None and ev["user_id"] != user_id:
+                    continue
+                if event_type is not None and ev["event_type"] != event_type:
+                    continue
+                yield ev
+
+
+def restore(db_path: Path, archive_dir: Path, since: date | None, until: date | None,
+            user_id: int | None = None, event_type: str | None = None) -> int:
+    """
+    Вернуть события в events с прежними id (для разбора по сырым событиям).
+    Счётчики /stats не трогаются — эти события в них уже учтены; следующий
+    проход архивации снова уберёт их из базы (файлы остаются на месте).
+    """
+    conn = sqlite3.connect(db_path)
+    n = 0
+    try:
+        batch = []
+        with conn:
+            for ev in iter_events(archive_dir, since, until, user_id, event_type):
+                batch.append((ev["id"], ev["user_id"], ev["event_type"], ev["ts"], ev["meta"]))
+                if len(batch) >= 1000:
+                    n += conn.executemany("INSERT OR IGNORE INTO events (id, user_id, event_type, ts, meta) "
+                                          "VALUES (?,?,?,?,?)", batch).rowcount
+                    batch.clear()
+            if batch:
+                n += conn.executemany("INSERT OR IGNORE INTO events (id, user_id, event_type, ts, meta) "
+                                      "VALUES (?,?,?,?,?)", batch).rowcount
+    finally:
+        conn.close()
+    return n
+
+
+def full_vacuum(db_path: Path):
+    """Один раз для старой базы: включить auto_vacuum=INCREMENTAL (нужен полный VACUUM)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+async def _run_cli(args) -> int:
+    storage = Storage(args.db)
+    await storage.open()
+    try:
+        retention = Retention(storage, args.archive, keep_days=args.keep_days)
+        return await retention.run_once()
+    finally:
+        await storage.close()
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Архив событий: выгрузка, просмотр, восстановление")
+    p.add_argument("--db", type=Path, default=Path(os.getenv("DB_PATH", "subscribers.db")))
+    p.add_argument("--archive", type=Path, default=Path(os.getenv("ARCHIVE_DIR", "archive")))
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="один проход архивации")
+    r.add_argument("--keep-days", type=int, default=int(os.getenv("EVENTS_KEEP_DAYS", "180") or 180))
+    sub.add_parser("list", help="выгруженные партиции")
+    sub.add_parser("vacuum", help="полный VACUUM и включение incremental auto_vacuum (бот остановлен)")
+    for name in ("query", "restore"):
+        q = sub.add_parser(name, help="события из архива в stdout (JSONL)" if name == "query"
+                           else "вернуть события из архива в events")
+        q.add_argument("--from", dest="since", type=date.fromisoformat)
+        q.add_argument("--to", dest="until", type=date.fromisoformat)
+        q.add_argument("--user", type=int)
+        q.add_argument("--type", dest="event_type")
+    args = p.parse_args(argv)
+
+    if args.cmd == "run":
+        logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(message)s")
+        print(f"Выгружено событий: {asyncio.run(_run_cli(args))}")
+    elif args.cmd == "list":
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        for file, day, rows, min_id, max_id in conn.execute(
+                "SELECT file, day, rows, min_id, max_id FROM events_archive ORDER BY day, file"):
+            print(f"{day}  {rows:>8}  id {min_id}..{max_id}  {file}")
+        conn.close()
+    elif args.cmd == "vacuum":
+        full_vacuum(args.db)
+        print("Готово: auto_vacuum=INCREMENTAL")
+    elif args.cmd == "query":
+        for ev in iter_events(args.archive, args.since, args.until, args.user, args.event_type):
+            sys.stdout.write(json.dumps(ev, ensure_ascii=False) + "\n")
+    elif args.cmd == "restore":
+        print(f"Восстановлено событий: {restore(args.db, args.archive, args.since, args.until, args.user, args.event_type)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик апдейтов: вместо «каждый апдейт — своя задача, сколько угодно».
+
+- апдейты разных пользователей идут параллельно, но не больше max_concurrency;
+- апдейты одного пользователя — строго по очереди, в порядке прихода
+  (двойной тап по карте не выполняется параллельно сам с собой);
+- повторный update_id отбрасывается (в памяти + state.mark_update между процессами);
+- в очереди не больше max_pending апдейтов: дальше webhook отвечает 503
+  (Telegram повторит позже), а polling не забирает новые апдейты,
+  пока не освободится место; один пользователь — не больше max_per_user;
+- перегрузка пишется в лог при входе и выходе, счётчики — в /metrics.
+
+Воркер, закончив апдейт, уступает слот следующему ждущему пользователю,
+если такой есть: один активный пользователь не занимает слот навсегда.
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from aiogram import Bot, Dispatcher, types
+
+from state import StateBackend, update_user_id
+
+log = logging.getLogger(__name__)
+
+
+class UpdateScheduler:
+    def __init__(self, dp: Dispatcher, state: StateBackend | None = None, max_concurrency: int = 64,
+                 max_pending: int = 5_000, max_per_user: int = 50, seen_size: int = 10_000):
+        self.dp = dp
+        self.state = state
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.seen_size = seen_size
+
+        self._queues: dict[object, deque[types.Update]] = {}   # пользователь → его очередь
+        self._ready: deque = deque()                           # пользователи, ждущие слота
+        self._seen: OrderedDict[int, None] = OrderedDict()     # недавние update_id
+        self._tasks: set[asyncio.Task] = set()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._overloaded = False
+
+        self.active = 0
+        self.pending = 0
+        self.processed = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.errors = 0
+
+    # --- приём ---
+    def submit(self, update: types.Update) -> bool:
+        """
+        Поставить апдейт в очередь, не дожидаясь. False — очередь полна,
+        апдейт не принят (его нужно доставить ещё раз).
+        """
+        if update.update_id in self._seen:
+            self.duplicates += 1
+            return True
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            self._set_overloaded(True)
+            return False
+
+        key = update_user_id(update)
+        if key is None:
+            key = ("update", update.update_id)   # без пользователя — сам по себе
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ready.append(key)
+        elif len(queue) >= self.max_per_user:
+            # один пользователь заваливает апдейтами — лишние не копим
+            self.dropped += 1
+            return True
+
+        self._seen[update.update_id] = None
+        if len(self._seen) > self.seen_size:
+            self._seen.popitem(last=False)
+        queue.append(update)
+        self.pending += 1
+        self._idle.clear()
+        self._pump()
+        return True
+
+    async def put(self, update: types.Update):
+        """Как submit, но при полной очереди ждёт места (polling)."""
+        await self.wait_room()
+        self.submit(update)
+
+    async def wait_room(self):
+        while self.pending >= self.max_pending:
+            self._room.clear()
+            self._set_overloaded(True)
+            await self._room.wait()
+
+    def _set_overloaded(self, value: bool):
+        if value == self._overloaded:
+            return
+        self._overloaded = value
+        if value:
+            log.warning("scheduler: перегрузка, в очереди %d апдейтов, активно %d", self.pending, self.active)
+        else:
+            log.warning("scheduler: очередь разгрузилась (отклонено %d)", self.rejected)
+
+    # --- обработка ---
+    def _pump(self):
+        while self._ready and self.active < self.max_concurrency:
+            key = self._ready.popleft()
+            self.active += 1
+            task = asyncio.create_task(self._worker(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _worker(self, key):
+        try:
+            queue = self._queues[key]
+            while queue:
+                update = queue.popleft()
+                try:
+                    await self._process(update, key)
+                finally:
+                    self.pending -= 1
+                    if self.pending < self.max_pending:
+                        self._room.set()
+                        self._set_overloaded(False)
+                if queue and self._ready:
+                    self._ready.append(key)   # уступаем слот; очередь пользователя остаётся за ним
+                    return
+            del self._queues[key]
+        finally:
+            self.active -= 1
+            self._pump()
+            if not self.pending and not self.active:
+                self._idle.set()
+
+    async def _process(self, update: types.Update, key):
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        try:
+            if self.state is None:
+                await self.dp.process_update(update)
+                self.processed += 1
+                return
+            if not await self.state.mark_update(update.update_id):
+                self.duplicates += 1   # уже обработал другой процесс
+                return
+            if isinstance(key, int):
+                async with self.state.user_lock(key):
+                    await self.dp.process_update(update)
+            else:
+                await self.dp.process_update(update)
+            self.processed += 1
+        except Exception:
+            self.errors += 1
+            log.exception("scheduler: ошибка обработки update_id=%s", update.update_id)
+
+    async def close(self, timeout: float | None = None):
+        """Дождаться обработки всего принятого (не дольше timeout)."""
+        if self.pending or self.active:
+            log.info("scheduler: жду %d апдейтов", self.pending)
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                log.warning("scheduler: не дождался %d апдейтов", self.pending)
+
+
+class SchedulingDispatcher(Dispatcher):
+    """
+    Dispatcher, у которого polling отдаёт апдейты планировщику. Пока очередь
+    полна, getUpdates не вызывается — апдейты ждут на стороне Telegram.
+    """
+
+    def __init__(self, bot: Bot, *args, scheduler_options: dict | None = None, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.scheduler = UpdateScheduler(self, **(scheduler_options or {}))
+
+        get_updates = bot.get_updates
+
+        async def paced_get_updates(*a, **kw):
+            await self.scheduler.wait_room()
+            return await get_updates(*a, **kw)
+
+        bot.get_updates = paced_get_updates
+
+    async def process_updates(self, updates, fast: bool = True):
+        for update in updates:
+            await self.scheduler.put(update)
+        return []
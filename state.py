@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Интерфейс общего состояния бота.
+
+Всё, что должно быть общим у нескольких процессов бота:
+  • пользователи (флаги подписки/согласия, last_seen);
+  • события (аналитика);
+  • «замок» на карту;
+  • дедупликация update_id (Telegram может прислать апдейт повторно,
+    а при нескольких воркерах — разным воркерам);
+  • последовательная обработка апдейтов одного пользователя.
+
+Реализации:
+  storage.Storage          — SQLite, один процесс (или несколько на одной машине);
+  redis_state.RedisBackend — Redis, несколько воркеров на разных машинах.
+
+Методы без реализации по умолчанию — абстрактные: бэкенд, где чего-то
+не хватает, не создастся вовсе, а не упадёт на первом апдейте.
+"""
+
+import abc
+import contextlib
+
+from aiogram import types
+
+
+class StateBackend(abc.ABC):
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    # --- пользователи ---
+    @abc.abstractmethod
+    async def start_user(self, u) -> bool:
+        """
+        /start: upsert (subscribe_flag=0) + отметка consent_shown, атомарно.
+        True — приглашение к рассылке нужно показать (впервые).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def upsert_user(self, u, subscribe_flag: int | None = None, consent_shown: int | None = None):
+        """Вставляет или обновляет пользователя + last_seen_ts."""
+        raise NotImplementedError
+
+    # --- события ---
+    @abc.abstractmethod
+    async def insert_events(self, rows: list[tuple[int, str, int, str | None]]):
+        """Пачка (user_id, event_type, ts, meta)."""
+        raise NotImplementedError
+
+    # --- замок на карту ---
+    @abc.abstractmethod
+    async def get_last_draw(self, user_id: int) -> int | None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def try_lock_card(self, user_id: int, now: int, lock_seconds: int) -> bool:
+        """Поставить замок, если его нет или он истёк — атомарно. True — замок наш."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def import_locks(self, rows: list[tuple[int, int]], lock_seconds: int):
+        """Разовый импорт (user_id, last_draw) из старого usage.json."""
+        raise NotImplementedError
+
+    # --- апдейты ---
+    @abc.abstractmethod
+    async def mark_update(self, update_id: int) -> bool:
+        """Отметить update_id обработанным. False — его уже обрабатывали (дубль)."""
+        raise NotImplementedError
+
+    @contextlib.asynccontextmanager
+    async def user_lock(self, user_id: int):
+        """Апдейты одного пользователя не обрабатываются параллельно разными процессами."""
+        yield
+
+
+def update_user_id(update: types.Update) -> int | None:
+    """От кого апдейт: по нему апдейты одного пользователя выстраиваются в очередь."""
+    for obj in (update.message, update.callback_query, update.edited_message,
+                update.inline_query, update.chosen_inline_result, update.my_chat_member,
+                update.pre_checkout_query, update.shipping_query):
+        if obj is not None and obj.from_user is not None:
+            return obj.from_user.id
+    return None
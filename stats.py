@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Инкрементальная статистика для /stats.
+
+- stats_daily (day, metric, key) → value: счётчики событий по дням
+  (metric = event_type, key = meta: start, card/think:3, subscribe/manual, ...)
+  + metric="active" — сколько разных пользователей было активно в этот день;
+- user_activity (user_id → last_day, last_ts): по индексу на last_ts считаем
+  активных за 1/7/30 дней без сканирования events;
+- активность — только действия самого пользователя: исходы рассылки и
+  напоминаний (OUTBOUND_EVENTS) считаются как события, но не как активность;
+- stats_totals: всего пользователей и подписчиков, ведутся триггерами на users.
+
+Счётчики обновляются в той же транзакции, что и запись пачки событий
+(см. Storage.insert_events), так что /stats не трогает таблицу events.
+"""
+
+import time
+import sqlite3
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+WINDOWS = (1, 7, 30)
+# события, которые инициирует бот (broadcast.py, reminders.py), а не пользователь
+OUTBOUND_EVENTS = ("broadcast", "reminder")
+_OUTBOUND_SQL = ", ".join(f"'{t}'" for t in OUTBOUND_EVENTS)
+
+
+def _day(ts: int) -> str:
+    return datetime.fromtimestamp(ts).date().isoformat()
+
+
+# ---------- запись ----------
+def apply_rollups(cur: sqlite3.Cursor, rows: list[tuple[int, str, int, str | None]]):
+    """Добавить пачку событий (user_id, event_type, ts, meta) в счётчики."""
+    counts: Counter = Counter()
+    days: dict[int, set[str]] = defaultdict(set)
+    last_ts: dict[int, int] = {}
+    for user_id, event_type, ts, meta in rows:
+        day = _day(ts)
+        counts[(day, event_type, meta or "")] += 1
+        if event_type in OUTBOUND_EVENTS:
+            continue
+        days[user_id].add(day)
+        last_ts[user_id] = max(ts, last_ts.get(user_id, 0))
+
+    # первый раз за день видим пользователя → +1 к active этого дня
+    for user_id, user_days in days.items():
+        row = cur.execute("SELECT last_day FROM user_activity WHERE user_id=?", (user_id,)).fetchone()
+        prev = row[0] if row else None
+        for day in sorted(user_days):
+            if prev is None or day > prev:
+                counts[(day, "active", "")] += 1
+                prev = day
+        cur.execute("""
+            INSERT INTO user_activity (user_id, last_day, last_ts) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE
+               SET last_day=MAX(last_day, excluded.last_day), last_ts=MAX(last_ts, excluded.last_ts)
+        """, (user_id, prev, last_ts[user_id]))
+
+    cur.executemany("""
+        INSERT INTO stats_daily (day, metric, key, value) VALUES (?, ?, ?, ?)
+        ON CONFLICT(day, metric, key) DO UPDATE SET value=value+excluded.value
+    """, [(day, metric, key, n) for (day, metric, key), n in counts.items()])
+
+
+def backfill(cur: sqlite3.Cursor):
+    """Разово посчитать счётчики по уже накопленным events/users (старая база)."""
+    cur.execute("""
+        INSERT INTO stats_daily (day, metric, key, value)
+        SELECT date(ts, 'unixepoch', 'localtime'), event_type, COALESCE(meta, ''), COUNT(*)
+          FROM events GROUP BY 1, 2, 3
+    """)
+    cur.execute("""
+        INSERT INTO stats_daily (day, metric, key, value)
+        SELECT day, 'active', '', COUNT(DISTINCT user_id)
+          FROM (SELECT date(ts, 'unixepoch', 'localtime') AS day, user_id FROM events
+                 WHERE event_type NOT IN ({outbound}))
+         GROUP BY day
+    """.format(outbound=_OUTBOUND_SQL))
+    cur.execute("""
+        INSERT INTO user_activity (user_id, last_day, last_ts)
+        SELECT user_id, date(MAX(ts), 'unixepoch', 'localtime'), MAX(ts) FROM events
+         WHERE event_type NOT IN ({outbound})
+         GROUP BY user_id
+    """.format(outbound=_OUTBOUND_SQL))
+    cur.execute("""
+        INSERT OR REPLACE INTO stats_totals (name, value) VALUES
+            ('users', (SELECT COUNT(*) FROM users)),
+            ('subscribed', (SELECT COUNT(*) FROM users WHERE subscribe_flag=1))
+    """)
+
+
+# ---------- чтение ----------
+def report(conn: sqlite3.Connection, now: float | None = None) -> dict:
+    """
+    Всё для /stats одним заходом в базу; каждый запрос — по индексу
+    и не зависит от размера истории events.
+    """
+    now = now or time.time()
+    today = date.fromtimestamp(now)
+    totals = dict(conn.execute("SELECT name, value FROM stats_totals"))
+    out = {
+        "users": totals.get("users", 0),
+        "subscribed": totals.get("subscribed", 0),
+        "active": {},
+        "counts": {},
+        "funnel": {},
+    }
+    for n in WINDOWS:
+        since_ts = int(now - n * 86400)
+        out["active"][n] = conn.execute(
+            "SELECT COUNT(*) FROM user_activity WHERE last_ts>=?", (since_ts,)
+        ).fetchone()[0]
+
+        # окно в n календарных дней, включая сегодня
+        since_day = (today - timedelta(days=n - 1)).isoformat()
+        counts = {
+            (metric, key): value for metric, key, value in conn.execute("""
+                SELECT metric, key, SUM(value) FROM stats_daily
+                 WHERE day>=? AND metric IN ('start', 'topic_menu', 'topic', 'card', 'card_locked',
+                                             'subscribe', 'unsubscribe')
+                 GROUP BY metric, key
+            """, (since_day,))
+        }
+        by_metric: Counter = Counter()
+        for (metric, _key), value in counts.items():
+            by_metric[metric] += value
+        out["counts"][n] = by_metric
+
+        topics = {k for (m, k) in counts if m == "topic"}
+        topics |= {k.split(":", 1)[0] for (m, k) in counts if m == "card"}
+        funnel = {}
+        for topic in sorted(topics):
+            funnel[topic] = {
+                "topic": counts.get(("topic", topic), 0),
+                "card": sum(v for (m, k), v in counts.items() if m == "card" and k.startswith(f"{topic}:")),
+                "locked": counts.get(("card_locked", topic), 0),
+            }
+        out["funnel"][n] = funnel
+    return out
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище пользователей и событий (SQLite).
+
+Одно долгоживущее соединение в режиме WAL живёт в отдельном потоке
+(ThreadPoolExecutor на 1 воркер), хэндлеры только await-ят корутины —
+медленный fsync больше не останавливает event loop aiogram.
+
+Storage — SQLite-реализация общего состояния (state.StateBackend).
+Для нескольких воркеров на разных машинах — redis_state.RedisBackend.
+"""
+
+import time
+import sqlite3
+import asyncio
+import functools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import stats
+from state import StateBackend
+from migrations import migrate
+from locks import read_usage_json, archive_usage_json
+
+DEDUP_TTL = 86400   # сколько помним обработанные update_id, сек
+
+
+def _upsert_user(cur: sqlite3.Cursor, u, now: int,
+                 subscribe_flag: int | None = None, consent_shown: int | None = None):
+    """INSERT нового пользователя или UPDATE last_seen_ts (+ переданные флаги)."""
+    sets = ["last_seen_ts=excluded.last_seen_ts"]
+    if subscribe_flag is not None:
+        sets.append("subscribe_flag=excluded.subscribe_flag")
+    if consent_shown is not None:
+        sets.append("consent_shown=excluded.consent_shown")
+    cur.execute(f"""
+        INSERT INTO users (user_id, username, first_name, last_name,
+                           first_seen_ts, last_seen_ts, subscribe_flag, consent_shown)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET {", ".join(sets)}
+    """, (
+        u.id, u.username, u.first_name, u.last_name,
+        now, now,
+        int(subscribe_flag or 0), int(consent_shown or 0)
+    ))
+
+
+def _get_last_draw(conn: sqlite3.Connection, user_id: int) -> int | None:
+    row = conn.execute("SELECT last_draw FROM card_locks WHERE user_id=?", (user_id,)).fetchone()
+    return int(row[0]) if row else None
+
+
+def _set_last_draw(conn: sqlite3.Connection, user_id: int, now: int, unlock_before: int) -> bool:
+    """Ставит замок, только если его нет или он истёк. True — замок наш."""
+    with conn:
+        cur = conn.execute("""
+            INSERT INTO card_locks (user_id, last_draw) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_draw=excluded.last_draw
+            WHERE card_locks.last_draw <= ?
+        """, (user_id, now, unlock_before))
+        return cur.rowcount > 0
+
+
+def _import_locks(conn: sqlite3.Connection, rows: list[tuple[int, int]]):
+    with conn:
+        conn.executemany("""
+            INSERT INTO card_locks (user_id, last_draw) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_draw=MAX(last_draw, excluded.last_draw)
+        """, rows)
+
+
+def _mark_update(conn: sqlite3.Connection, update_id: int, now: int, prune: bool) -> bool:
+    with conn:
+        cur = conn.execute("INSERT OR IGNORE INTO processed_updates (update_id, ts) VALUES (?, ?)",
+                           (update_id, now))
+        if prune:
+            conn.execute("DELETE FROM processed_updates WHERE ts < ?", (now - DEDUP_TTL,))
+        return cur.rowcount > 0
+
+
+def op_name(fn) -> str:
+    """Storage.start_user.<locals>._start → Storage.start_user; storage._set_last_draw как есть."""
+    name = fn.__qualname__.split(".<locals>")[0]
+    return name if "." in name else f"{fn.__module__}.{name}"
+
+
+class Storage(StateBackend):
+    """
+    Асинхронная обёртка над одним WAL-соединением.
+    Все запросы выполняются строго по очереди в выделенном потоке,
+    поэтому соединение не нужно защищать блокировками.
+
+    Несколько процессов на одной машине могут делить один файл: замки и
+    дедупликация — условные вставки, SQLite сам их сериализует. Порядок
+    апдейтов одного пользователя между процессами не гарантируется
+    (user_lock — пустой), для этого — RedisBackend.
+    """
+
+    def __init__(self, path: str | Path, usage_file: Path | None = None,
+                 executor: ThreadPoolExecutor | None = None):
+        self.path = Path(path)
+        self.usage_file = usage_file   # старый usage.json, переносится в card_locks при open
+        # executor с одним потоком можно делить между базами нескольких ботов (tenants.py)
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: sqlite3.Connection | None = None
+        # хук для замеров: on_op(имя операции, ожидание в очереди, выполнение), секунды
+        self.on_op = None
+        self._marked = 0
+
+    # --- служебное ---
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # действует только для новой базы; старую переводит `python retention.py vacuum`
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")   # в WAL это безопасно и без fsync на каждый commit
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _call(self, fn, *args, **kwargs):
+        if self._conn is None:
+            self._conn = self._connect()
+        return fn(self._conn, *args, **kwargs)
+
+    def _timed_call(self, fn, queued_at: float, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._call(fn, *args, **kwargs)
+        finally:
+            done = time.perf_counter()
+            self.on_op(op_name(fn), started - queued_at, done - started)
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполнить fn(conn, *args, **kwargs) в потоке хранилища."""
+        loop = asyncio.get_running_loop()
+        if self.on_op is None:
+            call = functools.partial(self._call, fn, *args, **kwargs)
+        else:
+            call = functools.partial(self._timed_call, fn, time.perf_counter(), *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def open(self):
+        """Миграции схемы (migrations.py) и перенос usage.json — один раз при старте, не на пути запроса."""
+        await self.run(migrate)
+        if self.usage_file is not None and self.usage_file.exists():
+            rows = read_usage_json(self.usage_file)
+            await self.run(_import_locks, rows)
+            archive_usage_json(self.usage_file, len(rows))
+
+    async def close(self):
+        def _close(conn: sqlite3.Connection):
+            conn.close()
+            self._conn = None
+        if self._conn is not None:
+            await self.run(_close)
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    # --- события ---
+    async def insert_events(self, rows: list[tuple[int, str, int, str | None]]):
+        """Пачка (user_id, event_type, ts, meta) + счётчики /stats — одной транзакцией."""
+        def _insert(conn: sqlite3.Connection):
+            with conn:
+                cur = conn.cursor()
+                cur.executemany(
+                    "INSERT INTO events (user_id, event_type, ts, meta) VALUES (?,?,?,?)", rows
+                )
+                stats.apply_rollups(cur, rows)
+        await self.run(_insert)
+
+    # --- пользователи ---
+    async def upsert_user(self, u, subscribe_flag: int | None = None, consent_shown: int | None = None):
+        """Вставляет или обновляет пользователя + last_seen_ts."""
+        def _upsert(conn: sqlite3.Connection):
+            _upsert_user(conn.cursor(), u, int(time.time()), subscribe_flag, consent_shown)
+            conn.commit()
+        await self.run(_upsert)
+
+    async def start_user(self, u) -> bool:
+        """
+        Всё, что нужно /start, одной транзакцией:
+        upsert (subscribe_flag=0) + отметка consent_shown.
+        Возвращает True, если приглашение к рассылке нужно показать (впервые).
+        """
+        def _start(conn: sqlite3.Connection):
+            now = int(time.time())
+            with conn:
+                cur = conn.cursor()
+                _upsert_user(cur, u, now, subscribe_flag=0)
+                cur.execute(
+                    "UPDATE users SET consent_shown=1 WHERE user_id=? AND COALESCE(consent_shown, 0)=0",
+                    (u.id,)
+                )
+                return cur.rowcount > 0
+        return await self.run(_start)
+
+    # --- замок на карту ---
+    async def get_last_draw(self, user_id: int) -> int | None:
+        return await self.run(_get_last_draw, user_id)
+
+    async def try_lock_card(self, user_id: int, now: int, lock_seconds: int) -> bool:
+        return await self.run(_set_last_draw, user_id, now, now - lock_seconds)
+
+    async def import_locks(self, rows: list[tuple[int, int]], lock_seconds: int):
+        await self.run(_import_locks, rows)
+
+    # --- апдейты ---
+    async def mark_update(self, update_id: int) -> bool:
+        # старые update_id чистим изредка, а не на каждом апдейте
+        self._marked += 1
+        return await self.run(_mark_update, update_id, int(time.time()), self._marked % 1000 == 0)
+
+    # --- статистика ---
+    async def stats_report(self) -> dict:
+        """Сводка для /stats из заранее посчитанных счётчиков (stats.py)."""
+        return await self.run(stats.report)
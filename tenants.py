@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Несколько ботов в одном процессе (BOTS_FILE): одни и те же хэндлеры, один
+event loop, общие HTTP-сессия к Bot API, потоки SQLite и клиент Redis.
+Состояние у каждого бота своё: база, колода, кэши, очередь отправки, рассылка.
+
+Формат BOTS_FILE (JSON, пути — относительно файла):
+[
+  {"name": "anna", "token": "123:ABC", "channel_link": "https://t.me/annap_club",
+   "owner_username": "@AnnaPClub", "decks_file": "decks.json", "db_path": "anna.db"},
+  {"name": "maria", ...}
+]
+Необязательные поля: usage_file (старый usage.json этого бота), archive_dir
+(по умолчанию ARCHIVE_DIR/<name>), webhook_path (по умолчанию /webhook/<name>).
+"""
+
+import json
+import itertools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+
+REQUIRED = ("name", "token", "channel_link", "owner_username", "decks_file", "db_path")
+OPTIONAL = ("usage_file", "archive_dir", "webhook_path")
+
+
+class BotConfig:
+    """
+    Всё, чем один бот отличается от другого. name=None — единственный бот
+    из переменных окружения (прежние ключи Redis и пути без суффиксов).
+    """
+
+    def __init__(self, name: str | None, token: str, channel_link: str, owner_username: str,
+                 decks_file: Path, db_path: Path, usage_file: Path | None = None,
+                 archive_dir: Path | None = None, webhook_path: str | None = None):
+        self.name = name
+        self.token = token
+        self.channel_link = channel_link
+        self.owner_username = owner_username
+        self.decks_file = Path(decks_file)
+        self.db_path = Path(db_path)
+        self.usage_file = Path(usage_file) if usage_file else None
+        self.archive_dir = Path(archive_dir) if archive_dir else None
+        self.webhook_path = webhook_path
+
+    @property
+    def redis_prefix(self) -> str:
+        return f"clarity:{self.name}:" if self.name else "clarity:"
+
+    def __repr__(self) -> str:
+        return f"BotConfig({self.name or 'main'}, db={self.db_path.name})"   # без токена
+
+
+def load_bots(path: Path, archive_root: Path) -> list[BotConfig]:
+    """Прочитать и проверить BOTS_FILE. Ошибка — отказ стартовать, а не «часть ботов молча не работает»."""
+    try:
+        data = json.loads(path.read_text("utf-8"))
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Не удалось прочитать {path.name}: {e}") from e
+    if not isinstance(data, list) or not data:
+        raise RuntimeError(f"{path.name}: ожидался непустой список ботов.")
+
+    base = path.resolve().parent
+    bots, seen = [], {"name": set(), "token": set(), "db_path": set()}
+    for i, rec in enumerate(data):
+        where = f"{path.name}[{i}]"
+        if not isinstance(rec, dict):
+            raise RuntimeError(f"{where}: ожидался объект.")
+        missing = [k for k in REQUIRED if not str(rec.get(k) or "").strip()]
+        if missing:
+            raise RuntimeError(f"{where}: не заданы {', '.join(missing)}.")
+        unknown = set(rec) - set(REQUIRED) - set(OPTIONAL)
+        if unknown:
+            raise RuntimeError(f"{where}: неизвестные поля {', '.join(sorted(unknown))}.")
+
+        name = str(rec["name"]).strip()
+        if not name.replace("_", "").replace("-", "").isalnum():
+            raise RuntimeError(f"{where}: name — латиница, цифры, - и _ (идёт в пути и ключи Redis).")
+        cfg = BotConfig(
+            name=name,
+            token=str(rec["token"]).strip(),
+            channel_link=str(rec["channel_link"]).strip(),
+            owner_username=str(rec["owner_username"]).strip(),
+            decks_file=base / rec["decks_file"],
+            db_path=base / rec["db_path"],
+            usage_file=base / rec["usage_file"] if rec.get("usage_file") else None,
+            archive_dir=base / rec["archive_dir"] if rec.get("archive_dir") else archive_root / name,
+            webhook_path=rec.get("webhook_path") or f"/webhook/{name}",
+        )
+        for key, value in (("name", cfg.name), ("token", cfg.token), ("db_path", cfg.db_path.resolve())):
+            if value in seen[key]:
+                raise RuntimeError(f"{where}: {key} повторяется — у каждого бота свой.")
+            seen[key].add(value)
+        bots.append(cfg)
+    return bots
+
+
+class SharedResources:
+    """
+    Общее для всех ботов процесса:
+    - одна aiohttp-сессия (пул соединений к Bot API) вместо своей у каждого Bot;
+    - storage_threads потоков SQLite: базы ботов раскладываются по ним по кругу
+      (у каждой базы по-прежнему ровно один поток, см. storage.py);
+    - один клиент Redis (пул соединений), ключи ботов разделены префиксом.
+    """
+
+    def __init__(self, storage_threads: int = 2):
+        self._executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{i}")
+                           for i in range(max(1, storage_threads))]
+        self._next_executor = itertools.cycle(self._executors)
+        self._redis = None
+        self._bots: list[Bot] = []
+
+    def storage_executor(self) -> ThreadPoolExecutor:
+        return next(self._next_executor)
+
+    @property
+    def storage_queue(self) -> int:
+        """Операций, ждущих своей очереди во всех потоках SQLite."""
+        return sum(e._work_queue.qsize() for e in self._executors)
+
+    def redis(self, url: str):
+        if self._redis is None:
+            try:
+                from redis import asyncio as aioredis
+            except ImportError as e:
+                raise RuntimeError("Для STATE_BACKEND=redis нужен пакет redis: pip install redis") from e
+            self._redis = aioredis.from_url(url, decode_responses=True)
+        return self._redis
+
+    def add_bot(self, bot: Bot):
+        self._bots.append(bot)
+
+    async def open(self):
+        """Сессию создаёт первый бот (со своими настройками SSL), остальные её используют."""
+        if self._bots:
+            session = await self._bots[0].get_session()
+            for bot in self._bots[1:]:
+                bot._session = session   # у aiogram 2 нет публичного способа передать сессию
+
+    async def close(self):
+        if self._bots:
+            await (await self._bots[0].get_session()).close()
+        if self._redis is not None:
+            await self._redis.aclose()
+        for executor in self._executors:
+            executor.shutdown(wait=True)
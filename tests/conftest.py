@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""Модули бота лежат в корне репозитория, без пакета."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
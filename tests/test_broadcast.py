@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from collections import Counter
+
+from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.utils.exceptions import BotBlocked, Unauthorized
+
+import broadcast
+from broadcast import Broadcaster, RateLimiter
+from fake_telegram import FakeTelegram
+from storage import Storage
+
+USERS = 30
+
+
+def test_resume_after_crash_does_not_resend(tmp_path, monkeypatch):
+    monkeypatch.setattr(broadcast, "CONCURRENCY", 1)
+
+    async def scenario():
+        fake = FakeTelegram()
+        await fake.start()
+        storage = Storage(tmp_path / "test.db")
+        await storage.open()
+        for uid in range(1, USERS + 1):
+            await storage.upsert_user(types.User(id=uid, is_bot=False, first_name="u"), subscribe_flag=1)
+        bot = Bot("1:TEST", server=TelegramAPIServer.from_base(fake.base_url))
+
+        # «падение» посреди пачки: задача рассылки обрывается после 10-го записанного исхода
+        first = Broadcaster(bot, storage)
+        first.limiter = RateLimiter(1000)
+        insert_events, written = storage.insert_events, []
+
+        async def crash_after_ten(rows):
+            await insert_events(rows)
+            written.extend(rows)
+            if len(written) == 10:
+                for task in first._tasks.values():
+                    task.cancel()
+        storage.insert_events = crash_after_ten
+        bid = await first.start(from_chat_id=1, message_id=1)
+        while first.running:
+            await asyncio.sleep(0.01)
+        storage.insert_events = insert_events
+        assert (await storage.run(broadcast._get, bid))["status"] == "running"
+
+        second = Broadcaster(bot, storage)
+        second.limiter = RateLimiter(1000)
+        await second.resume_pending()
+        while second.running:
+            await asyncio.sleep(0.01)
+
+        row = await storage.run(broadcast._get, bid)
+        sent = Counter(int(p["chat_id"]) for method, p in fake.calls if method == "copyMessage")
+        await (await bot.get_session()).close()
+        await storage.close()
+        await fake.close()
+
+        assert row["status"] == "done"
+        # доставленные до падения тоже в счётчике
+        assert row["sent"] == USERS
+        assert set(sent) == set(range(1, USERS + 1))
+        # повтор возможен только для сообщения, которое было в полёте в момент падения
+        assert sum(n - 1 for n in sent.values()) <= broadcast.CONCURRENCY
+    asyncio.run(scenario())
+
+
+class StubBot:
+    """copy_message: error(uid) → исключение или None (успех)."""
+
+    def __init__(self, error=lambda uid: None):
+        self.error = error
+        self.sent: list[int] = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        exc = self.error(chat_id)
+        if exc is not None:
+            raise exc
+        self.sent.append(chat_id)
+
+
+async def subscribers(storage: Storage, n: int):
+    for uid in range(1, n + 1):
+        await storage.upsert_user(types.User(id=uid, is_bot=False, first_name="u"), subscribe_flag=1)
+
+
+async def run_to_end(b: Broadcaster):
+    while b.running:
+        await asyncio.sleep(0.01)
+
+
+def test_revoked_token_stops_broadcast_without_unsubscribing(tmp_path, caplog):
+    async def scenario():
+        storage = Storage(tmp_path / "test.db")
+        await storage.open()
+        await subscribers(storage, 10)
+
+        revoked = Broadcaster(StubBot(lambda uid: Unauthorized("Unauthorized")), storage)
+        revoked.limiter = RateLimiter(1000)
+        bid = await revoked.start(from_chat_id=1, message_id=1)
+        await run_to_end(revoked)
+        stopped = await storage.run(broadcast._get, bid)
+        still_subscribed = await storage.run(
+            lambda conn: conn.execute("SELECT COUNT(*) FROM users WHERE subscribe_flag=1").fetchone()[0])
+
+        fixed_bot = StubBot()
+        fixed = Broadcaster(fixed_bot, storage)
+        fixed.limiter = RateLimiter(1000)
+        await fixed.resume_pending()
+        await run_to_end(fixed)
+        row = await storage.run(broadcast._get, bid)
+        await storage.close()
+        return stopped, still_subscribed, row, fixed_bot
+
+    stopped, still_subscribed, row, fixed_bot = asyncio.run(scenario())
+    assert stopped["status"] == "running" and stopped["blocked"] == 0
+    assert still_subscribed == 10
+    assert "broadcast #1: остановлена" in caplog.text
+    assert row["status"] == "done" and row["sent"] == 10
+    assert sorted(fixed_bot.sent) == list(range(1, 11))
+
+
+def test_blocked_users_are_unsubscribed(tmp_path):
+    async def scenario():
+        storage = Storage(tmp_path / "test.db")
+        await storage.open()
+        await subscribers(storage, 10)
+        b = Broadcaster(StubBot(lambda uid: BotBlocked("Forbidden: bot was blocked by the user")
+                                if uid % 2 else None), storage)
+        b.limiter = RateLimiter(1000)
+        bid = await b.start(from_chat_id=1, message_id=1)
+        await run_to_end(b)
+        row = await storage.run(broadcast._get, bid)
+        subscribed = await storage.run(
+            lambda conn: [r[0] for r in conn.execute("SELECT user_id FROM users WHERE subscribe_flag=1")])
+        await storage.close()
+        return row, subscribed
+
+    row, subscribed = asyncio.run(scenario())
+    assert (row["sent"], row["blocked"], row["failed"]) == (5, 5, 0)
+    assert subscribed == [2, 4, 6, 8, 10]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import asyncio
+
+import pytest
+
+import decks
+from decks import CARD_KEYS, Deck, DeckError, DeckRegistry
+
+
+def deck_data(cta="<b>Канал:</b> {channel_link}", lock_text="Следующая карта — через неделю. {owner}"):
+    return {"cta": cta, "lock_text": lock_text,
+            "topics": {"think": {"title": "Мысли", "cards": {k: f"Карта {k}" for k in CARD_KEYS}}}}
+
+
+@pytest.mark.parametrize("field", ["cta", "lock_text"])
+def test_stray_brace_is_deck_error(field):
+    data = deck_data()
+    data[field] += " {"
+    with pytest.raises(DeckError):
+        Deck(data, "https://t.me/c", "@owner")
+
+
+def broken_deck(*args):
+    raise RuntimeError("boom")
+
+
+def test_watcher_survives_bad_versions(tmp_path, monkeypatch):
+    path = tmp_path / "decks.json"
+    path.write_text(json.dumps(deck_data()), "utf-8")
+    registry = DeckRegistry(path, "https://t.me/c", "@owner", poll_interval=0.01)
+    registry.load()
+    first = registry.current
+
+    def write(data, mtime):
+        path.write_text(json.dumps(data), "utf-8")
+        # у быстрых записей подряд mtime может совпасть — задаём явно
+        os.utime(path, ns=(mtime, mtime))
+
+    async def scenario():
+        registry.start()
+        write(deck_data(cta="сломано {"), 1_000_000_000)
+        await asyncio.sleep(0.05)
+        assert registry.current is first
+
+        # непредусмотренная ошибка разбора тоже не останавливает слежение
+        real_deck = decks.Deck
+        monkeypatch.setattr(decks, "Deck", broken_deck)
+        write(deck_data(cta="тоже {channel_link}"), 2_000_000_000)
+        await asyncio.sleep(0.05)
+        assert registry.current is first
+        monkeypatch.setattr(decks, "Deck", real_deck)
+
+        write(deck_data(cta="исправлено {channel_link}"), 3_000_000_000)
+        await asyncio.sleep(0.05)
+        await registry.close()
+
+    asyncio.run(scenario())
+    assert registry.current is not first
+    assert registry.current.messages["think"]["1"].endswith("исправлено https://t.me/c")
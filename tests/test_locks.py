@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+import locks
+from locks import CardLocks
+from storage import Storage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = Storage(tmp_path / "test.db")
+    asyncio.run(s.open())
+    yield s
+    asyncio.run(s.close())
+
+
+def test_cache_is_bounded_and_evicted_users_stay_locked(storage):
+    async def scenario():
+        cl = CardLocks(storage, lock_days=7, max_size=100)
+        for uid in range(1, 301):
+            assert (await cl.try_acquire(uid))[0]
+        assert len(cl) == 100
+        # вытеснен из кэша, но замок в базе остался
+        ok, when = await cl.try_acquire(1)
+        assert not ok and when
+    asyncio.run(scenario())
+
+
+def test_expired_locks_are_dropped(storage, monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(locks.time, "time", lambda: now[0])
+
+    async def scenario():
+        cl = CardLocks(storage, lock_days=7)
+        for uid in range(1, 11):
+            assert (await cl.try_acquire(uid))[0]
+        assert len(cl) == 10
+        now[0] += cl.lock_seconds + 1
+        assert (await cl.try_acquire(11))[0]
+        assert len(cl) == 1
+        assert (await cl.try_acquire(1))[0]   # замок истёк — карта снова доступна
+    asyncio.run(scenario())
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.utils.exceptions import BadRequest, WrongFileIdentifier
+
+from media import MediaCache, _load_ids
+from storage import Storage
+
+
+class FakeMessage:
+    """answer_photo: по file_id — ошибка из очереди errors (или успех), загрузка — новый file_id."""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.uploads = 0
+
+    async def answer_photo(self, photo, **kwargs):
+        if isinstance(photo, str):
+            if self.errors:
+                raise self.errors.pop(0)
+            return SimpleNamespace(photo=[SimpleNamespace(file_id=photo)])
+        self.uploads += 1
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"id-{self.uploads}")])
+
+
+def run_sends(tmp_path, errors):
+    image = tmp_path / "welcome.jpg"
+    image.write_bytes(b"\xff\xd8 not really a jpeg")
+
+    async def scenario():
+        storage = Storage(tmp_path / "test.db")
+        await storage.open()
+        media = MediaCache(storage)
+        await media.load()
+        message = FakeMessage(errors)
+        try:
+            await media.send(message, image, caption="привет")   # первая загрузка
+            try:
+                await media.send(message, image, caption="привет")
+            finally:
+                ids = set((await storage.run(_load_ids)).values())
+        finally:
+            await storage.close()
+        return message, ids
+    return asyncio.run(scenario())
+
+
+def test_stale_file_id_is_reuploaded(tmp_path):
+    message, ids = run_sends(tmp_path, [WrongFileIdentifier("wrong file identifier/HTTP URL specified")])
+    assert message.uploads == 2
+    assert ids == {"id-2"}
+
+
+def test_other_bad_request_keeps_cached_id(tmp_path):
+    with pytest.raises(BadRequest):
+        run_sends(tmp_path, [BadRequest("Message caption is too long")])
+    message, ids = run_sends(tmp_path, [])
+    assert message.uploads == 0   # file_id из прошлого прогона остался в базе
+    assert ids == {"id-1"}
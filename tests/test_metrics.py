@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+from aiogram import Bot, Dispatcher, types
+
+import metrics
+from fake_telegram import make_message
+
+
+async def failing_handler(m: types.Message):
+    raise RuntimeError("boom")
+
+
+async def ok_handler(m: types.Message):
+    pass
+
+
+def test_handler_errors_are_labelled_by_handler():
+    async def scenario():
+        dp = Dispatcher(Bot("1:TEST"))
+        dp.middleware.setup(metrics.MetricsMiddleware())
+        dp.register_errors_handler(metrics._count_error)
+        dp.register_message_handler(failing_handler, commands=["fail"])
+        dp.register_message_handler(ok_handler)
+        Dispatcher.set_current(dp)
+
+        await dp.process_update(types.Update(**make_message(1, "/start")))
+        with pytest.raises(RuntimeError):
+            await dp.process_update(types.Update(**make_message(1, "/fail")))
+        await (await dp.bot.get_session()).close()
+
+    before = metrics.HANDLER_ERRORS._values.get(("failing_handler", "RuntimeError"), 0)
+    asyncio.run(scenario())
+    assert metrics.HANDLER_ERRORS._values[("failing_handler", "RuntimeError")] == before + 1
+    assert ("unknown", "RuntimeError") not in metrics.HANDLER_ERRORS._values
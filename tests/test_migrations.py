@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import json
+import asyncio
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import migrations
+from storage import Storage
+
+
+def make_baseline_db(path):
+    """Схема из самой первой версии бота: без subscribe_flag и consent_shown."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (
+            user_id        INTEGER PRIMARY KEY,
+            username       TEXT,
+            first_name     TEXT,
+            last_name      TEXT,
+            first_seen_ts  INTEGER,
+            last_seen_ts   INTEGER
+        );
+        CREATE TABLE events (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id     INTEGER,
+            event_type  TEXT,
+            ts          INTEGER,
+            meta        TEXT
+        );
+        INSERT INTO users VALUES (1, 'anna', 'Anna', NULL, 1700000000, 1700000100);
+        INSERT INTO users VALUES (2, NULL, 'Maria', NULL, 1700000200, 1700000300);
+        INSERT INTO events (user_id, event_type, ts, meta) VALUES (1, 'start', 1700000000, NULL);
+        INSERT INTO events (user_id, event_type, ts, meta) VALUES (1, 'card', 1700000100, 'think:3');
+    """)
+    conn.commit()
+    conn.close()
+
+
+def open_storage(path, usage_file=None):
+    async def scenario():
+        storage = Storage(path, usage_file=usage_file)
+        try:
+            await storage.open()
+        finally:
+            await storage.close()
+    asyncio.run(scenario())
+
+
+def test_upgrade_baseline_schema_with_usage_json(tmp_path):
+    db, usage = tmp_path / "subscribers.db", tmp_path / "usage.json"
+    make_baseline_db(db)
+    drawn = datetime(2025, 9, 29, 19, 15, 42)
+    usage.write_text(json.dumps({
+        "1": drawn.isoformat(),                          # самый старый формат — строка
+        "2": {"last_draw": drawn.isoformat()},
+        "oops": "не дата",
+    }), "utf-8")
+
+    open_storage(db, usage)
+
+    conn = sqlite3.connect(db)
+    try:
+        assert migrations.schema_version(conn) == migrations.LATEST
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        assert {"subscribe_flag", "consent_shown", "blocked_ts"} <= columns
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+        assert conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 2
+        locks = dict(conn.execute("SELECT user_id, last_draw FROM card_locks"))
+        assert locks == {1: int(drawn.timestamp()), 2: int(drawn.timestamp())}
+        # счётчики /stats пересчитаны по накопленным данным
+        assert dict(conn.execute("SELECT name, value FROM stats_totals"))["users"] == 2
+    finally:
+        conn.close()
+    assert not usage.exists()
+    assert (tmp_path / "usage.json.imported").exists()
+
+    # повторный старт ничего не меняет
+    conn = sqlite3.connect(db)
+    try:
+        assert migrations.migrate(conn) == 0
+    finally:
+        conn.close()
+
+
+def test_newer_schema_is_rejected(tmp_path):
+    db = tmp_path / "subscribers.db"
+    open_storage(db)
+    conn = sqlite3.connect(db)
+    conn.execute(f"PRAGMA user_version={migrations.LATEST + 1}")
+    conn.close()
+
+    with pytest.raises(RuntimeError, match="новее кода"):
+        open_storage(db)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+
+from aiogram import types
+
+from bench import load_bot
+from fake_telegram import FakeTelegram, make_callback
+
+USERS = range(1, 21)
+TAPS = 4
+
+
+def test_parallel_double_taps_give_one_card(tmp_path):
+    async def scenario():
+        fake = FakeTelegram(latency=0.005)
+        await fake.start()
+        bot = load_bot(fake.base_url, tmp_path)
+        app = bot.APPS[0]
+        await bot.on_startup()
+        # все тапы приходят разом, как при нетерпеливом двойном нажатии
+        for uid in USERS:
+            for _ in range(TAPS):
+                assert app.dp.scheduler.submit(types.Update(**make_callback(uid, "c:think:1")))
+        await app.dp.scheduler.close(timeout=10)
+        await bot.on_shutdown()
+        await fake.close()
+        return app
+
+    app = asyncio.run(scenario())
+    scheduler = app.dp.scheduler
+    assert scheduler.errors == 0
+    assert scheduler.processed == len(USERS) * TAPS
+
+    conn = sqlite3.connect(tmp_path / "bench.db")
+    try:
+        counts = dict(conn.execute(
+            "SELECT user_id, COUNT(*) FROM events WHERE event_type='card' GROUP BY user_id"))
+        locked = conn.execute("SELECT COUNT(*) FROM events WHERE event_type='card_locked'").fetchone()[0]
+    finally:
+        conn.close()
+    assert counts == {uid: 1 for uid in USERS}
+    # лишние тапы либо упёрлись в замок, либо отсеяны анти-флудом ещё до хэндлера
+    assert locked >= len(USERS)
+    assert locked + app.throttle.dropped == len(USERS) * (TAPS - 1)
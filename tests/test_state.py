@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from redis_state import RedisBackend
+from state import StateBackend
+from storage import Storage
+
+
+class Incomplete(StateBackend):
+    async def start_user(self, u) -> bool:
+        return True
+
+
+def test_incomplete_backend_fails_on_construction():
+    with pytest.raises(TypeError, match="abstract"):
+        Incomplete()
+
+
+def test_backends_implement_interface(tmp_path):
+    Storage(tmp_path / "test.db")
+    RedisBackend("redis://localhost", client=object())
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import sqlite3
+import time
+
+import stats
+from storage import Storage
+
+
+def outbound_heavy_rows(now: int) -> list[tuple[int, str, int, str | None]]:
+    """Один живой пользователь и рассылка с напоминаниями по 150 другим."""
+    rows = [(1, "start", now, None)]
+    rows += [(100 + i, "broadcast", now, "1:sent") for i in range(100)]
+    rows += [(300 + i, "reminder", now, "sent") for i in range(50)]
+    return rows
+
+
+def test_outbound_events_are_not_activity(tmp_path):
+    async def scenario():
+        storage = Storage(tmp_path / "test.db")
+        await storage.open()
+        try:
+            await storage.insert_events(outbound_heavy_rows(int(time.time())))
+            return await storage.stats_report()
+        finally:
+            await storage.close()
+
+    r = asyncio.run(scenario())
+    assert [r["active"][n] for n in stats.WINDOWS] == [1, 1, 1]
+    assert r["counts"][stats.WINDOWS[-1]]["start"] == 1
+
+
+def test_backfill_skips_outbound_events(tmp_path):
+    now = int(time.time())
+    conn = sqlite3.connect(tmp_path / "test.db")
+    conn.executescript("""
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, subscribe_flag INTEGER DEFAULT 0);
+        CREATE TABLE events (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+                             event_type TEXT, ts INTEGER, meta TEXT);
+        CREATE TABLE stats_daily (day TEXT, metric TEXT, key TEXT, value INTEGER,
+                                  PRIMARY KEY (day, metric, key));
+        CREATE TABLE user_activity (user_id INTEGER PRIMARY KEY, last_day TEXT, last_ts INTEGER);
+        CREATE TABLE stats_totals (name TEXT PRIMARY KEY, value INTEGER);
+    """)
+    conn.executemany("INSERT INTO events (user_id, event_type, ts, meta) VALUES (?,?,?,?)",
+                     outbound_heavy_rows(now))
+    stats.backfill(conn.cursor())
+
+    assert conn.execute("SELECT user_id FROM user_activity").fetchall() == [(1,)]
+    assert conn.execute("SELECT value FROM stats_daily WHERE metric='active'").fetchall() == [(1,)]
+    assert conn.execute("SELECT value FROM stats_daily WHERE metric='broadcast'").fetchall() == [(100,)]
+    conn.close()
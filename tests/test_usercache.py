@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from collections import Counter
+
+from aiogram import types
+
+from state import StateBackend
+from usercache import UserCache
+
+
+class CountingState(StateBackend):
+    """Ничего не хранит, только считает обращения."""
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def start_user(self, u) -> bool:
+        self.calls["start_user"] += 1
+        return True
+
+    async def upsert_user(self, u, subscribe_flag=None, consent_shown=None):
+        self.calls["upsert_user"] += 1
+
+    async def insert_events(self, rows):
+        self.calls["insert_events"] += 1
+
+    async def get_last_draw(self, user_id):
+        return None
+
+    async def try_lock_card(self, user_id, now, lock_seconds):
+        return True
+
+    async def import_locks(self, rows, lock_seconds):
+        pass
+
+    async def mark_update(self, update_id):
+        return True
+
+
+def test_burst_from_one_user_is_one_write():
+    async def scenario():
+        state = CountingState()
+        users = UserCache(state)
+        u = types.User(id=42, is_bot=False, first_name="u")
+        assert await users.start_user(u)
+        await asyncio.gather(*(users.touch(u) for _ in range(50)))
+        for _ in range(5):
+            assert not await users.start_user(u)
+        return state, users
+
+    state, users = asyncio.run(scenario())
+    assert users.writes == 1
+    assert sum(state.calls.values()) == 1
+    assert state.calls["start_user"] == 1
+
+
+def test_touch_writes_again_after_interval():
+    async def scenario():
+        state = CountingState()
+        users = UserCache(state, touch_interval=0)
+        u = types.User(id=42, is_bot=False, first_name="u")
+        await users.touch(u)
+        await users.touch(u)
+        return state
+    assert asyncio.run(scenario()).calls["upsert_user"] == 2
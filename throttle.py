@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Анти-флуд: token bucket на пользователя × правило.
+
+Правила задаются по префиксу callback_data («t:», «c:») и по тексту сообщения
+(«Моя тема», «/start»). Лишний callback получает пустой answer() — кнопка
+перестаёт «крутиться», — и дальше не идёт: ни замков, ни SQLite, ни LOCK_TEXT.
+Лишние сообщения просто отбрасываются.
+
+Вёдра живут в LRU: ведро, простоявшее дольше, чем нужно на полное
+восстановление, ничем не отличается от нового — его можно выбросить.
+Память зависит от числа активных сейчас пользователей, а не от всех.
+"""
+
+import time
+from collections import OrderedDict
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+Limit = tuple[float, float]    # (токенов в секунду, ёмкость ведра)
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    def __init__(self, callback_limits: dict[str, Limit] | None = None,
+                 message_limits: dict[str, Limit] | None = None,
+                 default_limit: Limit | None = None, max_buckets: int = 100_000):
+        super().__init__()
+        self.callback_limits = callback_limits or {}
+        self.message_limits = message_limits or {}
+        self.default_limit = default_limit
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[tuple[int, str], list[float]] = OrderedDict()   # → [токены, время]
+        # дольше этого ведро «полное» → можно забыть
+        limits = [*self.callback_limits.values(), *self.message_limits.values()]
+        if default_limit:
+            limits.append(default_limit)
+        self._idle = max((burst / rate for rate, burst in limits), default=60.0)
+
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _evict(self, now: float):
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if now - bucket[1] < self._idle and len(self._buckets) <= self.max_buckets:
+                break
+            self._buckets.popitem(last=False)
+
+    def allow(self, user_id: int, rule: str, limit: Limit) -> bool:
+        """Взять токен из ведра (user_id, rule). False — лимит исчерпан."""
+        rate, burst = limit
+        now = time.monotonic()
+        key = (user_id, rule)
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        self._buckets[key] = bucket   # в конец LRU
+        self._evict(now)
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        self.dropped += 1
+        return False
+
+    def _callback_rule(self, data: str) -> tuple[str, Limit] | None:
+        for prefix, limit in self.callback_limits.items():
+            if data.startswith(prefix):
+                return prefix, limit
+        return ("*", self.default_limit) if self.default_limit else None
+
+    def _message_rule(self, text: str) -> tuple[str, Limit] | None:
+        key = text.split()[0] if text.startswith("/") else text
+        if key in self.message_limits:
+            return key, self.message_limits[key]
+        return ("*", self.default_limit) if self.default_limit else None
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        rule = self._callback_rule(call.data or "")
+        if rule and not self.allow(call.from_user.id, f"cb:{rule[0]}", rule[1]):
+            await call.answer()
+            raise CancelHandler()
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        rule = self._message_rule(message.text or "")
+        if rule and message.from_user and not self.allow(message.from_user.id, f"msg:{rule[0]}", rule[1]):
+            raise CancelHandler()
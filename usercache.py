@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш состояния пользователей перед таблицей users.
+
+- флаги (subscribe_flag, consent_shown) помнятся в памяти: повторный /start
+  с тем же состоянием в базу не ходит; запись флагов — сразу в базу (write-through);
+- last_seen_ts пишется не чаще раза в touch_interval секунд на пользователя —
+  серия нажатий одного пользователя даёт одну запись в базу;
+- LRU на max_size пользователей + TTL: после ttl секунд флаги перечитываются
+  (их может поменять рассылка или другой процесс).
+"""
+
+import time
+from collections import OrderedDict
+
+from state import StateBackend
+
+
+class _Entry:
+    __slots__ = ("subscribe_flag", "consent_shown", "loaded_at", "seen_written")
+
+    def __init__(self, now: float):
+        self.subscribe_flag: int | None = None
+        self.consent_shown: int | None = None
+        self.loaded_at = now
+        self.seen_written = 0.0
+
+
+class UserCache:
+    def __init__(self, state: StateBackend, max_size: int = 50_000,
+                 ttl: float = 600.0, touch_interval: float = 60.0):
+        self.state = state
+        self.max_size = max_size
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+
+        # счётчики для метрик
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry(self, user_id: int) -> _Entry:
+        """Запись из кэша (свежая) или новая пустая; поднимает её в LRU."""
+        now = time.monotonic()
+        e = self._entries.get(user_id)
+        if e is None or now - e.loaded_at > self.ttl:
+            e = _Entry(now)
+            self._entries[user_id] = e
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(user_id)
+        return e
+
+    async def touch(self, u):
+        """Обновить last_seen_ts — но не чаще раза в touch_interval."""
+        e = self._entry(u.id)
+        now = time.monotonic()
+        if now - e.seen_written < self.touch_interval:
+            self.coalesced += 1
+            return
+        e.seen_written = now   # до await: параллельные касания уже не пойдут в базу
+        self.writes += 1
+        await self.state.upsert_user(u)
+
+    async def set_flags(self, u, subscribe_flag: int | None = None, consent_shown: int | None = None):
+        """Изменение флагов — сразу в базу (вместе с last_seen_ts)."""
+        e = self._entry(u.id)
+        e.seen_written = time.monotonic()
+        self.writes += 1
+        await self.state.upsert_user(u, subscribe_flag=subscribe_flag, consent_shown=consent_shown)
+        if subscribe_flag is not None:
+            e.subscribe_flag = int(subscribe_flag)
+        if consent_shown is not None:
+            e.consent_shown = int(consent_shown)
+
+    async def start_user(self, u) -> bool:
+        """
+        /start: subscribe_flag=0, consent_shown=1, last_seen_ts. Если в кэше
+        уже ровно это состояние и last_seen свежий — в базу не ходим.
+        Возвращает True, если приглашение к рассылке нужно показать.
+        """
+        e = self._entry(u.id)
+        now = time.monotonic()
+        if (e.subscribe_flag, e.consent_shown) == (0, 1) and now - e.seen_written < self.touch_interval:
+            self.hits += 1
+            self.coalesced += 1
+            return False
+        self.misses += 1
+        self.writes += 1
+        e.seen_written = now
+        show_consent = await self.state.start_user(u)
+        e.subscribe_flag, e.consent_shown = 0, 1
+        return show_consent
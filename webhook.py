@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Режим webhook: aiohttp-сервер принимает апдейты от Telegram.
+
+- проверяем секрет из заголовка X-Telegram-Bot-Api-Secret-Token;
+- отвечаем Telegram 200 сразу, а апдейт уходит планировщику (scheduler.py):
+  очередь по пользователю, общий лимит параллельности, отсев повторов;
+- очередь полна — отвечаем 503, Telegram доставит апдейт позже;
+- при остановке ждём незавершённые хэндлеры (не дольше DRAIN_TIMEOUT);
+- несколько ботов в одном процессе — один сервер, у каждого свой путь (tenants.py).
+"""
+
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import Dispatcher, types
+
+from scheduler import UpdateScheduler
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DRAIN_TIMEOUT = 10.0
+
+
+def add_route(app: web.Application, dp: Dispatcher, path: str, secret: str | None = None):
+    """Маршрут POST path → dp (через dp.scheduler, если он есть); при остановке — дождаться его очереди."""
+    scheduler = getattr(dp, "scheduler", None) or UpdateScheduler(dp)
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            update = types.Update(**(await request.json()))
+        except (ValueError, TypeError):
+            return web.Response(status=400)
+
+        if not scheduler.submit(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def drain(app: web.Application):
+        await scheduler.close(DRAIN_TIMEOUT)
+
+    app.router.add_post(path, handle)
+    app.on_shutdown.append(drain)
+
+
+def start_webhook(routes: list[tuple[Dispatcher, str, str]], *, secret: str | None,
+                  host: str, port: int, on_startup=None, on_shutdown=None, skip_updates: bool = True):
+    """
+    Блокирующий запуск, аналог executor.start_polling для webhook.
+    routes — (dp, webhook_url, path) для каждого бота; on_startup/on_shutdown — без аргументов.
+    """
+    app = web.Application()
+    for dp, _, path in routes:
+        add_route(app, dp, path, secret)
+
+    async def _startup(app: web.Application):
+        if on_startup:
+            await on_startup()
+        for dp, webhook_url, path in routes:
+            await dp.bot.set_webhook(webhook_url, secret_token=secret, drop_pending_updates=skip_updates)
+            log.info("webhook: слушаю %s:%s%s → %s", host, port, path, webhook_url)
+
+    async def _cleanup(app: web.Application):
+        if on_shutdown:
+            await on_shutdown()
+        for dp, _, _ in routes:
+            await dp.storage.close()
+            await dp.storage.wait_closed()
+
+    app.on_startup.append(_startup)
+    app.on_cleanup.append(_cleanup)
+    web.run_app(app, host=host, port=port, print=None)